@@ -0,0 +1,97 @@
+# Пакетный расчет прайс-листа: скалярный calculate_quote в цикле против calculate_batch.
+#
+#   python benchmarks/bench_batch_tariffs.py --rows 50000
+#
+# Перед замером проверяется, что результаты обоих вариантов совпадают точно.
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from tariffs import ENGINE_ELECTRIC, calculate_batch, calculate_quote
+
+COLUMNS = ('duty', 'excise', 'vat', 'recycling', 'total')
+
+
+def make_price_list(rows: int, seed: int = 42) -> dict:
+    rng = np.random.default_rng(seed)
+    engine_type = rng.integers(0, 3, rows)
+    return {
+        'price_cny': rng.uniform(20000, 2000000, rows).round(0),
+        'age_months': rng.integers(0, 120, rows),
+        # Включаем точные значения границ, чтобы проверить условия "<="
+        'engine_volume_cc': rng.choice([998, 1000, 1001, 1500, 1598, 1800, 1998, 2000, 2300, 2500,
+                                        3000, 3001, 3500, 3600, 4400], rows),
+        'power': np.where(engine_type == ENGINE_ELECTRIC,
+                          rng.choice([50, 66.19, 90, 110.33, 150, 220, 300, 420, 600], rows),
+                          rng.integers(70, 600, rows)).astype(np.float64),
+        'engine_type': engine_type,
+        'is_individual': rng.random(rows) < 0.7,
+        'is_personal_use': rng.random(rows) < 0.8,
+    }
+
+
+def scalar(price_list: dict, cny_rate: float, eur_rate: float) -> dict:
+    result = {column: [] for column in COLUMNS}
+    for i in range(len(price_list['price_cny'])):
+        is_individual = bool(price_list['is_individual'][i])
+        quote = calculate_quote(
+            float(price_list['price_cny'][i]),
+            int(price_list['age_months'][i]),
+            int(price_list['engine_volume_cc'][i]),
+            float(price_list['power'][i]),
+            int(price_list['engine_type'][i]) == ENGINE_ELECTRIC,
+            is_individual,
+            # Как в боте: юрлицо всегда считается "не для личного пользования"
+            is_individual and bool(price_list['is_personal_use'][i]),
+            cny_rate,
+            eur_rate
+        )
+        for column in COLUMNS:
+            result[column].append(quote[column])
+    return result
+
+
+def batch(price_list: dict, cny_rate: float, eur_rate: float) -> dict:
+    return calculate_batch(
+        price_list['price_cny'], price_list['age_months'], price_list['engine_volume_cc'],
+        price_list['power'], price_list['engine_type'], price_list['is_individual'],
+        price_list['is_individual'] & price_list['is_personal_use'], cny_rate, eur_rate
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--cny', type=float, default=11.23)
+    parser.add_argument('--eur', type=float, default=95.1)
+    args = parser.parse_args()
+
+    price_list = make_price_list(args.rows)
+
+    started = time.perf_counter()
+    expected = scalar(price_list, args.cny, args.eur)
+    scalar_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    actual = batch(price_list, args.cny, args.eur)
+    batch_time = time.perf_counter() - started
+
+    for column in COLUMNS:
+        mismatches = np.flatnonzero(np.asarray(expected[column], dtype=np.float64) != actual[column])
+        if len(mismatches):
+            i = mismatches[0]
+            raise SystemExit(f"Расхождение в {column}, строка {i}: {expected[column][i]!r} != {actual[column][i]!r}")
+
+    print(f"Строк: {args.rows}, результаты совпадают точно")
+    print(f"calculate_quote в цикле: {scalar_time * 1000:9.1f} мс")
+    print(f"calculate_batch:         {batch_time * 1000:9.1f} мс")
+    print(f"Ускорение:               {scalar_time / batch_time:9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# Пропускная способность рассылки против локального Bot API с лимитами Telegram
+# (30 сообщений/с на бота, ~1 сообщение/с на чат).
+#
+#   python benchmarks/bench_broadcast.py --users 1500 --blocked 0.05
+#
+# Реестр заполняется --users пользователями, часть из них заблокировала бота.
+# Рассылка прерывается на середине (как при падении процесса) и продолжается
+# с контрольной точки новым экземпляром BroadcastRunner. Проверяется темп,
+# число ответов 429, повторные доставки и пометка заблокировавших.
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from broadcast import BroadcastRunner
+from fake_telegram import FakeTelegramServer
+from send_scheduler import SendScheduler, SendSchedulerMiddleware
+from users import UserRegistry
+
+
+def make_bot(server: FakeTelegramServer, global_rate: float) -> Bot:
+    bot = Bot("123456:BENCH-TOKEN", session=AiohttpSession(api=TelegramAPIServer.from_base(server.base_url)))
+    bot.session.middleware(SendSchedulerMiddleware(SendScheduler(global_rate=global_rate)))
+    return bot
+
+
+async def run(server: FakeTelegramServer, registry: UserRegistry, args):
+    delivered = Counter()
+    server.on_send = lambda at, method, chat_id, params: delivered.update([chat_id])
+
+    # Первый запуск прерывается после --crash-after секунд
+    bot = make_bot(server, args.global_rate)
+    runner = BroadcastRunner(bot, registry, concurrency=args.concurrency, page_size=args.page_size)
+    job_id = runner.create("Рассылка: курс юаня изменился", audience="all")
+    started = time.perf_counter()
+    task = runner.start(job_id)
+    await asyncio.sleep(args.crash_after)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    checkpoint = runner.job(job_id)
+    await runner.close()
+    await bot.session.close()
+    print(f"Прервано через {args.crash_after:.0f} с: контрольная точка chat_id={checkpoint['cursor']}, "
+          f"отправлено {checkpoint['sent']}, доставлено фактически {sum(delivered.values())}")
+
+    # Новый процесс продолжает задание
+    bot = make_bot(server, args.global_rate)
+    runner = BroadcastRunner(bot, registry, concurrency=args.concurrency, page_size=args.page_size)
+    resumed = await runner.resume()
+    await asyncio.gather(*(runner.start(job_id) for job_id in resumed))
+    elapsed = time.perf_counter() - started
+    job = runner.job(job_id)
+    await runner.close()
+    await bot.session.close()
+
+    duplicates = sum(count - 1 for count in delivered.values() if count > 1)
+    total = sum(delivered.values())
+    print(f"Продолжено: задания {resumed}, статус {job['status']}")
+    print(f"\nДоставлено: {len(delivered)} пользователей ({total} сообщений, повторов {duplicates})")
+    print(f"Заблокировали бота: {job['blocked']}, ошибок: {job['failed']}, ответов 429: {server.calls['429']}")
+    print(f"Время: {elapsed:.1f} с (с перезапуском), темп: {total / elapsed:.1f} сообщений/с "
+          f"при лимите {args.global_rate:.0f}")
+    print(f"Реестр после рассылки: {registry.stats()}")
+
+    # Повторная рассылка уже не тратит запросы на заблокировавших
+    server.calls.clear()
+    delivered.clear()
+    bot = make_bot(server, args.global_rate)
+    runner = BroadcastRunner(bot, registry, concurrency=args.concurrency, page_size=args.page_size)
+    job = await runner.run(runner.create("Повторная рассылка", audience="all"))
+    await runner.close()
+    await bot.session.close()
+    print(f"Повторная рассылка: отправлено {job['sent']}, ответов 403: {server.calls['403']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1500)
+    parser.add_argument("--blocked", type=float, default=0.05, help="доля заблокировавших бота")
+    parser.add_argument("--concurrency", type=int, default=30)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--global-rate", type=float, default=30)
+    parser.add_argument("--crash-after", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8083)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    server = FakeTelegramServer(port=args.port, rate_limits=(30, 1, 3))
+    random.seed(1)
+    chat_ids = random.sample(range(10 ** 6, 10 ** 10), args.users)
+    server.blocked_chats = set(random.sample(chat_ids, int(args.users * args.blocked)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = UserRegistry(os.path.join(tmp, "users.sqlite3"))
+        for chat_id in chat_ids:
+            registry.touch(chat_id, chat_id)
+        server.start()
+        try:
+            print(f"Пользователей: {args.users}, заблокировали бота: {len(server.blocked_chats)}\n")
+            asyncio.run(run(server, registry, args))
+        finally:
+            server.stop()
+            registry.close()
+
+
+if __name__ == "__main__":
+    main()
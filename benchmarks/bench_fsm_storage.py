@@ -0,0 +1,121 @@
+# Сравнение задержки одного шага анкеты Form для разных хранилищ FSM.
+#
+#   python benchmarks/bench_fsm_storage.py --users 200
+#   python benchmarks/bench_fsm_storage.py --redis-url redis://127.0.0.1:6379/0
+#
+# Без --redis-url хранилище redis:// проверяется на локальной замене Redis
+# (fake_redis.py), если установлен пакет redis. Замеры на замене показывают
+# накладные расходы клиента и протокола, а не скорость настоящего Redis.
+#
+# Шаг анкеты повторяет то, что делает бот на каждое сообщение: чтение
+# состояния (FSMContextMiddleware), update_data и set_state в обработчике.
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiogram import Bot
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from fake_redis import FakeRedisServer
+from storage import BufferedStorage, SQLiteStorage, StorageBatchMiddleware, create_storage
+
+STEPS = [
+    ("Form:year_month", {"price": 150000.0}),
+    ("Form:engine_type", {"year_month": [2021.0, 5.0], "age_months": 65}),
+    ("Form:engine_volume", {"engine_type": "🛢️ Бензиновый"}),
+    ("Form:engine_power", {"engine_volume_cc": 2000}),
+    ("Form:importer_type", {"engine_power": 150.0}),
+    ("Form:personal_use", {"importer_type": True}),
+]
+
+# RedisStorage сериализует данные через bot.session; запросов к API нет
+BOT = Bot("123456:BENCH-TOKEN")
+
+
+async def run_step(storage, key, state, update):
+    await storage.get_state(bot=BOT, key=key)
+    await storage.update_data(bot=BOT, key=key, data=update)
+    await storage.set_state(bot=BOT, key=key, state=state)
+
+
+async def bench(name, storage, users):
+    middleware = StorageBatchMiddleware(storage) if isinstance(storage, BufferedStorage) else None
+    latencies = []
+
+    for user_id in range(1, users + 1):
+        key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+        for state, update in STEPS:
+            started = time.perf_counter()
+            if middleware is None:
+                await run_step(storage, key, state, update)
+            else:
+                async def handler(event, data):
+                    await run_step(storage, key, state, update)
+                await middleware(handler, None, {"bot": BOT})
+            latencies.append((time.perf_counter() - started) * 1e6)
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f"{name:<28} steps={len(latencies):<6} mean={statistics.mean(latencies):8.1f} мкс  "
+          f"p50={p50:8.1f} мкс  p99={p99:8.1f} мкс")
+    await storage.close()
+
+
+# Анкета, начатая через одно подключение, видна через другое (как у двух копий
+# бота), а брошенная истекает через ttl
+async def check_shared(name, url, ttl=1):
+    first, second = create_storage(url, ttl=ttl), create_storage(url, ttl=ttl)
+    key = StorageKey(bot_id=1, chat_id=-1, user_id=-1)
+    await first.set_state(bot=BOT, key=key, state="Form:engine_power")
+    await first.set_data(bot=BOT, key=key, data={"price": 150000.0})
+    shared = (await second.get_state(bot=BOT, key=key), await second.get_data(bot=BOT, key=key))
+    await asyncio.sleep(ttl + 0.1)
+    expired = await second.get_state(bot=BOT, key=key)
+    print(f"{name:<28} общая анкета: {shared}, после ttl: {expired}")
+    await first.close()
+    await second.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--redis-url", default=os.getenv("BENCH_REDIS_URL"))
+    args = parser.parse_args()
+
+    fake_redis = None
+    if not args.redis_url:
+        try:
+            import redis  # noqa: F401
+        except ImportError:
+            print("Пакет redis не установлен, хранилище redis:// не проверяется")
+        else:
+            fake_redis = FakeRedisServer()
+            fake_redis.start()
+            args.redis_url = fake_redis.url
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            await bench("memory", MemoryStorage(), args.users)
+            await bench("sqlite (без пакетов)", SQLiteStorage(os.path.join(tmp, "plain.sqlite3")), args.users)
+            await bench("sqlite (пакет на шаг)", create_storage(f"sqlite:///{tmp}/batched.sqlite3"), args.users)
+            await check_shared("sqlite", f"sqlite:///{tmp}/shared.sqlite3")
+            if args.redis_url:
+                name = "redis (замена, пакет на шаг)" if fake_redis else "redis (пакет на шаг)"
+                await bench(name, create_storage(args.redis_url), args.users)
+                await check_shared("redis", args.redis_url)
+    finally:
+        if fake_redis is not None:
+            fake_redis.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+# Сколько event loop простаивает на одном вызове logger.info:
+# прежний basicConfig (FileHandler + StreamHandler) против QueueHandler/QueueListener.
+#
+#   python benchmarks/bench_logging.py --calls 20000
+#   python benchmarks/bench_logging.py --write-latency 0.002   # медленный диск / stdout
+#
+# --write-latency добавляет задержку к каждой записи в поток, имитируя
+# перегруженный диск или заблокированный pipe логов контейнера.
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logging_setup import setup_logging, stop_listener
+
+DATA = {"price": 150000.0, "year_month": [2021.0, 5.0], "age_months": 65,
+        "engine_type": "🛢️ Бензиновый", "engine_volume_cc": 2000, "engine_power": 150.0}
+
+
+class SlowStream:
+    def __init__(self, stream, latency: float):
+        self.stream = stream
+        self.latency = latency
+
+    def write(self, text):
+        time.sleep(self.latency)
+        return self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def measure(logger, calls: int):
+    stalls = []
+    for i in range(calls):
+        started = time.perf_counter()
+        logger.info(f"Начало расчета для данных: {DATA}")
+        stalls.append(time.perf_counter() - started)
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+    return stalls
+
+
+def reset_root():
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+
+def slow_down(handlers, latency):
+    if latency:
+        for handler in handlers:
+            if handler.stream is None:
+                handler.stream = handler._open()
+            handler.setStream(SlowStream(handler.stream, latency))
+
+
+def report(name, stalls, elapsed):
+    print(f"{name:<12}{percentile(stalls, 0.5) * 1e6:>10.1f}{percentile(stalls, 0.99) * 1e6:>10.1f}"
+          f"{max(stalls) * 1e6:>12.1f}{sum(stalls) / len(stalls) * 1e6:>10.1f}{elapsed:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--write-latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    logger = logging.getLogger("bench")
+    calls = args.calls if not args.write_latency else min(args.calls, 2000)
+    print(f"Вызовов logger.info: {calls}, задержка записи: {args.write_latency * 1000:.1f} мс\n")
+    print(f"{'режим':<12}{'p50, мкс':>10}{'p99, мкс':>10}{'max, мкс':>12}{'avg, мкс':>10}{'всего, с':>10}")
+
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+        # Прежняя схема: форматирование и запись прямо в event loop
+        reset_root()
+        file_handler = logging.FileHandler(os.path.join(tmp, "blocking.log"), encoding="utf-8")
+        stream_handler = logging.StreamHandler(devnull)
+        slow_down([file_handler, stream_handler], args.write_latency)
+        logging.basicConfig(level=logging.INFO, handlers=[file_handler, stream_handler],
+                            format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        started = time.perf_counter()
+        stalls = asyncio.run(measure(logger, calls))
+        report("basicConfig", stalls, time.perf_counter() - started)
+        reset_root()
+
+        # Очередь: в event loop только QueueHandler.prepare и put в очередь
+        for fmt in ("text", "json"):
+            listener = setup_logging(path=os.path.join(tmp, f"queue-{fmt}.log"), fmt=fmt)
+            listener.handlers[0].setStream(devnull)
+            slow_down(listener.handlers, args.write_latency)
+            started = time.perf_counter()
+            stalls = asyncio.run(measure(logger, calls))
+            report(f"queue/{fmt}", stalls, time.perf_counter() - started)
+            stop_listener(listener)
+            reset_root()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# Проверка планировщика отправки против локального Bot API с лимитами Telegram:
+# общий лимит 30 сообщений/с и ~1 сообщение/с на чат (серия до 3 сообщений).
+#
+#   python benchmarks/bench_send_scheduler.py --chats 100 --broadcast 300
+#
+# Нагрузка: рассылка на --broadcast чатов и одновременно --chats пользователей,
+# каждый получает результат расчета (3 сообщения подряд) и еще одно сообщение
+# следом. Сравнивается прямая отправка и отправка через SendScheduler.
+#
+#   python benchmarks/bench_send_scheduler.py --chats 30 --broadcast 60 --check
+#
+# С --check прямая отправка пропускается, а отправка через SendScheduler
+# проверяется: все доставлено без 429, в чат не больше серии сообщений за
+# интервал лимита, ответы пользователям уходят раньше конца рассылки.
+# При нарушении скрипт завершается с ненулевым кодом.
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+
+from fake_telegram import FakeTelegramServer
+from send_scheduler import PRIORITY_BROADCAST, SendScheduler, SendSchedulerMiddleware, priority
+
+RATE_LIMITS = (30, 1, 3)
+BROADCAST_CHAT = 500000
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(server: FakeTelegramServer, args, scheduled: bool):
+    server.calls.clear()
+    server._chat_tokens.clear()
+    server._sent_at.clear()
+    delivered = defaultdict(list)
+    server.on_send = lambda at, method, chat_id, params: delivered[chat_id].append(at)
+
+    bot = Bot("123456:BENCH-TOKEN", session=AiohttpSession(api=TelegramAPIServer.from_base(server.base_url)))
+    if scheduled:
+        bot.session.middleware(SendSchedulerMiddleware(SendScheduler(global_rate=args.global_rate)))
+
+    failed = 0
+    interactive = []
+    broadcast_done = []
+
+    async def send(chat_id, text):
+        nonlocal failed
+        try:
+            await bot.send_message(chat_id, text)
+            return True
+        except TelegramRetryAfter:
+            failed += 1
+            return False
+
+    async def user(chat_id):
+        await asyncio.sleep(chat_id % 100 / 100)
+        started = time.perf_counter()
+        for part in ("Результат расчета", "Логотип", "Выберите действие:", "Курсы валют"):
+            await send(chat_id, part)
+        interactive.append(time.perf_counter() - started)
+
+    async def broadcast():
+        started = time.perf_counter()
+        with priority(PRIORITY_BROADCAST):
+            await asyncio.gather(*(send(BROADCAST_CHAT + i, "Рассылка: курсы обновлены") for i in range(args.broadcast)))
+        broadcast_done.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(broadcast(), *(user(100000 + i) for i in range(args.chats)))
+    elapsed = time.perf_counter() - started
+    await bot.session.close()
+
+    total = args.broadcast + args.chats * 4
+    name = "SendScheduler" if scheduled else "напрямую"
+    print(f"{name:<14}{total - failed:>10}{failed:>8}{server.calls['429']:>8}{elapsed:>9.1f}"
+          f"{percentile(interactive, 0.5):>10.2f}{percentile(interactive, 0.95):>10.2f}"
+          f"{broadcast_done[0]:>12.1f}")
+    return {'total': total, 'failed': failed, 'delivered': delivered}
+
+
+# Нарушения лимитов и приоритетов при отправке через SendScheduler
+def check(server: FakeTelegramServer, result: dict) -> list:
+    _, chat_rate, chat_burst = RATE_LIMITS
+    delivered = result['delivered']
+    problems = []
+    if result['failed'] or server.calls['429']:
+        problems.append(f"ошибок: {result['failed']}, ответов 429: {server.calls['429']}")
+    count = sum(map(len, delivered.values()))
+    if count != result['total']:
+        problems.append(f"доставлено {count} из {result['total']}")
+
+    # По GCRA сообщение номер j + серия уходит не раньше чем через интервал после j-го
+    for chat_id, times in delivered.items():
+        times.sort()
+        gaps = [later - earlier for earlier, later in zip(times, times[chat_burst:])]
+        if gaps and min(gaps) < 1 / chat_rate - 0.05:
+            problems.append(f"чат {chat_id}: {chat_burst + 1} сообщения за {min(gaps):.2f} с")
+
+    interactive = [at for chat_id, times in delivered.items() if chat_id < BROADCAST_CHAT for at in times]
+    broadcast = [at for chat_id, times in delivered.items() if chat_id >= BROADCAST_CHAT for at in times]
+    if interactive and broadcast and max(interactive) >= max(broadcast):
+        problems.append(f"ответы пользователям закончились на {max(interactive) - max(broadcast):.2f} с "
+                        f"позже рассылки")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--broadcast", type=int, default=300)
+    parser.add_argument("--global-rate", type=float, default=30)
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+    logging.getLogger("send_scheduler").setLevel(logging.ERROR)
+
+    server = FakeTelegramServer(port=args.port, rate_limits=RATE_LIMITS)
+    server.start()
+    try:
+        print(f"Пользователей: {args.chats} (по 4 сообщения), рассылка: {args.broadcast} сообщений\n")
+        print(f"{'режим':<14}{'доставлено':>10}{'ошибок':>8}{'429':>8}{'время, с':>9}"
+              f"{'p50, с':>10}{'p95, с':>10}{'рассылка, с':>12}")
+        if not args.check:
+            asyncio.run(run(server, args, scheduled=False))
+        result = asyncio.run(run(server, args, scheduled=True))
+    finally:
+        server.stop()
+
+    if args.check:
+        problems = check(server, result)
+        for problem in problems:
+            print(f"ОШИБКА: {problem}")
+        if problems:
+            sys.exit(1)
+        print("\nПроверка пройдена")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# Стоимость выбора обработчика для текстового сообщения: прежняя цепочка
+# фильтров lambda m: m.text == "..." против TextRouter (поиск в словаре).
+#
+#   python benchmarks/bench_text_router.py --updates 3000
+#
+# Оба диспетчера повторяют порядок обработчиков бота (команды, кнопки меню,
+# шаги анкеты, документы, "Очистить чат", обработчик по умолчанию), обработчики
+# ничего не отправляют, поэтому замеряется только работа aiogram и фильтров.
+# Синхронные фильтры (lambda и состояние анкеты напрямую, Form.price) aiogram
+# выполняет в пуле потоков, отсюда основная разница.
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher
+from aiogram.filters import Command, StateFilter
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import Chat, Message, Update, User
+
+from text_router import Keyboard, TextRouter
+
+MENU = (
+    ("START", "start"),
+    ("🚗 Рассчитать стоимость авто", "calculate"),
+    ("📊 Курсы валют", "rates"),
+    ("📜 История расчетов", "history"),
+    ("ℹ️ О боте", "about"),
+)
+TEXTS = (
+    ("START", "первая кнопка"),
+    ("ℹ️ О боте", "последняя кнопка"),
+    ("привет", "нет совпадений"),
+)
+
+
+class Form(StatesGroup):
+    price = State()
+    year_month = State()
+    engine_type = State()
+    engine_volume = State()
+    engine_power = State()
+    importer_type = State()
+    personal_use = State()
+
+
+def make_handler(name: str, handled: list):
+    async def handler(message: Message):
+        handled.append(name)
+    handler.__name__ = name
+    return handler
+
+
+def register_common(dp: Dispatcher, handled: list):
+    for command in ("start", "alerts", "calc"):
+        dp.message.register(make_handler(command, handled), Command(command))
+
+
+def register_steps(dp: Dispatcher, handled: list, sync_filters: bool):
+    for state in Form.__states__:
+        dp.message.register(make_handler(state.state, handled), state if sync_filters else StateFilter(state))
+
+
+def register_tail(dp: Dispatcher, handled: list, sync_filters: bool):
+    if sync_filters:
+        dp.message.register(make_handler("document", handled), lambda m: m.document is not None)
+        dp.message.register(make_handler("clean", handled), lambda m: m.text == "Очистить чат" or m.text == "/clean")
+    else:
+        async def has_document(message: Message) -> bool:
+            return message.document is not None
+
+        async def is_clean_command(message: Message) -> bool:
+            return message.text == "Очистить чат" or message.text == "/clean"
+
+        dp.message.register(make_handler("document", handled), has_document)
+        dp.message.register(make_handler("clean", handled), is_clean_command)
+    dp.message.register(make_handler("unknown", handled))
+
+
+def chain_dispatcher(handled: list) -> Dispatcher:
+    dp = Dispatcher()
+    register_common(dp, handled)
+    for text, action in MENU[:2]:
+        dp.message.register(make_handler(action, handled), lambda m, text=text: m.text == text)
+    register_steps(dp, handled, sync_filters=True)
+    for text, action in MENU[2:]:
+        dp.message.register(make_handler(action, handled), lambda m, text=text: m.text == text)
+    register_tail(dp, handled, sync_filters=True)
+    return dp
+
+
+def router_dispatcher(handled: list) -> Dispatcher:
+    dp = Dispatcher()
+    router = TextRouter()
+    router.include(Keyboard([[button] for button in MENU]))
+    for _, action in MENU:
+        router.action(action, any_state=action in ("start", "calculate"))(make_handler(action, handled))
+    router.validate()
+    register_common(dp, handled)
+    dp.message.register(router.dispatch, router)
+    register_steps(dp, handled, sync_filters=False)
+    register_tail(dp, handled, sync_filters=False)
+    return dp
+
+
+def make_update(update_id: int, text: str) -> Update:
+    user = User(id=update_id % 1000 + 1, is_bot=False, first_name="Bench")
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.now(), text=text,
+        chat=Chat(id=user.id, type="private"), from_user=user
+    ))
+
+
+async def measure(dp: Dispatcher, bot: Bot, text: str, updates: int) -> float:
+    batch = [make_update(i, text) for i in range(updates)]
+    started = time.perf_counter()
+    for update in batch:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / updates * 1e6
+
+
+async def run(args):
+    bot = Bot("123456:BENCH-TOKEN")
+    print(f"{'Текст':<30} {'цепочка, мкс':>14} {'TextRouter, мкс':>16} {'ускорение':>10}  обработчик")
+    for text, description in TEXTS:
+        handled_chain, handled_router = [], []
+        chain = chain_dispatcher(handled_chain)
+        router = router_dispatcher(handled_router)
+        # Прогрев и проверка, что оба варианта выбирают один обработчик
+        await measure(chain, bot, text, 50)
+        await measure(router, bot, text, 50)
+        assert set(handled_chain) == set(handled_router), (handled_chain[:1], handled_router[:1])
+        chain_us = await measure(chain, bot, text, args.updates)
+        router_us = await measure(router, bot, text, args.updates)
+        print(f"{text + ' (' + description + ')':<30} {chain_us:>14.1f} {router_us:>16.1f} "
+              f"{chain_us / router_us:>9.1f}x  {handled_router[-1]}")
+    await bot.session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=3000)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# Локальная замена Redis для проверки хранилища FSM_STORAGE=redis://.
+#
+# Сервер говорит по протоколу RESP2 и поддерживает команды, которыми
+# пользуется RedisStorage aiogram: GET, SET (EX/PX/NX/XX), DEL, EXISTS, а также
+# PING, SELECT и CLIENT, которые redis-py отправляет при подключении.
+# Истекшие ключи удаляются при обращении, как в Redis. Работает в отдельном
+# потоке со своим event loop, как FakeTelegramServer.
+import asyncio
+import threading
+import time
+from collections import Counter
+
+
+class FakeRedisServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 6390):
+        self.host = host
+        self.port = port
+        self.calls = Counter()
+        self._data = {}
+        self._expires = {}
+
+        self._loop = None
+        self._thread = None
+        self._server = None
+        self._clients = set()
+        self._tasks = set()
+        self._started = threading.Event()
+
+    @property
+    def url(self) -> str:
+        return f"redis://{self.host}:{self.port}/0"
+
+    # ===== Управление из основного потока =====
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="fake-redis", daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    # Открытые подключения закрываются, и их обработчики завершаются сами
+    async def _shutdown(self):
+        self._server.close()
+        for writer in list(self._clients):
+            writer.transport.abort()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._server.wait_closed()
+
+    # ===== Сервер =====
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._client, self.host, self.port))
+        self._started.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._clients.add(writer)
+        self._tasks.add(task)
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                writer.write(self._execute(command))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            self._tasks.discard(task)
+            writer.close()
+
+    # Команда RESP: массив строк *N\r\n$len\r\nbytes\r\n...
+    @staticmethod
+    async def _read_command(reader: asyncio.StreamReader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()
+        parts = []
+        for _ in range(int(line[1:])):
+            size = int((await reader.readline())[1:])
+            parts.append((await reader.readexactly(size + 2))[:-2])
+        return parts
+
+    def _alive(self, key: bytes) -> bool:
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._data.pop(key, None)
+            del self._expires[key]
+        return key in self._data
+
+    def _execute(self, command: list) -> bytes:
+        name = command[0].decode().upper()
+        args = command[1:]
+        self.calls[name] += 1
+
+        if name == "PING":
+            return b"+PONG\r\n"
+        if name in ("SELECT", "CLIENT"):
+            return b"+OK\r\n"
+        if name == "GET":
+            if not self._alive(args[0]):
+                return b"$-1\r\n"
+            value = self._data[args[0]]
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if name == "SET":
+            return self._set(args)
+        if name == "DEL":
+            deleted = 0
+            for key in args:
+                if self._alive(key):
+                    deleted += 1
+                self._data.pop(key, None)
+                self._expires.pop(key, None)
+            return b":%d\r\n" % deleted
+        if name == "EXISTS":
+            return b":%d\r\n" % sum(self._alive(key) for key in args)
+        return b"-ERR unknown command '%s'\r\n" % name.encode()
+
+    def _set(self, args: list) -> bytes:
+        key, value, options = args[0], args[1], [arg.decode().upper() for arg in args[2:]]
+        expires_at = None
+        i = 0
+        while i < len(options):
+            if options[i] in ("EX", "PX"):
+                ttl = float(options[i + 1]) / (1000 if options[i] == "PX" else 1)
+                expires_at = time.monotonic() + ttl
+                i += 1
+            elif options[i] == "NX" and self._alive(key):
+                return b"$-1\r\n"
+            elif options[i] == "XX" and not self._alive(key):
+                return b"$-1\r\n"
+            i += 1
+        self._data[key] = value
+        if expires_at is None:
+            self._expires.pop(key, None)
+        else:
+            self._expires[key] = expires_at
+        return b"+OK\r\n"
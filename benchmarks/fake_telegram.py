@@ -0,0 +1,269 @@
+# Локальная замена Telegram Bot API и сервиса курсов ЦБ для нагрузочных тестов.
+#
+# Сервер работает в отдельном потоке со своим event loop, чтобы его собственная
+# нагрузка не попадала в замеры задержек бота. Поддерживает методы, которыми
+# пользуется бот: getMe, deleteWebhook, getUpdates, sendMessage, sendPhoto,
+# sendDocument, editMessageText, getChat, getChatMember, getFile и скачивание
+# файлов, а также XML_daily.asp ЦБ РФ.
+#
+# С rate_limits=(общий лимит/с, лимит на чат/с, серия на чат) сервер, как
+# Telegram, отвечает 429 с retry_after при превышении лимитов отправки.
+# Чаты из blocked_chats отвечают 403, как пользователи, заблокировавшие бота.
+import asyncio
+import itertools
+import math
+import threading
+import time
+from collections import Counter, deque
+
+from aiohttp import web
+
+CBR_XML = (
+    '<?xml version="1.0" encoding="windows-1251"?>'
+    '<ValCurs Date="{date}" name="Foreign Currency Market">'
+    '<Valute ID="R01235"><NumCode>840</NumCode><CharCode>USD</CharCode><Nominal>1</Nominal>'
+    '<Name>Доллар США</Name><Value>81,5000</Value></Valute>'
+    '<Valute ID="R01239"><NumCode>978</NumCode><CharCode>EUR</CharCode><Nominal>1</Nominal>'
+    '<Name>Евро</Name><Value>95,1000</Value></Valute>'
+    '<Valute ID="R01375"><NumCode>156</NumCode><CharCode>CNY</CharCode><Nominal>10</Nominal>'
+    '<Name>Китайских юаней</Name><Value>112,3000</Value></Valute>'
+    '</ValCurs>'
+)
+
+
+class FakeTelegramServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081, latency: dict = None,
+                 cbr_latency: float = 0.0, rate_limits: tuple = None):
+        self.host = host
+        self.port = port
+        # Задержка ответа по методам, например {"getChatMember": 0.05}
+        self.latency = latency or {}
+        self.cbr_latency = cbr_latency
+        self.calls = Counter()
+        self.on_send = None
+        self.rate_limits = rate_limits
+        self._sent_at = deque()
+        self._chat_tokens = {}
+        self.blocked_chats = set()
+        # Файлы для скачивания ботом и документы, отправленные ботом
+        self.files = {}
+        self.documents = []
+
+        self._loop = None
+        self._thread = None
+        self._runner = None
+        self._updates = None
+        self._started = threading.Event()
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def cbr_url(self) -> str:
+        return f"{self.base_url}/scripts/XML_daily.asp"
+
+    # ===== Управление из основного потока =====
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="fake-telegram", daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    async def _shutdown(self):
+        current = asyncio.current_task()
+        for task in asyncio.all_tasks():
+            if task is not current:
+                task.cancel()
+        await self._runner.cleanup()
+
+    def push_message(self, chat_id: int, text: str):
+        update_id = next(self._update_ids)
+        update = {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private", "first_name": f"user{chat_id}"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+                "text": text
+            }
+        }
+        self._loop.call_soon_threadsafe(self._updates.put_nowait, update)
+
+    def push_document(self, chat_id: int, file_name: str, content: bytes):
+        file_id = f"doc{len(self.files) + 1}"
+        self.files[file_id] = content
+        update_id = next(self._update_ids)
+        update = {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private", "first_name": f"user{chat_id}"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+                "document": {"file_id": file_id, "file_unique_id": file_id,
+                             "file_name": file_name, "file_size": len(content)}
+            }
+        }
+        self._loop.call_soon_threadsafe(self._updates.put_nowait, update)
+
+    # ===== Сервер =====
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._updates = asyncio.Queue()
+
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_get("/scripts/XML_daily.asp", self._cbr_daily)
+        app.router.add_get("/file/bot{token}/{file_id}", self._file)
+        app.router.add_route("*", "/bot{token}/{method}", self._api)
+        self._runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        self._loop.run_until_complete(web.TCPSite(self._runner, self.host, self.port).start())
+        self._started.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _cbr_daily(self, request):
+        self.calls["cbr"] += 1
+        if self.cbr_latency:
+            await asyncio.sleep(self.cbr_latency)
+        body = CBR_XML.format(date=time.strftime("%d.%m.%Y")).encode("cp1251")
+        return web.Response(body=body, content_type="application/xml")
+
+    async def _file(self, request):
+        self.calls["file"] += 1
+        content = self.files.get(request.match_info["file_id"])
+        if content is None:
+            return web.Response(status=404)
+        return web.Response(body=content)
+
+    async def _params(self, request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        return dict(await request.post())
+
+    async def _api(self, request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = await self._params(request)
+
+        delay = self.latency.get(method, 0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        handler = getattr(self, f"_method_{method}", None)
+        if handler is None:
+            return web.json_response({"ok": True, "result": True})
+        return await handler(params)
+
+    async def _method_getMe(self, params):
+        return self._ok({"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"})
+
+    async def _method_getUpdates(self, params):
+        timeout = float(params.get("timeout") or 0)
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self._updates.get(), timeout=timeout or 0.001))
+        except asyncio.TimeoutError:
+            return self._ok([])
+        limit = int(params.get("limit") or 100)
+        while len(updates) < limit and not self._updates.empty():
+            updates.append(self._updates.get_nowait())
+        return self._ok(updates)
+
+    async def _method_getChat(self, params):
+        return self._ok({"id": -1001, "type": "channel", "title": "auto_zakaz_dv", "username": "auto_zakaz_dv"})
+
+    async def _method_getChatMember(self, params):
+        user_id = int(params.get("user_id", 0))
+        return self._ok({"status": "member", "user": {"id": user_id, "is_bot": False, "first_name": "u"}})
+
+    async def _method_sendMessage(self, params):
+        return self._sent("sendMessage", params)
+
+    async def _method_getFile(self, params):
+        file_id = params.get("file_id")
+        return self._ok({"file_id": file_id, "file_unique_id": file_id,
+                         "file_size": len(self.files.get(file_id, b"")), "file_path": file_id})
+
+    async def _method_sendDocument(self, params):
+        document = params.get("document")
+        self.documents.append((int(params.get("chat_id", 0)), document.filename, document.file.read()))
+        return self._sent("sendDocument", params, extra={
+            "document": {"file_id": f"sent{len(self.documents)}", "file_unique_id": f"sent{len(self.documents)}",
+                         "file_name": document.filename}
+        })
+
+    async def _method_editMessageText(self, params):
+        return self._ok({
+            "message_id": int(params.get("message_id", 0)),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "text": params.get("text")
+        })
+
+    async def _method_sendPhoto(self, params):
+        return self._sent("sendPhoto", params, extra={
+            "photo": [{"file_id": "AgAD-logo", "file_unique_id": "logo", "width": 200, "height": 60}],
+            "caption": params.get("caption")
+        })
+
+    # Общий лимит - скользящее окно в 1 с, лимит на чат - token bucket
+    def _retry_after(self, chat_id: int):
+        global_rate, chat_rate, chat_burst = self.rate_limits
+        now = time.monotonic()
+        while self._sent_at and now - self._sent_at[0] >= 1:
+            self._sent_at.popleft()
+        if len(self._sent_at) >= global_rate:
+            return max(1, math.ceil(1 - (now - self._sent_at[0])))
+
+        tokens, updated_at = self._chat_tokens.get(chat_id, (chat_burst, now))
+        tokens = min(chat_burst, tokens + (now - updated_at) * chat_rate)
+        if tokens < 1:
+            self._chat_tokens[chat_id] = (tokens, now)
+            return max(1, math.ceil((1 - tokens) / chat_rate))
+
+        self._chat_tokens[chat_id] = (tokens - 1, now)
+        self._sent_at.append(now)
+        return None
+
+    def _sent(self, method: str, params: dict, extra: dict = None):
+        chat_id = int(params.get("chat_id", 0))
+        if chat_id in self.blocked_chats:
+            self.calls["403"] += 1
+            return web.json_response({
+                "ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"
+            }, status=403)
+        if self.rate_limits is not None:
+            retry_after = self._retry_after(chat_id)
+            if retry_after is not None:
+                self.calls["429"] += 1
+                return web.json_response({
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after}
+                }, status=429)
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text")
+        }
+        if extra:
+            message.update(extra)
+        if self.on_send is not None:
+            self.on_send(time.perf_counter(), method, chat_id, params)
+        return self._ok(message)
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({"ok": True, "result": result})
@@ -0,0 +1,203 @@
+# Нагрузочный тест бота целиком: N пользователей проходят анкету Form
+# (price -> year_month -> engine_type -> volume/power -> importer_type -> personal_use)
+# через локальную замену Telegram Bot API и ЦБ РФ.
+#
+#   python benchmarks/loadtest.py --users 200 --flows 3
+#   python benchmarks/loadtest.py --users 200 --cbr-latency 2 --api-latency 0.3
+#
+# --cbr-latency задерживает ответ XML_daily.asp (get_currency_rates),
+# --api-latency - ответы getChat/getChatMember (is_subscribed),
+# --send-latency - ответы sendMessage/sendPhoto.
+# Лимиты отправки Telegram (SendScheduler) по умолчанию сняты, чтобы измерять
+# сам бот; --telegram-limits включает их (30 сообщений/с, 1 сообщение/с на чат).
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegramServer
+
+MENU_MARKER = "Рассчитать стоимость авто"
+
+# Сценарии анкеты: (шаг, текст пользователя)
+SCENARIOS = [
+    [("entry", "🚗 Рассчитать стоимость авто"), ("price", "150000"), ("year_month", "2021.05"),
+     ("engine_type", "🛢️ Бензиновый"), ("engine_volume", "2.0"), ("engine_power", "150"),
+     ("importer_type", "👤 Физическое лицо"), ("personal_use", "✅ Для личного пользования")],
+    [("entry", "🚗 Рассчитать стоимость авто"), ("price", "320000"), ("year_month", "2019.11"),
+     ("engine_type", "⛽ Дизельный"), ("engine_volume", "3000"), ("engine_power", "249"),
+     ("importer_type", "🏢 Юридическое лицо")],
+    [("entry", "🚗 Рассчитать стоимость авто"), ("price", "210000"), ("year_month", "2024.03"),
+     ("engine_type", "🔋 Электрический"), ("engine_power", "150"),
+     ("importer_type", "👤 Физическое лицо"), ("personal_use", "💰 Для перепродажи")],
+]
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class LoadTest:
+    def __init__(self, server: FakeTelegramServer, args):
+        self.server = server
+        self.args = args
+        self.inboxes = defaultdict(asyncio.Queue)
+        self.latencies = defaultdict(list)
+        self.loop_lag = []
+        self.timeouts = 0
+        self.completed_flows = 0
+        self.updates_sent = 0
+        self._loop = None
+
+    def on_send(self, at, method, chat_id, params):
+        self._loop.call_soon_threadsafe(self.inboxes[chat_id].put_nowait, (at, method, params))
+
+    async def wait_reply(self, chat_id: int, final: bool) -> float:
+        inbox = self.inboxes[chat_id]
+        while True:
+            at, method, params = await asyncio.wait_for(inbox.get(), self.args.step_timeout)
+            if not final:
+                return at
+            # Последний шаг заканчивается сообщением с главным меню
+            markup = params.get("reply_markup")
+            if isinstance(markup, str):
+                markup = json.loads(markup)
+            if markup and MENU_MARKER in json.dumps(markup, ensure_ascii=False):
+                return at
+
+    async def user(self, chat_id: int):
+        await asyncio.sleep(random.uniform(0, self.args.ramp))
+        for _ in range(self.args.flows):
+            scenario = random.choice(SCENARIOS)
+            for i, (step, text) in enumerate(scenario):
+                started = time.perf_counter()
+                self.server.push_message(chat_id, text)
+                self.updates_sent += 1
+                try:
+                    replied = await self.wait_reply(chat_id, final=i == len(scenario) - 1)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    return
+                self.latencies[step].append(replied - started)
+                if self.args.think:
+                    await asyncio.sleep(random.uniform(0, self.args.think))
+            self.completed_flows += 1
+
+    async def monitor_loop_lag(self, interval: float = 0.01):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(time.perf_counter() - started - interval)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self.server.on_send = self.on_send
+
+        import bot
+        logging.getLogger().setLevel(logging.WARNING)
+
+        bot_task = asyncio.create_task(bot.main())
+        lag_task = asyncio.create_task(self.monitor_loop_lag())
+        await asyncio.sleep(0.5)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(self.user(100000 + i) for i in range(self.args.users)))
+        elapsed = time.perf_counter() - started
+
+        lag_task.cancel()
+        await bot.dp.stop_polling()
+        await asyncio.wait_for(bot_task, 15)
+        self.report(elapsed)
+
+    def report(self, elapsed: float):
+        print(f"\nПользователей: {self.args.users}, анкет на пользователя: {self.args.flows}")
+        print(f"Задержки: ЦБ {self.args.cbr_latency} с, getChat/getChatMember {self.args.api_latency} с, "
+              f"sendMessage {self.args.send_latency} с\n")
+        print(f"{'шаг':<16}{'n':>7}{'p50, мс':>11}{'p95, мс':>11}{'p99, мс':>11}{'max, мс':>11}")
+        order = ["entry", "price", "year_month", "engine_type", "engine_volume",
+                 "engine_power", "importer_type", "personal_use"]
+        for step in order:
+            values = self.latencies.get(step)
+            if not values:
+                continue
+            print(f"{step:<16}{len(values):>7}"
+                  f"{percentile(values, 0.50) * 1000:>11.1f}{percentile(values, 0.95) * 1000:>11.1f}"
+                  f"{percentile(values, 0.99) * 1000:>11.1f}{max(values) * 1000:>11.1f}")
+
+        print(f"\nВремя теста: {elapsed:.2f} с")
+        print(f"Пропускная способность: {self.updates_sent / elapsed:.1f} обновлений/с, "
+              f"{self.completed_flows / elapsed:.1f} расчетов/с")
+        print(f"Завершено анкет: {self.completed_flows}, таймаутов: {self.timeouts}")
+        print(f"Лаг event loop: p50={percentile(self.loop_lag, 0.5) * 1000:.1f} мс, "
+              f"p99={percentile(self.loop_lag, 0.99) * 1000:.1f} мс, "
+              f"max={max(self.loop_lag, default=0) * 1000:.1f} мс")
+        print(f"Вызовы внешних сервисов: ЦБ={self.server.calls['cbr']}, "
+              f"getChat={self.server.calls['getChat']}, getChatMember={self.server.calls['getChatMember']}, "
+              f"sendMessage={self.server.calls['sendMessage']}, sendPhoto={self.server.calls['sendPhoto']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--flows", type=int, default=1, help="анкет на пользователя")
+    parser.add_argument("--ramp", type=float, default=1.0, help="разброс старта пользователей, с")
+    parser.add_argument("--think", type=float, default=0.0, help="пауза пользователя между шагами, с")
+    parser.add_argument("--cbr-latency", type=float, default=0.0)
+    parser.add_argument("--api-latency", type=float, default=0.0)
+    parser.add_argument("--send-latency", type=float, default=0.0)
+    parser.add_argument("--step-timeout", type=float, default=30.0)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--telegram-limits", action="store_true", help="ограничивать отправку как Telegram")
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(
+        port=args.port,
+        latency={
+            "getChat": args.api_latency,
+            "getChatMember": args.api_latency,
+            "sendMessage": args.send_latency,
+            "sendPhoto": args.send_latency,
+        },
+        cbr_latency=args.cbr_latency
+    )
+    server.start()
+
+    os.environ.setdefault("BOT_TOKEN", "123456:LOADTEST-TOKEN")
+    os.environ["BOT_MODE"] = "polling"
+    os.environ["TELEGRAM_API_URL"] = server.base_url
+    os.environ["CBR_URL"] = server.cbr_url
+    if not args.telegram_limits:
+        os.environ["SEND_GLOBAL_RATE"] = "100000"
+        os.environ["SEND_CHAT_RATE"] = "100000"
+
+    # Файлы бота (лог, архив курсов, пользователи, кэш file_id, анкеты) - во
+    # временном каталоге: тест не должен писать фиктивные курсы и file_id
+    # в рабочие файлы
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["LOG_FILE"] = os.path.join(tmp, "bot.log")
+        os.environ["RATES_ARCHIVE"] = os.path.join(tmp, "rates.sqlite3")
+        os.environ["USERS_DB"] = os.path.join(tmp, "users.sqlite3")
+        os.environ["MEDIA_CACHE_PATH"] = os.path.join(tmp, "media_cache.json")
+        if os.environ.get("FSM_STORAGE", "").startswith("sqlite"):
+            os.environ["FSM_STORAGE"] = f"sqlite:///{tmp}/fsm.sqlite3"
+        try:
+            asyncio.run(LoadTest(server, args).run())
+        finally:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
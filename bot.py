@@ -1,75 +1,97 @@
+import time
+
+# Момент запуска процесса - от него считается холодный старт
+PROCESS_STARTED_AT = time.perf_counter()
+
 import sys
-import subprocess
 import os
 import logging
 import asyncio
+import hashlib
+import hmac
+import html
+import json
+import math
 import re
+import tempfile
 from datetime import datetime
-from xml.etree import ElementTree as ET
-
-print("=" * 60)
-print("🚀 СИСТЕМНАЯ ДИАГНОСТИКА ПРИ ЗАПУСКЕ")
-
-# 1. Проверка версии Python
-print(f"\n🐍 Версия Python: {sys.version}")
-print(f"📂 Рабочая директория: {os.getcwd()}")
-
-# 2. Проверка установки pip
-try:
-    import pip
-    print(f"✅ pip установлен, версия: {pip.__version__}")
-except ImportError:
-    print("❌ pip не установлен! Попытка установки...")
-    subprocess.check_call([sys.executable, "-m", "ensurepip", "--default-pip"])
-
-# 3. Проверка requests
-try:
-    import requests
-    print(f"✅ requests установлена, версия: {requests.__version__}")
-except ImportError:
-    print("❌ requests не установлена! Выполняю принудительную установку...")
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "requests==2.31.0"])
-    import requests
-    print(f"✅ requests успешно установлена, версия: {requests.__version__}")
-
-# 4. Проверка сети
-print("\n🌐 ТЕСТ СЕТЕВОГО ПОДКЛЮЧЕНИЯ:")
-try:
-    response = requests.get("https://httpbin.org/get", timeout=10)
-    print(f"Статус: {response.status_code}")
-    print(f"IP-адрес: {response.json().get('origin', 'неизвестен')}")
-except Exception as e:
-    print(f"❌ СЕТЕВАЯ ОШИБКА: {str(e)}")
-    print("Проверьте подключение контейнера к интернету")
-
-print("=" * 60)
+
+from diagnostics import run_diagnostics
+
+# Быстрый старт: диагностика окружения и сети выполняется в фоне после
+# запуска бота. FAST_START=0 возвращает прежний блокирующий порядок.
+FAST_START = os.getenv("FAST_START", "1").lower() not in ("0", "false", "no")
+startup_diagnostics = {'status': 'pending'}
+
+if not FAST_START:
+    startup_diagnostics = {'status': 'done', **run_diagnostics()}
+
 print("⚡ ЗАПУСК БОТА\n")
 
 # Основные импорты
 from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.types import (
-    ReplyKeyboardMarkup, 
-    KeyboardButton, 
     ReplyKeyboardRemove,
     InlineKeyboardMarkup, 
-    InlineKeyboardButton
+    InlineKeyboardButton,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    FSInputFile
 )
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from aiogram.enums import ChatMemberStatus
+from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
 from bs4 import BeautifulSoup
 from aiohttp import web
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("bot.log", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
+from http_pool import HttpPool, PooledAiohttpSession
+from rates import HEADERS, CbrRatesClient, RatePrefetcher, parse_times
+from rate_archive import RateArchive
+from subscription import SubscriptionMiddleware, SubscriptionResolver
+from storage import BufferedStorage, SQLiteStorage, StorageBatchMiddleware, create_storage
+from metrics import (
+    API_QUOTES,
+    CALCULATIONS,
+    COLD_START,
+    CONTENT_TYPE,
+    FSM_ACTIVE_SESSIONS,
+    REGISTRY,
+    BotApiMetricsMiddleware,
+    HandlerMetricsMiddleware,
+    UpdateMetricsMiddleware
+)
+from logging_setup import parse_sampling, setup_logging
+from media import MediaCache
+from quote_cache import QuoteCache, quote_key
+from send_scheduler import SendScheduler, SendSchedulerMiddleware
+from update_executor import UpdateExecutor
+from users import UserRegistry
+from broadcast import BroadcastRunner
+from quote_history import QuoteHistory
+from price_list import file_format, price_file
+from text_router import Keyboard, TextRouter
+from loop_watchdog import LoopWatchdog, enable_loop_debug
+from sqlite_thread import SQLiteThread
+from tariffs import (
+    CUSTOMS_CLEARANCE, DELIVERY_COST, ENGINE_DIESEL, ENGINE_ELECTRIC, ENGINE_PETROL, ENGINE_TYPE_CODES,
+    KW_TO_HP, calculate_batch, calculate_quote, current_tariff
+)
+
+# Настройка логирования: запись в файл и консоль идет из фонового потока.
+# LOG_FORMAT=json - JSON lines, LOG_ROTATE_WHEN=H|D|midnight - ротация по времени,
+# LOG_SAMPLING="aiogram.event=10" - из 10 записей INFO/DEBUG логгера пишется одна
+log_listener = setup_logging(
+    path=os.getenv("LOG_FILE", "bot.log"),
+    level=logging.getLevelName(os.getenv("LOG_LEVEL", "INFO").upper()),
+    fmt=os.getenv("LOG_FORMAT", "text").lower(),
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    when=os.getenv("LOG_ROTATE_WHEN") or None,
+    backup_count=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+    sampling=parse_sampling(os.getenv("LOG_SAMPLING", ""))
 )
 logger = logging.getLogger(__name__)
 
@@ -86,37 +108,207 @@ if not TOKEN:
 print(f"✅ Токен успешно загружен")
 
 # Константы
-DELIVERY_COST = 220000
-CUSTOMS_CLEARANCE = 80000
 SITE_URL = "https://autozakaz-dv.ru/"
-BASE_RECYCLING_FEE_INDIVIDUAL = 20000
-BASE_RECYCLING_FEE_LEGAL = 150000
-BASE_EXCISE_RATE = 61
 CHANNEL_ID = "@auto_zakaz_dv"
 
-# Константы для электромобилей
-ELECTRIC_DUTY_RATE = 0.15
-BASE_RECYCLING_FEE_ELECTRIC_INDIVIDUAL_NEW = 3400
-BASE_RECYCLING_FEE_ELECTRIC_INDIVIDUAL_OLD = 5200
-BASE_RECYCLING_FEE_ELECTRIC_LEGAL_NEW = 667400
-BASE_RECYCLING_FEE_ELECTRIC_LEGAL_OLD = 1174000
-
-# Актуальные ставки акциза для электромобилей
-EXCISE_RATES_ELECTRIC = {
-    (0, 90): 0,
-    (90, 150): 58,
-    (150, 200): 557,
-    (200, 300): 912,
-    (300, 400): 1555,
-    (400, 500): 1609,
-    (500, float('inf')): 1662
-}
+# Адрес Bot API (например, локальный telegram-bot-api или тестовый сервер)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# Пулы HTTP-соединений к Bot API и ЦБ РФ. Таймаут чтения должен быть больше
+# ожидания long polling (10 с)
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "100"))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", "300"))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Хранилище анкет: memory, sqlite:///fsm.sqlite3 или redis://host:6379/0
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+FSM_TTL = float(os.getenv("FSM_TTL", "86400"))
 
 SITE_IMAGE_URL = "https://autozakaz-dv.ru/local/templates/autozakaz/images/logo_header.png"
+# Логотип загружается в Telegram один раз (из локального файла, если он задан),
+# дальше отправляется по сохраненному file_id
+SITE_LOGO_PATH = os.getenv("SITE_LOGO_PATH", "")
+MEDIA_CACHE_PATH = os.getenv("MEDIA_CACHE_PATH", "media_cache.json")
+# Результат расчета одним сообщением: фото с подписью и главным меню.
+# Если подпись длиннее лимита Telegram, отправляются отдельные сообщения
+RESULT_AS_PHOTO = os.getenv("RESULT_AS_PHOTO", "0").lower() in ("1", "true", "yes")
+CAPTION_LIMIT = 1024
+
+# Реестр пользователей и рассылки; команды /broadcast доступны только ADMIN_IDS
+USERS_DB = os.getenv("USERS_DB", "users.sqlite3")
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if user_id}
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "30"))
+# Сколько последних расчетов хранится в истории пользователя
+HISTORY_LIMIT = int(os.getenv("HISTORY_LIMIT", "20"))
+# Уведомление подписчикам, когда курс CNY отошел от последнего уведомления на столько процентов
+RATE_ALERT_THRESHOLD = float(os.getenv("RATE_ALERT_THRESHOLD", "1.0"))
+
+# HTTP API расчета (/api/quote, /api/quote/batch). Если API_TOKEN задан,
+# запросы должны содержать заголовок Authorization: Bearer <API_TOKEN>
+API_TOKEN = os.getenv("API_TOKEN", "")
+API_BATCH_LIMIT = int(os.getenv("API_BATCH_LIMIT", "10000"))
+# Результаты пакетного расчета отправляются клиенту порциями по столько строк
+API_BATCH_CHUNK = 100
+
+# Прайс-листы CSV/XLSX (для XLSX нужен пакет openpyxl). Бот может скачать
+# файл не больше 20 МБ
+PRICE_LIST_MAX_BYTES = 20 * 1024 * 1024
+PRICE_LIST_MAX_ROWS = int(os.getenv("PRICE_LIST_MAX_ROWS", "50000"))
+PRICE_LIST_CHUNK = int(os.getenv("PRICE_LIST_CHUNK", "2000"))
+
+# Сторож event loop: лаг и стеки блокирующего кода на /health.
+# LOOP_DEBUG=1 - отладочный режим asyncio с предупреждениями о колбэках
+# дольше LOOP_SLOW_CALLBACK секунд (заметно замедляет бота)
+LOOP_WATCHDOG = os.getenv("LOOP_WATCHDOG", "1").lower() not in ("0", "false", "no")
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", "0.25"))
+LOOP_DEBUG = os.getenv("LOOP_DEBUG", "0").lower() in ("1", "true", "yes")
+LOOP_SLOW_CALLBACK = float(os.getenv("LOOP_SLOW_CALLBACK", "0.1"))
+
+# Сколько секунд Telegram хранит ответ на inline-запрос с расчетом
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+INLINE_ERROR_CACHE_TIME = 5
+
+# Все запросы к внешним сервисам идут через общие пулы соединений
+telegram_pool = HttpPool(
+    "telegram",
+    limit=TELEGRAM_POOL_SIZE,
+    limit_per_host=TELEGRAM_POOL_SIZE,
+    dns_ttl=HTTP_DNS_TTL,
+    keepalive=HTTP_KEEPALIVE,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=HTTP_READ_TIMEOUT
+)
+cbr_pool = HttpPool(
+    "cbr",
+    limit_per_host=4,
+    dns_ttl=HTTP_DNS_TTL,
+    keepalive=HTTP_KEEPALIVE,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=HTTP_READ_TIMEOUT,
+    headers=HEADERS
+)
+http_pools = (telegram_pool, cbr_pool)
 
 # Инициализация бота
-bot = Bot(token=TOKEN)
-dp = Dispatcher()
+if TELEGRAM_API_URL:
+    bot = Bot(token=TOKEN, session=PooledAiohttpSession(
+        telegram_pool, api=TelegramAPIServer.from_base(TELEGRAM_API_URL)
+    ))
+else:
+    bot = Bot(token=TOKEN, session=PooledAiohttpSession(telegram_pool))
+# Исходящие сообщения проходят через планировщик с лимитами Telegram:
+# общий (~30 сообщений/с) и на чат (~1 сообщение/с с запасом на короткую серию)
+send_scheduler = SendScheduler(
+    global_rate=float(os.getenv("SEND_GLOBAL_RATE", "30")),
+    chat_rate=float(os.getenv("SEND_CHAT_RATE", "1")),
+    chat_burst=int(os.getenv("SEND_CHAT_BURST", "3")),
+    max_retries=int(os.getenv("SEND_MAX_RETRIES", "3"))
+)
+bot.session.middleware(SendSchedulerMiddleware(send_scheduler))
+bot.session.middleware(BotApiMetricsMiddleware())
+storage = create_storage(FSM_STORAGE, ttl=FSM_TTL)
+# FSM middleware подключается вручную после исполнителя обновлений:
+# состояние анкеты должно читаться уже в очереди чата, а не до нее
+dp = Dispatcher(storage=storage, disable_fsm=True)
+update_executor = UpdateExecutor(
+    concurrency=int(os.getenv("UPDATE_CONCURRENCY", "64")),
+    max_chat_queue=int(os.getenv("UPDATE_CHAT_QUEUE", "5")),
+    max_queued=int(os.getenv("UPDATE_MAX_QUEUED", "1000"))
+)
+dp.update.outer_middleware(update_executor)
+dp.update.outer_middleware(dp.fsm)
+dp.update.outer_middleware(UpdateMetricsMiddleware())
+
+# Холодный старт: секунды от запуска процесса до готовности и до первого обновления
+cold_start = {'ready': None, 'first_update': None}
+
+@dp.update.outer_middleware()
+async def cold_start_middleware(handler, event, data):
+    try:
+        return await handler(event, data)
+    finally:
+        if cold_start['first_update'] is None:
+            cold_start['first_update'] = round(time.perf_counter() - PROCESS_STARTED_AT, 3)
+            COLD_START.set(cold_start['first_update'])
+            logger.info(f"⏱ Холодный старт: первое обновление обработано через {cold_start['first_update']} с")
+
+if isinstance(storage, BufferedStorage):
+    # Все записи анкеты за одно обновление уходят в хранилище одним пакетом
+    dp.update.outer_middleware(StorageBatchMiddleware(storage))
+# Архив курсов ЦБ по датам (пустой RATES_ARCHIVE отключает архив).
+# Заполнить за прошлые годы: python rate_archive.py backfill 2023-01-01
+RATES_ARCHIVE = os.getenv("RATES_ARCHIVE", "rates.sqlite3")
+# Запросы к архиву курсов, реестру пользователей, истории и рассылкам
+# выполняются в отдельном потоке, event loop не ждет SQLite
+sqlite_thread = SQLiteThread()
+rates_client = CbrRatesClient(
+    url=os.getenv("CBR_URL", "https://www.cbr.ru/scripts/XML_daily.asp"),
+    ttl=float(os.getenv("RATES_CACHE_TTL", "3600")),
+    stale_timeout=float(os.getenv("RATES_STALE_TIMEOUT", "1.0")),
+    archive=RateArchive(RATES_ARCHIVE) if RATES_ARCHIVE else None,
+    http_pool=cbr_pool,
+    db=sqlite_thread
+)
+user_registry = UserRegistry(USERS_DB)
+broadcast_runner = BroadcastRunner(bot, user_registry, concurrency=BROADCAST_CONCURRENCY, db=sqlite_thread)
+quote_history = QuoteHistory(USERS_DB, limit=HISTORY_LIMIT)
+
+# Рассылка подписчикам /alerts, если курс CNY ушел за порог
+async def notify_rate_change(rates: dict):
+    cny = rates['CNY']
+    last = await sqlite_thread.run(user_registry.get_meta, "alert_cny")
+    if last is None:
+        await sqlite_thread.run(user_registry.set_meta, "alert_cny", repr(cny))
+        return
+    
+    last = float(last)
+    change = (cny - last) / last * 100
+    if abs(change) < RATE_ALERT_THRESHOLD:
+        return
+    await sqlite_thread.run(user_registry.set_meta, "alert_cny", repr(cny))
+    
+    recipients = await sqlite_thread.run(user_registry.count, "rate_alerts")
+    logger.info(f"💱 Курс CNY изменился на {change:+.2f}%: {last:.4f} -> {cny:.4f}, подписчиков: {recipients}")
+    if not recipients:
+        return
+    job_id = await sqlite_thread.run(
+        broadcast_runner.create,
+        f"{'📈' if change > 0 else '📉'} <b>Курс юаня ЦБ РФ изменился</b>\n\n"
+        f"🇨🇳 CNY: {last:.2f} → {cny:.2f} руб. ({change:+.1f}%)\n\n"
+        f"Пересчитайте стоимость авто: нажмите START\n"
+        f"Отключить уведомления: /alerts",
+        audience="rate_alerts"
+    )
+    broadcast_runner.start(job_id)
+
+# Курсы обновляются в фоне по расписанию ЦБ (время по Москве),
+# обработчики берут их из памяти и не ждут ответа cbr.ru
+RATES_PREFETCH = os.getenv("RATES_PREFETCH", "1") != "0"
+rates_prefetcher = RatePrefetcher(
+    rates_client,
+    times=parse_times(os.getenv("RATES_PREFETCH_AT", "00:01")),
+    interval=float(os.getenv("RATES_PREFETCH_INTERVAL", os.getenv("RATES_CACHE_TTL", "3600"))),
+    on_refresh=notify_rate_change
+)
+# file_id загруженного логотипа привязан к боту и серверу Bot API
+media_cache = MediaCache(MEDIA_CACHE_PATH, scope=f"{bot.id}@{TELEGRAM_API_URL or 'api.telegram.org'}")
+loop_watchdog = LoopWatchdog(threshold=LOOP_LAG_THRESHOLD)
+quote_cache = QuoteCache(maxsize=int(os.getenv("QUOTE_CACHE_SIZE", "2048")))
+subscription_resolver = SubscriptionResolver(
+    bot,
+    CHANNEL_ID,
+    positive_ttl=float(os.getenv("SUBSCRIPTION_POSITIVE_TTL", "600")),
+    negative_ttl=float(os.getenv("SUBSCRIPTION_NEGATIVE_TTL", "30")),
+    maxsize=int(os.getenv("SUBSCRIPTION_CACHE_SIZE", "10000"))
+)
 
 # Состояния бота
 class Form(StatesGroup):
@@ -128,50 +320,62 @@ class Form(StatesGroup):
     importer_type = State()
     personal_use = State()
 
-# Клавиатуры
-def start_keyboard():
-    return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="START")]],
-        resize_keyboard=True,
-        one_time_keyboard=False
-    )
+# Клавиатуры: кнопка - (текст, значение). Значения кнопок меню - действия
+# menu_router, значения кнопок анкеты читают обработчики шагов
+BACK_BUTTON = ("↩ Назад", None)
 
-def main_menu():
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="🚗 Рассчитать стоимость авто")],
-            [KeyboardButton(text="📊 Курсы валют"), KeyboardButton(text="ℹ️ О боте")]
-        ],
-        resize_keyboard=True
-    )
+start_keyboard = Keyboard(
+    [[("START", "start")]],
+    resize_keyboard=True,
+    one_time_keyboard=False
+)
 
-def importer_type_keyboard():
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="👤 Физическое лицо"), KeyboardButton(text="🏢 Юридическое лицо")],
-            [KeyboardButton(text="↩ Назад")]
-        ],
-        resize_keyboard=True
-    )
+main_menu = Keyboard(
+    [
+        [("🚗 Рассчитать стоимость авто", "calculate")],
+        [("📊 Курсы валют", "rates"), ("ℹ️ О боте", "about")],
+        [("📜 История расчетов", "history")]
+    ],
+    resize_keyboard=True
+)
 
-def personal_use_keyboard():
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="✅ Для личного пользования"), KeyboardButton(text="💰 Для перепродажи")],
-            [KeyboardButton(text="↩ Назад")]
-        ],
-        resize_keyboard=True
-    )
+menu_router = TextRouter()
+menu_router.include(start_keyboard)
+menu_router.include(main_menu)
 
-def engine_type_keyboard():
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="🛢️ Бензиновый"), KeyboardButton(text="⛽ Дизельный")],
-            [KeyboardButton(text="🔋 Электрический")],
-            [KeyboardButton(text="↩ Назад")]
-        ],
-        resize_keyboard=True
-    )
+def history_keyboard():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔄 Пересчитать все по курсу на сегодня", callback_data="history_reprice")],
+        [InlineKeyboardButton(text="🗑 Очистить историю", callback_data="history_clear")]
+    ])
+
+# Значение - is_individual
+importer_type_keyboard = Keyboard(
+    [
+        [("👤 Физическое лицо", True), ("🏢 Юридическое лицо", False)],
+        [BACK_BUTTON]
+    ],
+    resize_keyboard=True
+)
+
+# Значение - is_personal_use
+personal_use_keyboard = Keyboard(
+    [
+        [("✅ Для личного пользования", True), ("💰 Для перепродажи", False)],
+        [BACK_BUTTON]
+    ],
+    resize_keyboard=True
+)
+
+# Значение - код типа двигателя в tariffs
+engine_type_keyboard = Keyboard(
+    [
+        [("🛢️ Бензиновый", ENGINE_PETROL), ("⛽ Дизельный", ENGINE_DIESEL)],
+        [("🔋 Электрический", ENGINE_ELECTRIC)],
+        [BACK_BUTTON]
+    ],
+    resize_keyboard=True
+)
 
 def subscribe_keyboard():
     return InlineKeyboardMarkup(
@@ -189,71 +393,23 @@ def subscribe_keyboard():
 
 # Проверка подписки на канал
 async def is_subscribed(user_id: int) -> bool:
-    try:
-        # Получаем информацию о чате по username
-        chat = await bot.get_chat(chat_id=CHANNEL_ID)
-        
-        # Проверяем статус подписки
-        member = await bot.get_chat_member(
-            chat_id=chat.id, 
-            user_id=user_id
-        )
-        
-        return member.status in [
-            ChatMemberStatus.MEMBER,
-            ChatMemberStatus.ADMINISTRATOR,
-            ChatMemberStatus.CREATOR
-        ]
-    except Exception as e:
-        logger.error(f"Ошибка проверки подписки: {e}", exc_info=True)
-        return False
+    return await subscription_resolver.is_subscribed(user_id)
 
 # Получение курсов валют
-def get_currency_rates():
-    try:
-        logger.info("Запрос курсов валют к ЦБ РФ")
-        url = 'https://www.cbr.ru/scripts/XML_daily.asp'
-        today = datetime.now().strftime("%d/%m/%Y")
-        params = {'date_req': today}
-        
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'
-        }
-        
-        response = requests.get(url, params=params, headers=headers, timeout=15)
-        response.raise_for_status()
-        
-        root = ET.fromstring(response.content)
-        rates = {}
-        
-        for valute in root.findall('Valute'):
-            char_code = valute.find('CharCode').text
-            if char_code in ['USD', 'EUR', 'CNY']:
-                nominal = int(valute.find('Nominal').text)
-                value = float(valute.find('Value').text.replace(',', '.'))
-                rates[char_code] = value / nominal
-        
-        default_rates = {'USD': 80.0, 'EUR': 90.0, 'CNY': 11.0}
-        for currency in ['USD', 'EUR', 'CNY']:
-            if currency not in rates:
-                rates[currency] = default_rates[currency]
-                logger.warning(f"Курс {currency} не найден, использовано значение по умолчанию")
-        
-        logger.info(f"Получены курсы: USD={rates['USD']}, EUR={rates['EUR']}, CNY={rates['CNY']}")
-        return rates
-        
-    except Exception as e:
-        logger.exception("Ошибка получения курсов")
-        return {'USD': 80.0, 'EUR': 90.0, 'CNY': 11.0}
+async def get_currency_rates():
+    return await rates_client.get_rates()
 
+# Объем двигателя в см³. Числа меньше 50 - литры (2, 1.6), остальные - см³ (1600)
 def parse_engine_volume(input_str):
     try:
-        clean_input = input_str.replace(' ', '').replace(',', '.')
-        if '.' in clean_input:
-            return int(float(clean_input) * 1000)
-        return int(clean_input)
-    except:
+        volume = float(input_str.replace(' ', '').replace(',', '.'))
+    except (AttributeError, ValueError):
         return None
+    if not math.isfinite(volume) or volume <= 0:
+        return None
+    if volume < 50:
+        return int(round(volume * 1000))
+    return int(volume)
 
 def format_engine_volume(volume_cc):
     liters = volume_cc / 1000
@@ -262,124 +418,306 @@ def format_engine_volume(volume_cc):
 def format_number(value):
     return "{0:,}".format(int(value)).replace(",", ".")
 
-# Расчет пошлины
-def calculate_duty(price_rub: float, age_months: int, engine_volume_cc: int, 
-                  is_individual: bool, eur_rate: float, is_electric: bool,
-                  is_personal_use: bool) -> float:
+# Год и месяц выпуска из строки ГГГГ.ММ: (год, месяц, возраст в месяцах).
+# ValueError - неверный формат, None - дата вне допустимого диапазона
+def parse_year_month(input_str):
+    cleaned_input = input_str.strip().replace(' ', '')
+    year, month = map(float, cleaned_input.split('.'))
+    current_date = datetime.now()
     
-    if is_electric:
-        return price_rub * ELECTRIC_DUTY_RATE
+    if not (1990 <= year <= current_date.year) or not (1 <= month <= 12):
+        return None
+    
+    return year, month, age_in_months(year, month, current_date)
+
+# Возраст авто в полных календарных месяцах на дату расчета
+def age_in_months(year, month, current_date=None):
+    current_date = current_date or datetime.now()
+    return (current_date.year - int(year)) * 12 + (current_date.month - int(month))
+
+CALC_USAGE = (
+    "🧮 <b>Быстрый расчет одной строкой</b>\n\n"
+    "<code>/calc цена ГГГГ.ММ объем мощность [фл|юл] [личн|продажа]</code>\n\n"
+    "Примеры:\n"
+    "<code>/calc 150000 2021.05 2.0 150 фл личн</code> - бензин 2.0 л, 150 л.с.\n"
+    "<code>/calc 320000 2019.11 3000 249 дизель юл</code> - дизель, юрлицо\n"
+    "<code>/calc 210000 2024.03 ev 120kw</code> - электромобиль 120 кВт\n\n"
+    "По умолчанию: бензин, физлицо, личное пользование. "
+    "Мощность ДВС в л.с., электромобиля в кВт (можно указать 120kw или 163hp)."
+)
+
+CALC_KEYWORDS = {
+    'ev': 'electric', 'эл': 'electric', 'электро': 'electric', 'электромобиль': 'electric',
+    'diesel': 'diesel', 'дизель': 'diesel', 'дт': 'diesel',
+    'petrol': 'petrol', 'бензин': 'petrol',
+    'fl': 'individual', 'фл': 'individual', 'физ': 'individual',
+    'ul': 'legal', 'юл': 'legal', 'юр': 'legal',
+    'personal': 'personal', 'личн': 'personal', 'лично': 'personal',
+    'resale': 'resale', 'продажа': 'resale', 'перепродажа': 'resale',
+}
+POWER_UNITS = {'kw': 'kw', 'квт': 'kw', 'hp': 'hp', 'лс': 'hp', 'л.с.': 'hp', 'л.с': 'hp'}
+
+# Разбор строки /calc и inline-запроса в данные анкеты.
+# Возвращает (data, is_individual, is_personal_use), при ошибке - ValueError с текстом для пользователя
+def parse_calc_query(text):
+    tokens = text.lower().replace(',', '.').split()
+    if len(tokens) < 3:
+        raise ValueError("Укажите как минимум цену, дату выпуска и параметры двигателя")
     
-    if not is_individual or not is_personal_use:
-        return price_rub * 0.20
+    try:
+        price = float(tokens[0])
+    except ValueError:
+        raise ValueError(f"Некорректная цена: {tokens[0]}")
+    if price <= 0:
+        raise ValueError("Стоимость должна быть положительным числом")
     
-    if age_months <= 36:
-        price_eur = price_rub / eur_rate
-        
-        if price_eur <= 8500:
-            rate_percent = 0.54
-            min_rate_eur = 2.5
-        elif price_eur <= 16700:
-            rate_percent = 0.48
-            min_rate_eur = 3.5
-        elif price_eur <= 42250:
-            rate_percent = 0.48
-            min_rate_eur = 5.5
-        elif price_eur <= 84500:
-            rate_percent = 0.48
-            min_rate_eur = 7.5
-        elif price_eur <= 169000:
-            rate_percent = 0.48
-            min_rate_eur = 15
-        else:
-            rate_percent = 0.48
-            min_rate_eur = 20
-            
-        duty_by_percent = price_rub * rate_percent
-        duty_by_volume = min_rate_eur * eur_rate * engine_volume_cc
-        return max(duty_by_percent, duty_by_volume)
-        
-    elif 36 < age_months <= 60:
-        if engine_volume_cc <= 1000:
-            eur_per_cc = 1.5
-        elif engine_volume_cc <= 1500:
-            eur_per_cc = 1.7
-        elif engine_volume_cc <= 1800:
-            eur_per_cc = 2.5
-        elif engine_volume_cc <= 2300:
-            eur_per_cc = 2.7
-        elif engine_volume_cc <= 3000:
-            eur_per_cc = 3.0
+    try:
+        year_month = parse_year_month(tokens[1])
+    except ValueError:
+        raise ValueError(f"Некорректная дата выпуска: {tokens[1]} (формат ГГГГ.ММ)")
+    if year_month is None:
+        raise ValueError("Некорректная дата выпуска")
+    year, month, age_months = year_month
+    
+    engine = 'petrol'
+    is_individual = True
+    is_personal_use = True
+    numbers = []
+    power = None
+    for token in tokens[2:]:
+        option = CALC_KEYWORDS.get(token)
+        if option in ('electric', 'diesel', 'petrol'):
+            engine = option
+        elif option in ('individual', 'legal'):
+            is_individual = option == 'individual'
+        elif option in ('personal', 'resale'):
+            is_personal_use = option == 'personal'
         else:
-            eur_per_cc = 3.6
-        return eur_per_cc * engine_volume_cc * eur_rate
-        
+            unit = next((u for u in POWER_UNITS if token.endswith(u) and token != u), None)
+            try:
+                if unit is not None:
+                    power = (float(token[:-len(unit)]), POWER_UNITS[unit])
+                else:
+                    numbers.append(token)
+            except ValueError:
+                raise ValueError(f"Не удалось разобрать параметр: {token}")
+    
+    volume_cc = None
+    if engine == 'electric':
+        if power is None and numbers:
+            power = (numbers.pop(0), 'kw')
     else:
-        if engine_volume_cc <= 1000:
-            eur_per_cc = 3.0
-        elif engine_volume_cc <= 1500:
-            eur_per_cc = 3.2
-        elif engine_volume_cc <= 1800:
-            eur_per_cc = 3.5
-        elif engine_volume_cc <= 2300:
-            eur_per_cc = 4.8
-        elif engine_volume_cc <= 3000:
-            eur_per_cc = 5.0
-        else:
-            eur_per_cc = 5.7
-        return eur_per_cc * engine_volume_cc * eur_rate
+        volume_cc = parse_engine_volume(numbers.pop(0)) if numbers else None
+        if volume_cc is None or volume_cc <= 0:
+            raise ValueError("Укажите объем двигателя (например: 1.6 или 1600)")
+        if power is None and numbers:
+            power = (numbers.pop(0), 'hp')
+    
+    if power is None:
+        raise ValueError("Укажите мощность двигателя")
+    if numbers:
+        raise ValueError(f"Лишние параметры: {' '.join(numbers)}")
+    return build_quote_input(price, year_month, engine, volume_cc, power, is_individual, is_personal_use)
 
-# Расчет утильсбора
-def calculate_recycling(age_months: int, engine_volume_cc: int, is_individual: bool, 
-                       is_personal_use: bool, is_electric: bool) -> float:
-    if is_electric:
-        if is_individual and is_personal_use:
-            return BASE_RECYCLING_FEE_ELECTRIC_INDIVIDUAL_NEW if age_months <= 36 else BASE_RECYCLING_FEE_ELECTRIC_INDIVIDUAL_OLD
-        else:
-            return BASE_RECYCLING_FEE_ELECTRIC_LEGAL_NEW if age_months <= 36 else BASE_RECYCLING_FEE_ELECTRIC_LEGAL_OLD
+ENGINE_NAMES = {'petrol': "🛢️ Бензиновый", 'diesel': "⛽ Дизельный", 'electric': "🔋 Электрический"}
+
+# Границы параметров расчета: все, что за ними, - ошибка ввода
+MAX_PRICE_CNY = 100_000_000
+MIN_ENGINE_VOLUME_CC = 50
+MAX_ENGINE_VOLUME_CC = 20_000
+MAX_ENGINE_POWER = 3_000
+
+# Данные анкеты из проверенных параметров (общее для /calc, inline-режима и HTTP API).
+# power - (значение, 'hp' | 'kw')
+def build_quote_input(price, year_month, engine, volume_cc, power, is_individual, is_personal_use):
+    if not math.isfinite(price) or price <= 0:
+        raise ValueError("Стоимость должна быть положительным числом")
+    if price > MAX_PRICE_CNY:
+        raise ValueError(f"Стоимость больше {format_number(MAX_PRICE_CNY)} CNY")
     
-    if is_individual and is_personal_use and engine_volume_cc <= 3000:
-        if age_months <= 36:
-            return 3400
-        else:
-            return 5200
-            
-    is_new = age_months <= 36
-    
-    if engine_volume_cc <= 1000:
-        coefficient = 1.42 if is_new else 5.3
-    elif engine_volume_cc <= 2000:
-        coefficient = 2.21 if is_new else 8.26
-    elif engine_volume_cc <= 3000:
-        coefficient = 4.22 if is_new else 16.12
-    elif engine_volume_cc <= 3500:
-        coefficient = 5.73 if is_new else 28.5
+    year, month, age_months = year_month
+    data = {'price': price, 'year_month': (year, month), 'age_months': age_months,
+            'engine_type': ENGINE_NAMES[engine]}
+    if engine != 'electric':
+        if volume_cc is None or volume_cc <= 0:
+            raise ValueError("Укажите объем двигателя (например: 1.6 или 1600)")
+        if volume_cc < MIN_ENGINE_VOLUME_CC:
+            raise ValueError(f"Объем двигателя указывается в см³, не меньше {MIN_ENGINE_VOLUME_CC}")
+        if volume_cc > MAX_ENGINE_VOLUME_CC:
+            raise ValueError(f"Объем двигателя больше {format_number(MAX_ENGINE_VOLUME_CC)} см³")
+        data['engine_volume_cc'] = volume_cc
+    
+    if power is None:
+        raise ValueError("Укажите мощность двигателя")
+    try:
+        value, unit = float(power[0]), power[1]
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"Некорректная мощность: {power[0]}")
+    if not math.isfinite(value) or value <= 0:
+        raise ValueError("Мощность должна быть положительным числом")
+    if value > MAX_ENGINE_POWER:
+        raise ValueError(f"Мощность больше {format_number(MAX_ENGINE_POWER)}")
+    
+    # Для расчета мощность ДВС нужна в л.с., электромобиля - в кВт.
+    # Значения не округляются: на границе ставки акциза округление меняет ставку
+    if engine == 'electric':
+        data['engine_power'] = value if unit == 'kw' else hp_to_kw(value)
     else:
-        coefficient = 9.08 if is_new else 35.01
-        
-    return BASE_RECYCLING_FEE_LEGAL * coefficient
+        data['engine_power'] = value if unit == 'hp' else value * KW_TO_HP
+    
+    return data, is_individual, is_personal_use
+
+# Мощность в кВт, из которой расчет (кВт * KW_TO_HP) получит не больше hp л.с.
+# и как можно ближе к ним. Простое деление иногда дает на единицу младшего
+# разряда больше, и мощность ровно на границе ставки уходит в следующую
+def hp_to_kw(hp):
+    kw = hp / KW_TO_HP
+    while kw * KW_TO_HP > hp:
+        kw = math.nextafter(kw, 0)
+    while math.nextafter(kw, math.inf) * KW_TO_HP <= hp:
+        kw = math.nextafter(kw, math.inf)
+    return kw
+
+# Запрос HTTP API в данные анкеты:
+# {"price_cny": 150000, "year": 2021, "month": 5, "engine_type": "petrol|diesel|electric",
+#  "engine_volume_cc": 2000, "power": 150, "power_unit": "hp|kw",
+#  "importer": "individual|legal", "purpose": "personal|resale"}
+def parse_quote_request(item):
+    if not isinstance(item, dict):
+        raise ValueError("Ожидается JSON-объект с параметрами расчета")
+    
+    if 'price_cny' not in item:
+        raise ValueError("Не указана стоимость price_cny")
+    price = json_number(item['price_cny'], f"Некорректная стоимость: {item['price_cny']}")
+    
+    if 'year' not in item or 'month' not in item:
+        raise ValueError("Не указана дата выпуска year и month")
+    year = json_number(item['year'], "Некорректная дата выпуска")
+    month = json_number(item['month'], "Некорректная дата выпуска")
+    try:
+        year_month = parse_year_month(f"{int(year)}.{int(month)}")
+    except ValueError:
+        raise ValueError("Некорректная дата выпуска")
+    if year_month is None:
+        raise ValueError("Некорректная дата выпуска")
+    
+    engine = item.get('engine_type', 'petrol')
+    if not isinstance(engine, str) or engine not in ENGINE_NAMES:
+        raise ValueError(f"engine_type: ожидается {', '.join(ENGINE_NAMES)}")
+    importer = item.get('importer', 'individual')
+    if not isinstance(importer, str) or importer not in ('individual', 'legal'):
+        raise ValueError("importer: ожидается individual или legal")
+    purpose = item.get('purpose', 'personal')
+    if not isinstance(purpose, str) or purpose not in ('personal', 'resale'):
+        raise ValueError("purpose: ожидается personal или resale")
+    unit = item.get('power_unit', 'kw' if engine == 'electric' else 'hp')
+    if not isinstance(unit, str) or unit not in ('hp', 'kw'):
+        raise ValueError("power_unit: ожидается hp или kw")
+    
+    volume_cc = item.get('engine_volume_cc')
+    if volume_cc is not None:
+        volume_cc = int(json_number(volume_cc, f"Некорректный объем двигателя: {volume_cc}"))
+    power = item.get('power')
+    if power is not None:
+        power = json_number(power, f"Некорректная мощность: {power}")
+    
+    return build_quote_input(
+        price, year_month, engine, volume_cc, (power, unit) if power is not None else None,
+        importer == 'individual', purpose == 'personal'
+    )
+
+# Число из JSON: число или строка с числом. bool, массивы, объекты,
+# NaN и Infinity - ValueError с текстом error
+def json_number(value, error):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(error)
+    try:
+        number = float(value)
+    except (ValueError, OverflowError):
+        raise ValueError(error)
+    if not math.isfinite(number):
+        raise ValueError(error)
+    return number
+
+# Строка прайс-листа: те же правила, что и в анкете (price_handler,
+# year_month_handler, parse_engine_volume, engine_power_handler).
+# Пустые тип двигателя, импортер и цель - бензин, физлицо, личное пользование
+def parse_price_row(fields: dict):
+    try:
+        price = float(fields['price'].replace(' ', '').replace(',', '.'))
+    except ValueError:
+        raise ValueError(f"Некорректная стоимость: {fields['price']}")
+    if price <= 0:
+        raise ValueError("Стоимость должна быть положительным числом")
+    
+    try:
+        year_month = parse_year_month(fields['year_month'])
+    except ValueError:
+        raise ValueError(f"Некорректная дата выпуска: {fields['year_month']} (формат ГГГГ.ММ)")
+    if year_month is None:
+        raise ValueError("Некорректная дата выпуска")
+    
+    engine = parse_option(fields.get('engine_type', ''), ('petrol', 'diesel', 'electric'), 'petrol', "тип двигателя")
+    is_individual = parse_option(fields.get('importer', ''), ('individual', 'legal'), 'individual', "импортер") == 'individual'
+    is_personal_use = parse_option(fields.get('purpose', ''), ('personal', 'resale'), 'personal', "цель ввоза") == 'personal'
+    
+    volume_cc = None
+    if engine != 'electric':
+        volume_cc = parse_engine_volume(fields.get('engine_volume', ''))
+    
+    power = None
+    power_text = fields.get('power', '').lower().replace(' ', '').replace(',', '.')
+    if power_text:
+        unit = next((u for u in POWER_UNITS if power_text.endswith(u) and power_text != u), None)
+        if unit is not None:
+            power = (power_text[:-len(unit)], POWER_UNITS[unit])
+        else:
+            power = (power_text, 'kw' if engine == 'electric' else 'hp')
+    
+    return build_quote_input(price, year_month, engine, volume_cc, power, is_individual, is_personal_use)
+
+# Значение столбца: ключевые слова /calc (бензин, ev, юл...) или подписи кнопок анкеты
+def parse_option(text: str, options: tuple, default: str, name: str) -> str:
+    text = text.strip().lower()
+    if not text:
+        return default
+    for option in options:
+        label = ENGINE_NAMES.get(option, "")
+        if label and text in (label.lower(), label.split()[-1].lower()):
+            return option
+    option = CALC_KEYWORDS.get(text) or CALC_KEYWORDS.get(text[:3])
+    if option in options:
+        return option
+    raise ValueError(f"Неизвестное значение в столбце «{name}»: {text}")
 
-def calculate_excise(engine_power_hp: int) -> float:
-    return engine_power_hp * BASE_EXCISE_RATE
+# Метрики времени обработчиков (снаружи проверки подписки, чтобы учитывать и ее)
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
+dp.inline_query.middleware(HandlerMetricsMiddleware())
 
-def calculate_excise_electric(power_hp: float) -> float:
-    for (min_power, max_power), rate in EXCISE_RATES_ELECTRIC.items():
-        if min_power < power_hp <= max_power:
-            return power_hp * rate
-    return 0
+# Проверка подписки для всех обработчиков; шаги начатого расчета отмечены
+# флагом skip_subscription, остальные обработчики проверяются и во время анкеты
+subscription_middleware = SubscriptionMiddleware(
+    subscription_resolver,
+    prompt=(
+        "📢 Для использования бота необходимо подписаться на наш канал!\n"
+        "После подписки нажмите кнопку '✅ Я подписался'"
+    ),
+    reply_markup_factory=subscribe_keyboard
+)
+dp.message.middleware(subscription_middleware)
+dp.callback_query.middleware(subscription_middleware)
+dp.inline_query.middleware(subscription_middleware)
 
 # Обработчики сообщений
 @dp.message(Command("start"))
 async def start_handler(message: types.Message):
     try:
-        if not await is_subscribed(message.from_user.id):
-            await message.answer(
-                "📢 Для использования бота необходимо подписаться на наш канал!\n"
-                "После подписки нажмите кнопку '✅ Я подписался'",
-                reply_markup=subscribe_keyboard()
-            )
-            return
-        
+        await sqlite_thread.run(user_registry.touch, message.chat.id, message.from_user.id)
+    except Exception as e:
+        logger.error(f"Ошибка записи в реестр пользователей: {e}", exc_info=True)
+    
+    try:
         await message.answer(
             "🚗 <b>AutoZakazDV Calculator</b>\n\n"
             "Добро пожаловать! Актуальные расчеты стоимости авто из Китая\n\n"
@@ -391,9 +729,129 @@ async def start_handler(message: types.Message):
         logger.error(f"Ошибка в start_handler: {e}", exc_info=True)
         await message.answer("⚠️ Произошла ошибка. Пожалуйста, попробуйте позже.")
 
-@dp.callback_query(lambda c: c.data == "check_subscription")
+# Подписка на уведомления об изменении курса юаня
+@dp.message(Command("alerts"))
+async def alerts_handler(message: types.Message):
+    try:
+        await sqlite_thread.run(user_registry.touch, message.chat.id, message.from_user.id)
+        enabled = not await sqlite_thread.run(user_registry.rate_alerts_enabled, message.chat.id)
+        await sqlite_thread.run(user_registry.set_rate_alerts, message.chat.id, enabled)
+        if enabled:
+            text = (
+                f"🔔 Уведомления включены: бот напишет, когда курс юаня ЦБ РФ "
+                f"изменится больше чем на {RATE_ALERT_THRESHOLD:g}%.\n\nОтключить: /alerts"
+            )
+        else:
+            text = "🔕 Уведомления о курсе юаня отключены.\n\nВключить снова: /alerts"
+        await message.answer(text)
+    except Exception as e:
+        logger.error(f"Ошибка в alerts_handler: {e}", exc_info=True)
+        await message.answer("⚠️ Произошла ошибка. Пожалуйста, попробуйте позже.")
+
+# Рассылка всем пользователям: /broadcast текст (HTML-разметка Telegram)
+@dp.message(Command("broadcast"), lambda m: m.from_user.id in ADMIN_IDS)
+async def broadcast_handler(message: types.Message, command: CommandObject):
+    try:
+        if not command.args:
+            await message.answer("Использование: /broadcast текст рассылки")
+            return
+        
+        # Сначала сообщение получает сам администратор: ошибка в HTML-разметке
+        # обнаружится до рассылки, а не на каждом получателе
+        try:
+            await message.answer(command.args, parse_mode="HTML", disable_web_page_preview=True)
+        except TelegramBadRequest as e:
+            await message.answer(f"❌ Рассылка не запущена, Telegram не принял сообщение: {e.message}")
+            return
+        
+        job_id = await sqlite_thread.run(broadcast_runner.create, command.args, audience="all")
+        broadcast_runner.start(job_id)
+        recipients = await sqlite_thread.run(user_registry.count, "all")
+        await message.answer(
+            f"📨 Рассылка #{job_id} запущена: {recipients} получателей, сообщение выше.\n"
+            f"Статус: /broadcast_status {job_id}"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка в broadcast_handler: {e}", exc_info=True)
+        await message.answer("⚠️ Не удалось запустить рассылку.")
+
+@dp.message(Command("broadcast_status"), lambda m: m.from_user.id in ADMIN_IDS)
+async def broadcast_status_handler(message: types.Message, command: CommandObject):
+    try:
+        if command.args and command.args.strip().isdigit():
+            jobs = [await sqlite_thread.run(broadcast_runner.job, int(command.args))]
+        else:
+            jobs = await sqlite_thread.run(broadcast_runner.last_jobs)
+        
+        lines = [
+            f"#{job['id']} {job['audience']}: {job['status']}, отправлено {job['sent']}, "
+            f"заблокировали {job['blocked']}, ошибок {job['failed']}"
+            for job in jobs if job is not None
+        ]
+        await message.answer("\n".join(lines) or "Рассылок еще не было")
+    except Exception as e:
+        logger.error(f"Ошибка в broadcast_status_handler: {e}", exc_info=True)
+        await message.answer("⚠️ Не удалось получить статус рассылки.")
+
+# Расчет одной командой без анкеты: /calc 150000 2021.05 2.0 150 фл личн
+@dp.message(Command("calc"))
+async def calc_command_handler(message: types.Message, command: CommandObject):
+    try:
+        if not command.args:
+            await message.answer(CALC_USAGE, parse_mode="HTML")
+            return
+        
+        try:
+            data, is_individual, is_personal_use = parse_calc_query(command.args)
+        except ValueError as e:
+            await message.answer(f"❌ Ошибка! {e}\n\n{CALC_USAGE}", parse_mode="HTML")
+            return
+        
+        rates = await get_currency_rates()
+        quote, result = cached_quote(data, rates, is_individual, is_personal_use)
+        await message.answer(result, parse_mode="HTML", disable_web_page_preview=True)
+        count_calculation(data, is_individual)
+        await save_to_history(message.chat.id, data, quote, rates, is_individual, is_personal_use)
+    except Exception as e:
+        logger.error(f"Ошибка в calc_command_handler: {e}", exc_info=True)
+        await message.answer("⚠️ Произошла ошибка при расчете стоимости. Пожалуйста, попробуйте еще раз.")
+
+# Inline-режим: @bot 150000 2021.05 ev 120kw - результат кэшируется на стороне Telegram
+@dp.inline_query()
+async def inline_quote_handler(inline_query: types.InlineQuery):
+    try:
+        try:
+            data, is_individual, is_personal_use = parse_calc_query(inline_query.query)
+        except ValueError as e:
+            await inline_query.answer(
+                [], cache_time=INLINE_ERROR_CACHE_TIME,
+                switch_pm_text=f"❓ {e}"[:64], switch_pm_parameter="calc"
+            )
+            return
+        
+        rates = await get_currency_rates()
+        quote, result = cached_quote(data, rates, is_individual, is_personal_use)
+        key = quote_key(data, is_individual, is_personal_use)
+        article = InlineQueryResultArticle(
+            id=hashlib.sha1(repr(key).encode()).hexdigest(),
+            title=f"ИТОГО: {format_number(quote['total'])} руб.",
+            description=(
+                f"{data['engine_type']}, {format_number(data['price'])} CNY, "
+                f"пошлина {format_number(quote['duty'])} руб., утильсбор {format_number(quote['recycling'])} руб."
+            ),
+            input_message_content=InputTextMessageContent(
+                message_text=result, parse_mode="HTML", disable_web_page_preview=True
+            )
+        )
+        # Результаты личные: общий кэш Telegram отдал бы расчет и неподписанным
+        await inline_query.answer([article], cache_time=INLINE_CACHE_TIME, is_personal=True)
+    except Exception as e:
+        logger.error(f"Ошибка в inline_quote_handler: {e}", exc_info=True)
+
+@dp.callback_query(lambda c: c.data == "check_subscription", flags={"skip_subscription": True})
 async def check_subscription_handler(callback_query: types.CallbackQuery):
     try:
+        subscription_resolver.invalidate(callback_query.from_user.id)
         if await is_subscribed(callback_query.from_user.id):
             await callback_query.message.delete()
             await callback_query.message.answer(
@@ -409,17 +867,12 @@ async def check_subscription_handler(callback_query: types.CallbackQuery):
     except Exception as e:
         logger.error(f"Ошибка в check_subscription_handler: {e}", exc_info=True)
 
-@dp.message(lambda m: m.text == "START")
+# Кнопки меню: один обработчик, действие выбирается по тексту кнопки
+dp.message.register(menu_router.dispatch, menu_router)
+
+@menu_router.action("start", any_state=True)
 async def start_command_handler(message: types.Message):
     try:
-        if not await is_subscribed(message.from_user.id):
-            await message.answer(
-                "📢 Для использования бота необходимо подписаться на наш канал!\n"
-                "После подписки нажмите кнопку '✅ Я подписался'",
-                reply_markup=subscribe_keyboard()
-            )
-            return
-        
         await message.answer(
             "🚗 <b>AutoZakazDV Calculator</b>\n\n"
             "Выберите действие:",
@@ -431,17 +884,9 @@ async def start_command_handler(message: types.Message):
         await message.answer("⚠️ Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 @dp.message(Command("calculate"))
-@dp.message(lambda m: m.text == "🚗 Рассчитать стоимость авто")
+@menu_router.action("calculate", any_state=True)
 async def calculate_handler(message: types.Message, state: FSMContext):
     try:
-        if not await is_subscribed(message.from_user.id):
-            await message.answer(
-                "📢 Для использования калькулятора необходимо подписаться на наш канал!\n"
-                "После подписки нажмите кнопку '✅ Я подписался'",
-                reply_markup=subscribe_keyboard()
-            )
-            return
-        
         await state.set_state(Form.price)
         await message.answer(
             "💰 Введите стоимость автомобиля в CNY (например 150000):",
@@ -451,17 +896,9 @@ async def calculate_handler(message: types.Message, state: FSMContext):
         logger.error(f"Ошибка в calculate_handler: {e}", exc_info=True)
         await message.answer("⚠️ Произошла ошибка. Пожалуйста, попробуйте позже.")
 
-@dp.message(Form.price)
+@dp.message(StateFilter(Form.price), flags={"skip_subscription": True})
 async def price_handler(message: types.Message, state: FSMContext):
     try:
-        if not await is_subscribed(message.from_user.id):
-            await message.answer(
-                "📢 Для продолжения расчета необходимо подписаться на наш канал!\n"
-                "После подписки нажмите кнопку '✅ Я подписался'",
-                reply_markup=subscribe_keyboard()
-            )
-            return
-        
         price = float(message.text.replace(' ', '').replace(',', '.'))
         if price <= 0: 
             await message.answer("❌ Ошибка! Стоимость должна быть положительным числом.")
@@ -476,28 +913,15 @@ async def price_handler(message: types.Message, state: FSMContext):
         logger.error(f"Ошибка в price_handler: {e}", exc_info=True)
         await message.answer("⚠️ Произошла ошибка. Пожалуйста, начните расчет заново.")
 
-@dp.message(Form.year_month)
+@dp.message(StateFilter(Form.year_month), flags={"skip_subscription": True})
 async def year_month_handler(message: types.Message, state: FSMContext):
     try:
-        if not await is_subscribed(message.from_user.id):
-            await message.answer(
-                "📢 Для продолжения расчета необходимо подписаться на наш канал!\n"
-                "После подписки нажмите кнопку '✅ Я подписался'",
-                reply_markup=subscribe_keyboard()
-            )
-            return
-        
-        cleaned_input = message.text.strip().replace(' ', '')
-        year, month = map(float, cleaned_input.split('.'))
-        current_date = datetime.now()
-        
-        if not (1990 <= year <= current_date.year) or not (1 <= month <= 12):
+        year_month = parse_year_month(message.text)
+        if year_month is None:
             await message.answer("❌ Ошибка! Некорректная дата выпуска.")
             return
-            
-        manufacture_date = datetime(int(year), int(month), 1)
-        age_months = (current_date.year - manufacture_date.year) * 12 + (current_date.month - manufacture_date.month)
         
+        year, month, age_months = year_month
         await state.update_data(year_month=(year, month), age_months=age_months)
         await state.set_state(Form.engine_type)
         await message.answer("🔧 Выберите тип двигателя:", reply_markup=engine_type_keyboard())
@@ -506,26 +930,18 @@ async def year_month_handler(message: types.Message, state: FSMContext):
         await message.answer("❌ Ошибка формата! Введите как ГГГГ.ММ (например: 2021.05)")
         await state.set_state(Form.year_month)
 
-@dp.message(Form.engine_type)
+@dp.message(StateFilter(Form.engine_type), flags={"skip_subscription": True})
 async def engine_type_handler(message: types.Message, state: FSMContext):
     try:
-        if not await is_subscribed(message.from_user.id):
-            await message.answer(
-                "📢 Для продолжения расчета необходимо подписаться на наш канал!\n"
-                "После подписки нажмите кнопку '✅ Я подписался'",
-                reply_markup=subscribe_keyboard()
-            )
-            return
-        
-        engine_types = ["🛢️ Бензиновый", "⛽ Дизельный", "🔋 Электрический"]
-        if message.text not in engine_types:
+        engine_code = engine_type_keyboard.value(message.text)
+        if engine_code is None:
             await message.answer("❌ Пожалуйста, выберите тип двигателя из предложенных вариантов",
                                reply_markup=engine_type_keyboard())
             return
         
         await state.update_data(engine_type=message.text)
         
-        if message.text in ["🛢️ Бензиновый", "⛽ Дизельный"]:
+        if engine_code != ENGINE_ELECTRIC:
             await state.set_state(Form.engine_volume)
             await message.answer("⚙️ Введите объем двигателя в кубических сантиметрах (например: 2000) или в литрах (например: 2.0):")
         else:
@@ -536,21 +952,17 @@ async def engine_type_handler(message: types.Message, state: FSMContext):
         await message.answer("⚠️ Произошла ошибка. Пожалуйста, попробуйте еще раз.")
         await state.set_state(Form.engine_type)
 
-@dp.message(Form.engine_volume)
+@dp.message(StateFilter(Form.engine_volume), flags={"skip_subscription": True})
 async def engine_volume_handler(message: types.Message, state: FSMContext):
     try:
-        if not await is_subscribed(message.from_user.id):
-            await message.answer(
-                "📢 Для продолжения расчета необходимо подписаться на наш канал!\n"
-                "После подписки нажмите кнопку '✅ Я подписался'",
-                reply_markup=subscribe_keyboard()
-            )
-            return
-        
         volume_cc = parse_engine_volume(message.text)
         if volume_cc is None or volume_cc <= 0:
             await message.answer("❌ Ошибка! Введите объем цифрами (например: 1.6 или 1600)")
             return
+        if not MIN_ENGINE_VOLUME_CC <= volume_cc <= MAX_ENGINE_VOLUME_CC:
+            await message.answer(f"❌ Ошибка! Объем двигателя должен быть от {MIN_ENGINE_VOLUME_CC} "
+                                 f"до {format_number(MAX_ENGINE_VOLUME_CC)} см³")
+            return
         
         await state.update_data(engine_volume_cc=volume_cc)
         await state.set_state(Form.engine_power)
@@ -560,17 +972,9 @@ async def engine_volume_handler(message: types.Message, state: FSMContext):
         await message.answer("⚠️ Произошла ошибка. Пожалуйста, введите объем снова.")
         await state.set_state(Form.engine_volume)
 
-@dp.message(Form.engine_power)
+@dp.message(StateFilter(Form.engine_power), flags={"skip_subscription": True})
 async def engine_power_handler(message: types.Message, state: FSMContext):
     try:
-        if not await is_subscribed(message.from_user.id):
-            await message.answer(
-                "📢 Для продолжения расчета необходимо подписаться на наш канал!\n"
-                "После подписки нажмите кнопку '✅ Я подписался'",
-                reply_markup=subscribe_keyboard()
-            )
-            return
-        
         power = float(message.text)
         if power <= 0: 
             await message.answer("❌ Ошибка! Мощность должна быть положительным числом.")
@@ -588,23 +992,15 @@ async def engine_power_handler(message: types.Message, state: FSMContext):
         await message.answer("⚠️ Произошла ошибка. Пожалуйста, введите мощность снова.")
         await state.set_state(Form.engine_power)
 
-@dp.message(Form.importer_type)
+@dp.message(StateFilter(Form.importer_type), flags={"skip_subscription": True})
 async def importer_type_handler(message: types.Message, state: FSMContext):
     try:
-        if not await is_subscribed(message.from_user.id):
-            await message.answer(
-                "📢 Для продолжения расчета необходимо подписаться на наш канал!\n"
-                "После подписки нажмите кнопку '✅ Я подписался'",
-                reply_markup=subscribe_keyboard()
-            )
-            return
-        
-        if message.text not in ["👤 Физическое лицо", "🏢 Юридическое лицо"]:
+        is_individual = importer_type_keyboard.value(message.text)
+        if is_individual is None:
             await message.answer("❌ Пожалуйста, выберите тип из предложенных вариантов",
                                reply_markup=importer_type_keyboard())
             return
         
-        is_individual = message.text == "👤 Физическое лицо"
         await state.update_data(importer_type=is_individual)
         
         if is_individual:
@@ -618,23 +1014,15 @@ async def importer_type_handler(message: types.Message, state: FSMContext):
         await message.answer("⚠️ Произошла ошибка. Пожалуйста, попробуйте еще раз.")
         await state.set_state(Form.importer_type)
 
-@dp.message(Form.personal_use)
+@dp.message(StateFilter(Form.personal_use), flags={"skip_subscription": True})
 async def personal_use_handler(message: types.Message, state: FSMContext):
     try:
-        if not await is_subscribed(message.from_user.id):
-            await message.answer(
-                "📢 Для продолжения расчета необходимо подписаться на наш канал!\n"
-                "После подписки нажмите кнопку '✅ Я подписался'",
-                reply_markup=subscribe_keyboard()
-            )
-            return
-        
-        if message.text not in ["✅ Для личного пользования", "💰 Для перепродажи"]:
+        is_personal_use = personal_use_keyboard.value(message.text)
+        if is_personal_use is None:
             await message.answer("❌ Пожалуйста, выберите цель из предложенных вариантов",
                                reply_markup=personal_use_keyboard())
             return
         
-        is_personal_use = message.text == "✅ Для личного пользования"
         data = await state.get_data()
         await calculate_and_send_result(message, state, data, is_individual=True, is_personal_use=is_personal_use)
     except Exception as e:
@@ -642,120 +1030,193 @@ async def personal_use_handler(message: types.Message, state: FSMContext):
         await message.answer("⚠️ Произошла ошибка. Пожалуйста, попробуйте еще раз.")
         await state.set_state(Form.personal_use)
 
-async def calculate_and_send_result(message: types.Message, state: FSMContext, data: dict, is_individual: bool, is_personal_use: bool):
+# Длина подписи так, как ее считает Telegram: без HTML-разметки, в UTF-16
+def caption_length(text: str) -> int:
+    visible = html.unescape(re.sub(r"<[^>]+>", "", text))
+    return len(visible.encode("utf-16-le")) // 2
+
+async def send_result_messages(message: types.Message, result: str):
+    # Отправляем текстовый результат
     try:
-        logger.info(f"Начало расчета для данных: {data}")
-        
-        rates = get_currency_rates()
-        price_rub = data['price'] * rates['CNY']
-        eur_rate = rates['EUR']
-        
-        is_electric = data.get('engine_type') == "🔋 Электрический"
-        engine_volume_cc = data.get('engine_volume_cc', 0) if not is_electric else 0
-        
-        if is_electric:
-            power_kw = data.get('engine_power', 0)
-            engine_power_hp = power_kw * 1.35962
-            excise = calculate_excise_electric(engine_power_hp)
-            current_rate = 0
-            for (min_power, max_power), rate in EXCISE_RATES_ELECTRIC.items():
-                if min_power < engine_power_hp <= max_power:
-                    current_rate = rate
-                    break
+        if len(result) > 4096:
+            parts = [result[i:i+4096] for i in range(0, len(result), 4096)]
+            for part in parts:
+                await message.answer(part, parse_mode="HTML")
         else:
-            engine_power_hp = data.get('engine_power', 0)
-            excise = calculate_excise(engine_power_hp) if not is_individual else 0
-            current_rate = BASE_EXCISE_RATE
-        
-        duty = calculate_duty(price_rub, data['age_months'], engine_volume_cc, 
-                             is_individual, eur_rate, is_electric, is_personal_use)
-        
-        recycling = calculate_recycling(data['age_months'], engine_volume_cc, 
-                                      is_individual, is_personal_use, is_electric)
-        
-        vat_base = price_rub + duty + excise
-        vat = vat_base * 0.2 if (is_electric or not is_individual) else 0
-        
-        total = price_rub + duty + recycling + vat + excise + DELIVERY_COST + CUSTOMS_CLEARANCE
-        
-        years = data['age_months'] // 12
-        months = data['age_months'] % 12
-        age_str = f"{years} г. {months} мес." if months else f"{years} лет"
-        
-        importer_type = "Физическое лицо" if is_individual else "Юридическое лицо"
-        if is_individual:
-            purpose = "личное пользование" if is_personal_use else "перепродажа"
-            importer_type += f" ({purpose})"
-        
-        result = (
-            f"📊 <b>Результат расчета</b> (актуально на {datetime.now().strftime('%d.%m.%Y')}):\n\n"
-            f"💰 <b>Стоимость авто:</b> {format_number(data['price'])} CNY ({format_number(price_rub)} руб.)\n"
-            f"📈 <b>Курсы:</b> CNY: {rates['CNY']:.2f} руб., EUR: {rates['EUR']:.2f} руб.\n"
-            f"⏳ <b>Дата выпуска:</b> {data['year_month'][0]:.0f}.{data['year_month'][1]:.0f} ({age_str})\n"
-            f"🔋 <b>Тип двигателя:</b> {data['engine_type']}\n"
+            await message.answer(result, parse_mode="HTML")
+    except Exception as text_error:
+        logger.error(f"Ошибка при отправке текста: {text_error}", exc_info=True)
+    
+    # Отправляем фото
+    try:
+        await media_cache.answer_photo(
+            message, "site_logo", SITE_LOGO_PATH or SITE_IMAGE_URL,
+            caption="AutoZakazDV",
+            parse_mode="HTML"
         )
-        
-        if data['engine_type'] in ["🛢️ Бензиновый", "⛽ Дизельный"]:
-            result += f"🔧 <b>Объем двигателя:</b> {format_engine_volume(engine_volume_cc)}\n"
-            result += f"⚡ <b>Мощность двигателя:</b> {int(round(data.get('engine_power', 0)))} л.с.\n"
+    except Exception as photo_error:
+        logger.error(f"Ошибка при отправке фото: {photo_error}", exc_info=True)
+    
+    # Возвращаем основное меню
+    await message.answer("Выберите действие:", reply_markup=main_menu())
+
+# Текст результата расчета по данным анкеты и разбивке платежей
+def render_quote(data: dict, quote: dict, rates: dict, is_individual: bool, is_personal_use: bool) -> str:
+    is_electric = data.get('engine_type') == "🔋 Электрический"
+    price_rub = quote['price_rub']
+    engine_volume_cc = quote['engine_volume_cc']
+    engine_power_hp = quote['engine_power_hp']
+    current_rate = quote['excise_rate']
+    duty = quote['duty']
+    excise = quote['excise']
+    vat = quote['vat']
+    recycling = quote['recycling']
+    total = quote['total']
+    
+    years = data['age_months'] // 12
+    months = data['age_months'] % 12
+    age_str = f"{years} г. {months} мес." if months else f"{years} лет"
+    
+    importer_type = "Физическое лицо" if is_individual else "Юридическое лицо"
+    if is_individual:
+        purpose = "личное пользование" if is_personal_use else "перепродажа"
+        importer_type += f" ({purpose})"
+    
+    result = (
+        f"📊 <b>Результат расчета</b> (актуально на {datetime.now().strftime('%d.%m.%Y')}):\n\n"
+        f"💰 <b>Стоимость авто:</b> {format_number(data['price'])} CNY ({format_number(price_rub)} руб.)\n"
+        f"📈 <b>Курсы:</b> CNY: {rates['CNY']:.2f} руб., EUR: {rates['EUR']:.2f} руб.\n"
+        f"⏳ <b>Дата выпуска:</b> {data['year_month'][0]:.0f}.{data['year_month'][1]:.0f} ({age_str})\n"
+        f"🔋 <b>Тип двигателя:</b> {data['engine_type']}\n"
+    )
+    
+    if data['engine_type'] in ["🛢️ Бензиновый", "⛽ Дизельный"]:
+        result += f"🔧 <b>Объем двигателя:</b> {format_engine_volume(engine_volume_cc)}\n"
+        result += f"⚡ <b>Мощность двигателя:</b> {int(round(data.get('engine_power', 0)))} л.с.\n"
+    else:
+        result += f"⚡ <b>Мощность двигателя:</b> {round(data.get('engine_power', 0), 1):g} кВт ({engine_power_hp:.1f} л.с.)\n"
+    
+    result += f"👤 <b>Импортер:</b> {importer_type}\n\n"
+    result += f"📝 <b>Таможенные платежи:</b>\n"
+    result += f"- Пошлина: {format_number(duty)} руб.\n"
+    
+    if excise > 0:
+        if is_electric:
+            result += f"- Акциз: {format_number(excise)} руб. ({current_rate} руб./л.с.)\n"
         else:
-            result += f"⚡ <b>Мощность двигателя:</b> {data.get('engine_power', 0)} кВт ({engine_power_hp:.1f} л.с.)\n"
-        
-        result += f"👤 <b>Импортер:</b> {importer_type}\n\n"
-        result += f"📝 <b>Таможенные платежи:</b>\n"
-        result += f"- Пошлина: {format_number(duty)} руб.\n"
-        
-        if excise > 0:
-            if is_electric:
-                result += f"- Акциз: {format_number(excise)} руб. ({current_rate} руб./л.с.)\n"
-            else:
-                result += f"- Акциз: {format_number(excise)} руб.\n"
-        
-        if vat > 0:
-            result += f"- НДС (20%): {format_number(vat)} руб.\n"
-        
-        result += f"- Утильсбор: {format_number(recycling)} руб.\n"
-        
-        result += (
-            f"\n🚚 <b>Дополнительно:</b>\n"
-            f"- Доставка до Уссурийска: {format_number(DELIVERY_COST)} руб.\n"
-            f"- Таможенное оформление: {format_number(CUSTOMS_CLEARANCE)} руб.\n\n"
-            f"💵 <b>ИТОГО к оплате:</b> {format_number(total)} руб.\n\n"
-            f"<a href='{SITE_URL}'>С уважением, Авто Заказ ДВ</a>\n\n"
-            f"<a href='{SITE_URL}'>autozakaz-dv.ru</a>\n"
-            f"<a href='{SITE_URL}'>Главная</a>"
+            result += f"- Акциз: {format_number(excise)} руб.\n"
+    
+    if vat > 0:
+        result += f"- НДС (20%): {format_number(vat)} руб.\n"
+    
+    result += f"- Утильсбор: {format_number(recycling)} руб.\n"
+    
+    result += (
+        f"\n🚚 <b>Дополнительно:</b>\n"
+        f"- Доставка до Уссурийска: {format_number(DELIVERY_COST)} руб.\n"
+        f"- Таможенное оформление: {format_number(CUSTOMS_CLEARANCE)} руб.\n\n"
+        f"💵 <b>ИТОГО к оплате:</b> {format_number(total)} руб.\n\n"
+        f"<a href='{SITE_URL}'>С уважением, Авто Заказ ДВ</a>\n\n"
+        f"<a href='{SITE_URL}'>autozakaz-dv.ru</a>\n"
+        f"<a href='{SITE_URL}'>Главная</a>"
+    )
+    
+    if is_electric:
+        result += "\n\nℹ️ <i>Для электромобилей: пошлина 15%, акциз по мощности, НДС 20%</i>"
+        if engine_power_hp <= 90:
+            result += " (акциз 0% для мощности до 90 л.с.)"
+    elif not is_individual:
+        result += "\n\nℹ️ <i>Для ДВС юридических лиц: учтены пошлина, акциз, НДС и утильсбор</i>"
+    
+    return result
+
+# Расчет через кэш: одинаковые анкеты при тех же курсах, тарифах и дате
+# не пересчитываются и не рендерятся заново
+def cached_quote(data: dict, rates: dict, is_individual: bool, is_personal_use: bool):
+    tariff = current_tariff()
+    generation = (rates_client.rate_date, rates['CNY'], rates['EUR'], tariff.version, datetime.now().date())
+    key = quote_key(data, is_individual, is_personal_use)
+    cached = quote_cache.get(generation, key)
+    if cached is not None:
+        return cached
+    
+    is_electric = data.get('engine_type') == "🔋 Электрический"
+    quote = calculate_quote(
+        data['price'], data['age_months'], data.get('engine_volume_cc', 0), data.get('engine_power', 0),
+        is_electric, is_individual, is_personal_use, rates['CNY'], rates['EUR'], tariff=tariff
+    )
+    entry = (quote, render_quote(data, quote, rates, is_individual, is_personal_use))
+    quote_cache.put(generation, key, entry)
+    return entry
+
+def count_calculation(data: dict, is_individual: bool):
+    engine_type = data.get('engine_type')
+    CALCULATIONS.labels(
+        "electric" if engine_type == "🔋 Электрический" else ("diesel" if engine_type == "⛽ Дизельный" else "petrol"),
+        "individual" if is_individual else "legal"
+    ).inc()
+
+# В историю пишутся только исходные данные анкеты и итог, текст не хранится
+async def save_to_history(chat_id: int, data: dict, quote: dict, rates: dict, is_individual: bool, is_personal_use: bool):
+    try:
+        await sqlite_thread.run(
+            quote_history.append, chat_id, data, is_individual, is_personal_use, quote['total'], rates['CNY']
         )
+    except Exception as e:
+        logger.error(f"Ошибка записи в историю расчетов: {e}", exc_info=True)
+
+# Краткое описание авто для истории: тип, цена, дата выпуска, двигатель
+def describe_car(data: dict) -> str:
+    year, month = data['year_month']
+    parts = [data['engine_type'], f"{format_number(data['price'])} CNY", f"{int(year)}.{int(month):02d}"]
+    if data['engine_type'] == "🔋 Электрический":
+        parts.append(f"{round(data['engine_power'], 1):g} кВт")
+    else:
+        parts.append(f"{data['engine_volume_cc'] / 1000:.1f} л, {round(data['engine_power'], 1):g} л.с.")
+    return ", ".join(parts)
+
+def format_change(value):
+    return f"+{format_number(value)}" if value >= 0 else f"−{format_number(-value)}"
+
+# Пересчет всей истории одним пакетным проходом по текущим курсам и тарифам;
+# возраст авто считается на сегодня, как при новом расчете
+def reprice_history(entries: list, rates: dict) -> list:
+    today = datetime.now()
+    result = calculate_batch(
+        [entry['data']['price'] for entry in entries],
+        [age_in_months(*entry['data']['year_month'], today) for entry in entries],
+        [entry['data']['engine_volume_cc'] for entry in entries],
+        [entry['data']['engine_power'] for entry in entries],
+        [ENGINE_TYPE_CODES[entry['data']['engine_type']] for entry in entries],
+        [entry['is_individual'] for entry in entries],
+        [entry['is_personal_use'] for entry in entries],
+        rates['CNY'], rates['EUR']
+    )
+    return result['total'].tolist()
+
+async def calculate_and_send_result(message: types.Message, state: FSMContext, data: dict, is_individual: bool, is_personal_use: bool):
+    try:
+        logger.info(f"Начало расчета для данных: {data}")
         
-        if is_electric:
-            result += "\n\nℹ️ <i>Для электромобилей: пошлина 15%, акциз по мощности, НДС 20%</i>"
-            if engine_power_hp <= 90:
-                result += " (акциз 0% для мощности до 90 л.с.)"
-        elif not is_individual:
-            result += "\n\nℹ️ <i>Для ДВС юридических лиц: учтены пошлина, акциз, НДС и утильсбор</i>"
-        
-        # Отправляем текстовый результат
-        try:
-            if len(result) > 4096:
-                parts = [result[i:i+4096] for i in range(0, len(result), 4096)]
-                for part in parts:
-                    await message.answer(part, parse_mode="HTML")
-            else:
-                await message.answer(result, parse_mode="HTML")
-        except Exception as text_error:
-            logger.error(f"Ошибка при отправке текста: {text_error}", exc_info=True)
+        rates = await get_currency_rates()
+        quote, result = cached_quote(data, rates, is_individual, is_personal_use)
         
-        # Отправляем фото
-        try:
-            await message.answer_photo(
-                photo=SITE_IMAGE_URL,
-                caption="AutoZakazDV",
-                parse_mode="HTML"
-            )
-        except Exception as photo_error:
-            logger.error(f"Ошибка при отправке фото: {photo_error}", exc_info=True)
+        if RESULT_AS_PHOTO and caption_length(result) <= CAPTION_LIMIT:
+            # Одно сообщение: логотип по file_id, результат в подписи и главное меню
+            try:
+                await media_cache.answer_photo(
+                    message, "site_logo", SITE_LOGO_PATH or SITE_IMAGE_URL,
+                    caption=result, parse_mode="HTML", reply_markup=main_menu()
+                )
+            except Exception as photo_error:
+                # Без фото результат все равно нужен: отправляем текстом
+                logger.error(f"Ошибка при отправке результата с фото: {photo_error}", exc_info=True)
+                await send_result_messages(message, result)
+        else:
+            await send_result_messages(message, result)
         
-        # Возвращаем основное меню
-        await message.answer("Выберите действие:", reply_markup=main_menu())
+        count_calculation(data, is_individual)
+        await save_to_history(message.chat.id, data, quote, rates, is_individual, is_personal_use)
         
         # Очищаем состояние
         await state.clear()
@@ -770,18 +1231,10 @@ async def calculate_and_send_result(message: types.Message, state: FSMContext, d
         except:
             pass
 
-@dp.message(lambda m: m.text == "📊 Курсы валют")
+@menu_router.action("rates")
 async def show_rates_handler(message: types.Message):
     try:
-        if not await is_subscribed(message.from_user.id):
-            await message.answer(
-                "📢 Для просмотра курсов валют необходимо подписаться на наш канал!\n"
-                "После подписки нажмите кнопку '✅ Я подписался'",
-                reply_markup=subscribe_keyboard()
-            )
-            return
-        
-        rates = get_currency_rates()
+        rates = await get_currency_rates()
         await message.answer(
             f"📊 <b>Текущие курсы ЦБ РФ</b>:\n\n"
             f"🇺🇸 USD: {rates['USD']:.2f} руб.\n"
@@ -795,17 +1248,156 @@ async def show_rates_handler(message: types.Message):
         logger.error(f"Ошибка в show_rates_handler: {e}", exc_info=True)
         await message.answer("⚠️ Не удалось получить курсы валют. Пожалуйста, попробуйте позже.")
 
-@dp.message(lambda m: m.text == "ℹ️ О боте")
-async def about_handler(message: types.Message):
+@dp.message(Command("history"))
+@menu_router.action("history")
+async def history_handler(message: types.Message):
     try:
-        if not await is_subscribed(message.from_user.id):
+        entries = await sqlite_thread.run(quote_history.entries, message.chat.id)
+        if not entries:
             await message.answer(
-                "📢 Для просмотра информации о боте необходимо подписаться на наш канал!\n"
-                "После подписки нажмите кнопку '✅ Я подписался'",
-                reply_markup=subscribe_keyboard()
+                "📜 История расчетов пуста. Здесь появятся ваши последние расчеты.",
+                reply_markup=main_menu()
             )
             return
         
+        lines = [
+            f"{i}. {datetime.fromtimestamp(entry['created_at']).strftime('%d.%m.%Y')} - "
+            f"{describe_car(entry['data'])}: <b>{format_number(entry['total'])} руб.</b>"
+            for i, entry in enumerate(entries, 1)
+        ]
+        await message.answer(
+            f"📜 <b>Ваши расчеты</b> (последние {len(entries)}):\n\n" + "\n".join(lines),
+            parse_mode="HTML",
+            reply_markup=history_keyboard()
+        )
+    except Exception as e:
+        logger.error(f"Ошибка в history_handler: {e}", exc_info=True)
+        await message.answer("⚠️ Произошла ошибка. Пожалуйста, попробуйте позже.")
+
+@dp.callback_query(lambda c: c.data == "history_reprice")
+async def history_reprice_handler(callback_query: types.CallbackQuery):
+    try:
+        await callback_query.answer()
+        entries = await sqlite_thread.run(quote_history.entries, callback_query.message.chat.id)
+        if not entries:
+            await callback_query.message.answer("📜 История расчетов пуста.", reply_markup=main_menu())
+            return
+        
+        rates = await get_currency_rates()
+        totals = reprice_history(entries, rates)
+        lines = [
+            f"{i}. {describe_car(entry['data'])}\n"
+            f"     <b>{format_number(total)} руб.</b> (было {format_number(entry['total'])}, "
+            f"{format_change(total - entry['total'])})"
+            for i, (entry, total) in enumerate(zip(entries, totals), 1)
+        ]
+        before = sum(entry['total'] for entry in entries)
+        after = sum(totals)
+        await callback_query.message.answer(
+            f"🔄 <b>Пересчет по курсу на {datetime.now().strftime('%d.%m.%Y')}</b>\n"
+            f"📈 CNY: {rates['CNY']:.2f} руб., EUR: {rates['EUR']:.2f} руб.\n\n"
+            + "\n".join(lines) +
+            f"\n\n💵 <b>Всего за {len(entries)} авто:</b> {format_number(after)} руб. "
+            f"({format_change(after - before)} руб. к прошлым расчетам)",
+            parse_mode="HTML",
+            reply_markup=main_menu()
+        )
+    except Exception as e:
+        logger.error(f"Ошибка в history_reprice_handler: {e}", exc_info=True)
+        await callback_query.message.answer("⚠️ Не удалось пересчитать историю. Пожалуйста, попробуйте позже.")
+
+@dp.callback_query(lambda c: c.data == "history_clear")
+async def history_clear_handler(callback_query: types.CallbackQuery):
+    try:
+        await sqlite_thread.run(quote_history.clear, callback_query.message.chat.id)
+        await callback_query.answer("История очищена")
+        await callback_query.message.edit_text("🗑 История расчетов очищена.")
+    except Exception as e:
+        logger.error(f"Ошибка в history_clear_handler: {e}", exc_info=True)
+
+# Прайс-лист дилера: файл CSV/XLSX с ценой, датой выпуска, типом двигателя,
+# объемом и мощностью. Расчет идет в отдельном потоке, ход виден
+# в одном сообщении, в ответ - файл с платежами и отчет об ошибках
+price_list_slots = asyncio.Semaphore(int(os.getenv("PRICE_LIST_CONCURRENCY", "2")))
+
+# Фильтры асинхронные: синхронные (lambda) aiogram выполняет в пуле потоков
+async def has_document(message: types.Message) -> bool:
+    return message.document is not None
+
+async def is_clean_command(message: types.Message) -> bool:
+    return message.text == "Очистить чат" or message.text == "/clean"
+
+@dp.message(has_document)
+async def price_list_handler(message: types.Message):
+    document = message.document
+    try:
+        extension = file_format(document.file_name)
+    except ValueError as e:
+        await message.answer(
+            f"❌ {e}. Пришлите прайс-лист со столбцами: цена CNY, год.месяц выпуска, "
+            f"тип двигателя, объем, мощность."
+        )
+        return
+    if document.file_size and document.file_size > PRICE_LIST_MAX_BYTES:
+        await message.answer("❌ Файл больше 20 МБ. Разбейте прайс-лист на несколько файлов.")
+        return
+    
+    status = await message.answer("⏳ Прайс-лист получен, загружаю...")
+    loop = asyncio.get_running_loop()
+    edits = []
+    
+    def progress(rows: int):
+        edits.append(asyncio.run_coroutine_threadsafe(
+            edit_status(status, f"⏳ Обработано строк: {format_number(rows)}"), loop
+        ))
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "source" + extension)
+            priced_path = os.path.join(tmp, "priced" + extension)
+            errors_path = os.path.join(tmp, "errors.csv")
+            await bot.download(document, destination=source)
+            rates = await get_currency_rates()
+            
+            async with price_list_slots:
+                await edit_status(status, "⏳ Расчет прайс-листа...")
+                result = await asyncio.to_thread(
+                    price_file, source, priced_path, errors_path, parse_price_row,
+                    rates['CNY'], rates['EUR'], chunk_size=PRICE_LIST_CHUNK,
+                    max_rows=PRICE_LIST_MAX_ROWS, progress=progress
+                )
+            # Запоздавшие обновления хода не должны перезаписать итог
+            await asyncio.gather(*(asyncio.wrap_future(edit) for edit in edits))
+            
+            await edit_status(
+                status,
+                f"✅ Готово за {result['seconds']} с: рассчитано {format_number(result['priced'])} "
+                f"из {format_number(result['rows'])} строк, ошибок: {format_number(result['errors'])}\n"
+                f"📈 Курсы ЦБ: CNY {rates['CNY']:.2f} руб., EUR {rates['EUR']:.2f} руб."
+            )
+            stem = os.path.splitext(document.file_name)[0]
+            await message.answer_document(FSInputFile(priced_path, filename=f"{stem}_расчет{extension}"))
+            if result['errors']:
+                await message.answer_document(
+                    FSInputFile(errors_path, filename=f"{stem}_ошибки.csv"),
+                    caption=f"⚠️ Строки с ошибками: {format_number(result['errors'])}"
+                )
+    except ValueError as e:
+        await asyncio.gather(*(asyncio.wrap_future(edit) for edit in edits))
+        await edit_status(status, f"❌ {e}")
+    except Exception as e:
+        logger.error(f"Ошибка в price_list_handler: {e}", exc_info=True)
+        await edit_status(status, "⚠️ Не удалось обработать прайс-лист. Пожалуйста, попробуйте позже.")
+
+async def edit_status(status: types.Message, text: str):
+    try:
+        await status.edit_text(text)
+    except Exception as e:
+        logger.warning(f"Не удалось обновить сообщение о ходе расчета: {e}")
+
+@menu_router.action("about")
+async def about_handler(message: types.Message):
+    try:
         await message.answer(
             f"🤖 <b>AutoZakazDV Calculator Bot</b>\n\n"
             f"Этот бот помогает рассчитать стоимость растаможки автомобилей из Китая.\n\n"
@@ -822,7 +1414,7 @@ async def about_handler(message: types.Message):
         logger.error(f"Ошибка в about_handler: {e}", exc_info=True)
         await message.answer("⚠️ Произошла ошибка. Пожалуйста, попробуйте позже.")
 
-@dp.message(lambda m: m.text == "Очистить чат" or m.text == "/clean")
+@dp.message(is_clean_command, flags={"skip_subscription": True})
 async def clear_chat_handler(message: types.Message):
     try:
         await message.answer(
@@ -832,17 +1424,11 @@ async def clear_chat_handler(message: types.Message):
     except Exception as e:
         logger.error(f"Ошибка в clear_chat_handler: {e}", exc_info=True)
 
+menu_router.validate()
+
 @dp.message()
 async def unknown_command_handler(message: types.Message):
     try:
-        if not await is_subscribed(message.from_user.id):
-            await message.answer(
-                "📢 Для использования бота необходимо подписаться на наш канал!\n"
-                "После подписки нажмите кнопку '✅ Я подписался'",
-                reply_markup=subscribe_keyboard()
-            )
-            return
-        
         await message.answer(
             "Я не понимаю эту команду. Нажмите START для начала работы.",
             reply_markup=ReplyKeyboardRemove()
@@ -859,8 +1445,186 @@ async def global_error_handler(update: types.Update, exception: Exception):
 async def health_check(request):
     return web.Response(text="Bot is running")
 
+async def health_details_handler(request):
+    return web.json_response({
+        'status': 'ok',
+        'fast_start': FAST_START,
+        'cold_start': cold_start,
+        'rates': rates_prefetcher.stats(),
+        'loop': loop_watchdog.stats(),
+        'diagnostics': startup_diagnostics
+    })
+
+async def metrics_handler(request):
+    FSM_ACTIVE_SESSIONS.set(await count_active_sessions())
+    return web.Response(body=REGISTRY.render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+# Число незавершенных анкет считается только при чтении /metrics
+async def count_active_sessions() -> float:
+    backend = storage.backend if isinstance(storage, BufferedStorage) else storage
+    if isinstance(backend, MemoryStorage):
+        return sum(1 for record in backend.storage.values() if record.state)
+    if isinstance(backend, SQLiteStorage):
+        return await backend.active_sessions()
+    return float('nan')
+
+async def stats_handler(request):
+    return web.json_response({
+        'rates': rates_client.stats(),
+        'subscription': subscription_resolver.stats(),
+        'media': media_cache.stats(),
+        'quotes': quote_cache.stats(),
+        'send': send_scheduler.stats(),
+        'updates': update_executor.stats(),
+        'users': await sqlite_thread.run(user_registry.stats),
+        'broadcast': await broadcast_runner.stats(),
+        'history': await sqlite_thread.run(quote_history.stats),
+        'sqlite': sqlite_thread.stats(),
+        'text_router': menu_router.stats(),
+        'http': {pool.name: pool.stats() for pool in http_pools},
+        'cold_start': cold_start
+    })
+
+# HTTP API расчета для сайта: те же cached_quote и кэш курсов, что и у бота
+def api_authorized(request) -> bool:
+    if not API_TOKEN:
+        return True
+    return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {API_TOKEN}")
+
+def quote_json(data: dict, quote: dict, rates: dict) -> dict:
+    return {
+        'total': round(quote['total'], 2),
+        'price_rub': round(quote['price_rub'], 2),
+        'duty': round(quote['duty'], 2),
+        'excise': round(quote['excise'], 2),
+        'vat': round(quote['vat'], 2),
+        'recycling': round(quote['recycling'], 2),
+        'delivery': DELIVERY_COST,
+        'customs_clearance': CUSTOMS_CLEARANCE,
+        'engine_power_hp': round(quote['engine_power_hp'], 1),
+        'age_months': data['age_months'],
+        'tariff_version': quote['tariff_version'],
+        'rates': {'CNY': rates['CNY'], 'EUR': rates['EUR'], 'date': rates_client.rate_date},
+    }
+
+async def api_quote_handler(request):
+    if not api_authorized(request):
+        return web.json_response({'error': 'unauthorized'}, status=401)
+    try:
+        data, is_individual, is_personal_use = parse_quote_request(parse_json(await request.read()))
+    except ValueError as e:
+        API_QUOTES.labels("quote", "error").inc()
+        return web.json_response({'error': str(e)}, status=400, dumps=json_dumps)
+    
+    rates = await get_currency_rates()
+    quote, _ = cached_quote(data, rates, is_individual, is_personal_use)
+    API_QUOTES.labels("quote", "ok").inc()
+    return web.json_response(quote_json(data, quote, rates), dumps=json_dumps)
+
+# Пакетный расчет: на входе NDJSON (один запрос на строку, необязательное поле id),
+# на выходе NDJSON в том же порядке. Строки читаются и отдаются потоком,
+# ни запрос, ни ответ целиком в памяти не собираются. Весь пакет считается
+# по одному снимку курсов
+async def api_quote_batch_handler(request):
+    if not api_authorized(request):
+        return web.json_response({'error': 'unauthorized'}, status=401)
+    
+    rates = await get_currency_rates()
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson; charset=utf-8'})
+    await response.prepare(request)
+    
+    chunk = []
+    line_no = 0
+    ok = failed = 0
+    try:
+        async for raw in request.content:
+            if not raw.strip():
+                continue
+            line_no += 1
+            if line_no > API_BATCH_LIMIT:
+                chunk.append({'line': line_no, 'error': f"Не больше {API_BATCH_LIMIT} расчетов за запрос"})
+                break
+            
+            item = None
+            try:
+                item = parse_json(raw)
+                data, is_individual, is_personal_use = parse_quote_request(item)
+                quote, _ = cached_quote(data, rates, is_individual, is_personal_use)
+                result = {'line': line_no, **quote_json(data, quote, rates)}
+                ok += 1
+            except ValueError as e:
+                result = {'line': line_no, 'error': str(e)}
+                failed += 1
+            except Exception as e:
+                # Ошибка одной строки не должна обрывать ответ на середине
+                logger.error(f"API: ошибка расчета в строке {line_no} пакета: {e}", exc_info=True)
+                result = {'line': line_no, 'error': "Внутренняя ошибка расчета"}
+                failed += 1
+            if isinstance(item, dict) and 'id' in item:
+                result = {'id': item['id'], **result}
+            chunk.append(result)
+            
+            if len(chunk) >= API_BATCH_CHUNK:
+                await response.write("".join(json_dumps(result) + "\n" for result in chunk).encode('utf-8'))
+                chunk.clear()
+                # Длинный пакет не должен задерживать обработку обновлений бота
+                await asyncio.sleep(0)
+        
+        if chunk:
+            await response.write("".join(json_dumps(result) + "\n" for result in chunk).encode('utf-8'))
+        await response.write_eof()
+    finally:
+        API_QUOTES.labels("batch", "ok").inc(ok)
+        API_QUOTES.labels("batch", "error").inc(failed)
+        logger.info(f"API: пакетный расчет, строк {line_no}, ошибок {failed}")
+    return response
+
+def parse_json(raw: bytes):
+    try:
+        return json.loads(raw)
+    except ValueError:
+        raise ValueError("Некорректный JSON")
+
+def json_dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+# Вебхук: проверка секрета, мгновенный ответ 200 и обработка в фоне
+webhook_tasks = set()
+
+async def process_webhook_update(update: dict):
+    try:
+        await dp.feed_raw_update(bot, update)
+    except Exception as e:
+        logger.error(f"Ошибка обработки обновления из вебхука: {e}", exc_info=True)
+
+async def webhook_handler(request):
+    if WEBHOOK_SECRET:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token, WEBHOOK_SECRET):
+            logger.warning(f"Вебхук: неверный секретный токен от {request.remote}")
+            return web.Response(status=401)
+    
+    try:
+        update = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+    
+    task = asyncio.create_task(process_webhook_update(update))
+    webhook_tasks.add(task)
+    task.add_done_callback(webhook_tasks.discard)
+    return web.Response()
+
 app = web.Application()
-app.add_routes([web.get('/', health_check)])
+app.add_routes([
+    web.get('/', health_check),
+    web.get('/health', health_details_handler),
+    web.get('/stats', stats_handler),
+    web.get('/metrics', metrics_handler),
+    web.post('/api/quote', api_quote_handler),
+    web.post('/api/quote/batch', api_quote_batch_handler)
+])
+if BOT_MODE == "webhook":
+    app.add_routes([web.post(WEBHOOK_PATH, webhook_handler)])
 
 async def start_webapp():
     runner = web.AppRunner(app)
@@ -869,10 +1633,34 @@ async def start_webapp():
     await site.start()
     logger.info("HTTP server started on port 8000")
 
+# Диагностика окружения в фоне: subprocess и requests работают в отдельном потоке
+diagnostics_tasks = set()
+
+async def background_diagnostics():
+    global startup_diagnostics
+    startup_diagnostics = {'status': 'running'}
+    try:
+        result = await asyncio.to_thread(run_diagnostics)
+        startup_diagnostics = {'status': 'done', **result}
+        if result['errors']:
+            logger.warning(f"⚠️ Диагностика окружения завершена с ошибками: {result['errors']}")
+        else:
+            logger.info(f"✅ Диагностика окружения завершена за {result['duration']} с")
+    except Exception as e:
+        startup_diagnostics = {'status': 'failed', 'errors': [str(e)]}
+        logger.error(f"Ошибка диагностики окружения: {e}", exc_info=True)
+
+async def on_startup():
+    cold_start['ready'] = round(time.perf_counter() - PROCESS_STARTED_AT, 3)
+    logger.info(f"⏱ Холодный старт: бот готов принимать обновления через {cold_start['ready']} с")
+    if FAST_START and startup_diagnostics['status'] == 'pending':
+        task = asyncio.create_task(background_diagnostics())
+        diagnostics_tasks.add(task)
+        task.add_done_callback(diagnostics_tasks.discard)
+    await broadcast_runner.resume()
+
 # Запуск приложения
-async def main():
-    dp.errors.register(global_error_handler)
-    
+async def run_polling():
     # ДОБАВЛЕНО: Очистка вебхуков перед запуском long-polling
     try:
         logger.info("🔄 Очистка старых вебхуков...")
@@ -881,6 +1669,43 @@ async def main():
     except Exception as e:
         logger.error(f"❌ Ошибка при очистке вебхуков: {e}")
     
+    logger.info("🚀 Запуск бота (polling)...")
+    await dp.start_polling(bot)
+
+async def run_webhook():
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info(f"🚀 Запуск бота (webhook): {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    
+    await dp.emit_startup(bot=bot)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        if webhook_tasks:
+            await asyncio.wait(webhook_tasks, timeout=10)
+        await dp.emit_shutdown(bot=bot)
+
+async def main():
+    dp.errors.register(global_error_handler)
+    dp.startup.register(on_startup)
+    
+    if LOOP_DEBUG:
+        enable_loop_debug(LOOP_SLOW_CALLBACK)
+    if LOOP_WATCHDOG:
+        loop_watchdog.start()
+    
+    prefetch_task = None
+    if RATES_PREFETCH:
+        prefetch_task = asyncio.create_task(rates_prefetcher.run())
+    
+    try:
+        await subscription_resolver.resolve_channel()
+    except Exception as e:
+        logger.error(f"❌ Не удалось получить id канала {CHANNEL_ID}: {e}")
+    
     try:
         await start_webapp()
         logger.info("🟢 HTTP-сервер успешно запущен")
@@ -888,35 +1713,48 @@ async def main():
         logger.error(f"🔴 Ошибка запуска HTTP-сервера: {e}")
     
     try:
-        logger.info("🚀 Запуск бота...")
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook" and WEBHOOK_URL:
+            try:
+                await run_webhook()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Не удалось включить вебхук, переход на polling: {e}")
+                await run_polling()
+        else:
+            if BOT_MODE == "webhook":
+                logger.error("❌ WEBHOOK_URL не задан, используется polling")
+            await run_polling()
     except Exception as e:
         logger.critical(f"💥 КРИТИЧЕСКАЯ ОШИБКА: {e}")
         logger.exception("Трассировка ошибки")
+    finally:
+        logger.info(f"Статистика кэша курсов: {rates_client.stats()}")
+        logger.info(f"Статистика кэша подписок: {subscription_resolver.stats()}")
+        logger.info(f"Статистика кэша расчетов: {quote_cache.stats()}")
+        if LOOP_WATCHDOG:
+            stats = loop_watchdog.stats()
+            logger.info(f"Лаг event loop: p50={stats['lag_ms_p50']} мс, p99={stats['lag_ms_p99']} мс, "
+                        f"max={stats['lag_ms_max']} мс, блокировок: {stats['stalls']}")
+            await loop_watchdog.stop()
+        if prefetch_task is not None:
+            prefetch_task.cancel()
+        await broadcast_runner.close()
+        await sqlite_thread.run(quote_history.close)
+        await sqlite_thread.run(user_registry.close)
+        await rates_client.close()
+        await asyncio.to_thread(sqlite_thread.close)
+        for pool in http_pools:
+            logger.info(f"Статистика HTTP-пула {pool.name}: {pool.stats()}")
+        await asyncio.gather(*(pool.close() for pool in http_pools))
 
 if __name__ == "__main__":
     print("\n" + "="*60)
-    print("ФИНАЛЬНАЯ ПРОВЕРКА СИСТЕМЫ:")
     print(f"Python: {sys.version}")
     print(f"Путь к интерпретатору: {sys.executable}")
-    
-    try:
-        import requests
-        print(f"✅ requests: {requests.__version__}")
-        
-        print("\n🔧 ПОСЛЕДНИЙ ТЕСТ СЕТИ:")
-        r = requests.get("https://httpbin.org/get", timeout=10)
-        print(f"HTTP-статус: {r.status_code}")
-        print(f"IP-адрес: {r.json().get('origin', 'неизвестен')}")
-        
-    except Exception as e:
-        print(f"❌ ФАТАЛЬНАЯ ОШИБКА: {str(e)}")
-        import traceback
-        traceback.print_exc()
-    
+    if FAST_START:
+        print("Быстрый старт: диагностика окружения будет выполнена в фоне")
     print("="*60)
     print("⚡ ВСЕ СИСТЕМЫ ГОТОВЫ К РАБОТЕ\n")
     
     asyncio.run(main())
-
-
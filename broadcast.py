@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import deque
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from metrics import Counter
+from send_scheduler import PRIORITY_BROADCAST, priority
+from sqlite_thread import SQLiteThread
+from users import AUDIENCES, UserRegistry
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_MESSAGES = Counter("bot_broadcast_messages_total", "Сообщения рассылок", ["result"])
+
+JOB_FIELDS = ("id", "audience", "text", "parse_mode", "status", "cursor",
+              "sent", "blocked", "failed", "created_at", "updated_at", "finished_at")
+
+
+# Рассылки по реестру пользователей.
+# Получатели обходятся по возрастанию chat_id, сообщения уходят параллельно
+# (не больше concurrency одновременно) в полосе рассылок SendScheduler,
+# который держит темп на пределе лимитов Telegram. Раз в checkpoint_interval
+# секунд в базу пишется контрольная точка (chat_id, до которого все отправки
+# завершены, и счетчики), поэтому после падения рассылка продолжается с нее,
+# и повторно сообщение получат только те, кому оно отправлялось в последние секунды.
+# Запросы к базе во время рассылки выполняются в потоке SQLiteThread (db).
+class BroadcastRunner:
+    def __init__(self, bot: Bot, registry: UserRegistry, concurrency: int = 30,
+                 page_size: int = 500, checkpoint_interval: float = 1.0, db: SQLiteThread = None):
+        self.bot = bot
+        self.registry = registry
+        self.db = db if db is not None else SQLiteThread("broadcast")
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.checkpoint_interval = checkpoint_interval
+        self._tasks = {}
+
+        # Задания хранятся рядом с реестром, в том же файле
+        self._db = sqlite3.connect(registry.path, isolation_level=None, check_same_thread=False, timeout=5)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS broadcasts ("
+            " id INTEGER PRIMARY KEY,"
+            " audience TEXT NOT NULL,"
+            " text TEXT NOT NULL,"
+            " parse_mode TEXT,"
+            " status TEXT NOT NULL,"
+            " cursor INTEGER,"
+            " sent INTEGER NOT NULL DEFAULT 0,"
+            " blocked INTEGER NOT NULL DEFAULT 0,"
+            " failed INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " finished_at REAL)"
+        )
+
+    def create(self, text: str, audience: str = "all", parse_mode: str = "HTML") -> int:
+        if audience not in AUDIENCES:
+            raise ValueError(f"Неизвестная аудитория рассылки: {audience}")
+        now = time.time()
+        return self._db.execute(
+            "INSERT INTO broadcasts (audience, text, parse_mode, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'pending', ?, ?)",
+            (audience, text, parse_mode, now, now)
+        ).lastrowid
+
+    def job(self, job_id: int):
+        row = self._db.execute(
+            f"SELECT {', '.join(JOB_FIELDS)} FROM broadcasts WHERE id = ?", (job_id,)
+        ).fetchone()
+        return dict(zip(JOB_FIELDS, row)) if row else None
+
+    def last_jobs(self, limit: int = 5) -> list:
+        rows = self._db.execute(
+            f"SELECT {', '.join(JOB_FIELDS)} FROM broadcasts ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [dict(zip(JOB_FIELDS, row)) for row in rows]
+
+    # Значения снимаются в event loop, в поток уходит только запрос
+    async def _checkpoint(self, job: dict):
+        job['updated_at'] = time.time()
+        await self.db.run(
+            self._db.execute,
+            "UPDATE broadcasts SET status = ?, cursor = ?, sent = ?, blocked = ?, failed = ?, "
+            "updated_at = ?, finished_at = ? WHERE id = ?",
+            (job['status'], job['cursor'], job['sent'], job['blocked'], job['failed'],
+             job['updated_at'], job['finished_at'], job['id'])
+        )
+
+    # Запуск задания в фоне; повторный запуск того же задания не создает второй задачи
+    def start(self, job_id: int) -> asyncio.Task:
+        task = self._tasks.get(job_id)
+        if task is None or task.done():
+            task = self._tasks[job_id] = asyncio.create_task(self.run(job_id))
+            task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+        return task
+
+    # Незавершенные после перезапуска задания продолжаются с контрольной точки
+    async def resume(self) -> list:
+        job_ids = await self.db.run(self._unfinished)
+        for job_id in job_ids:
+            logger.info(f"📨 Продолжение рассылки #{job_id}")
+            self.start(job_id)
+        return job_ids
+
+    def _unfinished(self) -> list:
+        return [row[0] for row in self._db.execute(
+            "SELECT id FROM broadcasts WHERE status IN ('pending', 'running') ORDER BY id"
+        )]
+
+    async def run(self, job_id: int) -> dict:
+        job = await self.db.run(self.job, job_id)
+        if job is None or job['status'] == 'done':
+            return job
+        job['status'] = 'running'
+        await self._checkpoint(job)
+        recipients = await self.db.run(self.registry.count, job['audience'])
+        logger.info(f"📨 Рассылка #{job_id} ({job['audience']}): "
+                    f"{recipients} получателей, продолжение после {job['cursor']}")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # Отправки в порядке chat_id; контрольная точка - последний chat_id,
+        # до которого включительно все отправки завершены
+        window = deque()
+        started = checkpointed = time.monotonic()
+        sent_before = job['sent']
+        try:
+            with priority(PRIORITY_BROADCAST):
+                after = job['cursor']
+                while True:
+                    chat_ids = await self.db.run(
+                        self.registry.recipients, job['audience'], after=after, limit=self.page_size
+                    )
+                    if not chat_ids:
+                        break
+                    for chat_id in chat_ids:
+                        await semaphore.acquire()
+                        task = asyncio.create_task(self._send(chat_id, job))
+                        task.add_done_callback(lambda _: semaphore.release())
+                        window.append((chat_id, task))
+                        await self._advance(job, window)
+                        if time.monotonic() - checkpointed >= self.checkpoint_interval:
+                            await self._checkpoint(job)
+                            checkpointed = time.monotonic()
+                    after = chat_ids[-1]
+                await asyncio.gather(*(task for _, task in window))
+        finally:
+            for _, task in window:
+                task.cancel()
+            await self._advance(job, window)
+            await self._checkpoint(job)
+
+        job['status'] = 'done'
+        job['finished_at'] = time.time()
+        await self._checkpoint(job)
+        elapsed = time.monotonic() - started
+        logger.info(f"✅ Рассылка #{job_id} завершена: отправлено {job['sent']}, заблокировали бота "
+                    f"{job['blocked']}, ошибок {job['failed']}, "
+                    f"{(job['sent'] - sent_before) / elapsed if elapsed else 0:.1f} сообщений/с")
+        return job
+
+    # Учет завершенных отправок с начала окна
+    async def _advance(self, job: dict, window: deque):
+        blocked = []
+        while window and window[0][1].done() and not window[0][1].cancelled():
+            chat_id, task = window.popleft()
+            result = task.result()
+            job[result] += 1
+            job['cursor'] = chat_id
+            if result == "blocked":
+                blocked.append(chat_id)
+        if blocked:
+            await self.db.run(self.registry.mark_blocked, blocked)
+
+    async def _send(self, chat_id: int, job: dict) -> str:
+        try:
+            await self.bot.send_message(
+                chat_id, job['text'], parse_mode=job['parse_mode'], disable_web_page_preview=True
+            )
+            result = "sent"
+        except TelegramForbiddenError:
+            # Бот заблокирован или аккаунт удален
+            result = "blocked"
+        except TelegramBadRequest as e:
+            result = "blocked" if "chat not found" in e.message.lower() else "failed"
+            if result == "failed":
+                logger.warning(f"Рассылка #{job['id']}: чат {chat_id} отклонил сообщение: {e.message}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result = "failed"
+            logger.warning(f"Рассылка #{job['id']}: не удалось отправить в чат {chat_id}: {e}")
+        BROADCAST_MESSAGES.labels(result).inc()
+        return result
+
+    async def stats(self) -> dict:
+        return {
+            'running': sorted(self._tasks),
+            'jobs': await self.db.run(self.last_jobs),
+        }
+
+    # Остановка: задания остаются в статусе running и продолжаются после запуска
+    async def close(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.db.run(self._db.close)
@@ -0,0 +1,76 @@
+import os
+import subprocess
+import sys
+import time
+
+# Системная диагностика окружения: Python, pip, requests и доступ в интернет.
+# Функция блокирующая (subprocess, сетевой запрос), поэтому в режиме быстрого
+# старта бот запускает ее в отдельном потоке уже после начала работы.
+
+
+def run_diagnostics() -> dict:
+    started = time.monotonic()
+    result = {
+        'python': sys.version,
+        'executable': sys.executable,
+        'cwd': os.getcwd(),
+        'pip': None,
+        'requests': None,
+        'network': None,
+        'errors': [],
+    }
+
+    print("=" * 60)
+    print("🚀 СИСТЕМНАЯ ДИАГНОСТИКА ПРИ ЗАПУСКЕ")
+
+    # 1. Проверка версии Python
+    print(f"\n🐍 Версия Python: {sys.version}")
+    print(f"📂 Рабочая директория: {os.getcwd()}")
+
+    # 2. Проверка установки pip
+    try:
+        import pip
+        result['pip'] = pip.__version__
+        print(f"✅ pip установлен, версия: {pip.__version__}")
+    except ImportError:
+        print("❌ pip не установлен! Попытка установки...")
+        try:
+            subprocess.check_call([sys.executable, "-m", "ensurepip", "--default-pip"])
+        except Exception as e:
+            result['errors'].append(f"ensurepip: {e}")
+
+    # 3. Проверка requests
+    try:
+        import requests
+        print(f"✅ requests установлена, версия: {requests.__version__}")
+    except ImportError:
+        print("❌ requests не установлена! Выполняю принудительную установку...")
+        try:
+            subprocess.check_call([sys.executable, "-m", "pip", "install", "requests==2.31.0"])
+            import requests
+            print(f"✅ requests успешно установлена, версия: {requests.__version__}")
+        except Exception as e:
+            result['errors'].append(f"requests: {e}")
+            requests = None
+    if requests is not None:
+        result['requests'] = requests.__version__
+
+    # 4. Проверка сети
+    print("\n🌐 ТЕСТ СЕТЕВОГО ПОДКЛЮЧЕНИЯ:")
+    if requests is not None:
+        try:
+            response = requests.get("https://httpbin.org/get", timeout=10)
+            result['network'] = {
+                'status': response.status_code,
+                'ip': response.json().get('origin', 'неизвестен')
+            }
+            print(f"Статус: {response.status_code}")
+            print(f"IP-адрес: {result['network']['ip']}")
+        except Exception as e:
+            result['errors'].append(f"network: {e}")
+            print(f"❌ СЕТЕВАЯ ОШИБКА: {str(e)}")
+            print("Проверьте подключение контейнера к интернету")
+
+    result['duration'] = round(time.monotonic() - started, 3)
+    print("=" * 60)
+    return result
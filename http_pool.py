@@ -0,0 +1,198 @@
+import logging
+import ssl
+import time
+from collections import deque
+
+import aiohttp
+import certifi
+from aiogram.client.session.aiohttp import AiohttpSession
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+HTTP_CONNECT_LATENCY = Histogram(
+    "http_connect_duration_seconds", "Время установки нового соединения (DNS, TCP, TLS)", ["pool"]
+)
+HTTP_POOL_WAIT = Histogram("http_pool_wait_seconds", "Ожидание свободного соединения в пуле", ["pool"])
+HTTP_CONNECTIONS = Counter("http_connections_total", "Запросы по новым и повторно используемым соединениям",
+                           ["pool", "connection"])
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# Пул HTTP-соединений к одному внешнему сервису.
+# Одна ClientSession на весь процесс: соединения держатся открытыми keepalive
+# секунд и переиспользуются, DNS кэшируется на dns_ttl секунд, одновременно
+# открыто не больше limit соединений (limit_per_host на один хост).
+# Таймаут connect ограничивает установку соединения, read - паузу между
+# пакетами ответа; total задается на запрос. Сессия создается при первом
+# запросе внутри event loop и закрывается при остановке бота.
+class HttpPool:
+    def __init__(self, name: str, limit: int = 100, limit_per_host: int = 0, dns_ttl: int = 300,
+                 keepalive: float = 30, connect_timeout: float = 5, read_timeout: float = 30,
+                 total_timeout: float = None, headers: dict = None):
+        self.name = name
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.headers = headers
+        self._session = None
+        self._connections_warned = False
+
+        self.connects = 0
+        self.reused = 0
+        self.queued = 0
+        self.dns_hits = 0
+        self.dns_misses = 0
+        # Последние замеры для перцентилей в /stats
+        self._connect_times = deque(maxlen=500)
+        self._wait_times = deque(maxlen=500)
+
+    def timeout(self, total: float = None) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(
+            total=total if total is not None else self.total_timeout,
+            sock_connect=self.connect_timeout,
+            sock_read=self.read_timeout
+        )
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=self.keepalive,
+                ssl=ssl.create_default_context(cafile=certifi.where()),
+                enable_cleanup_closed=True
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=self.timeout(),
+                trace_configs=[self._trace_config()]
+            )
+            logger.info(f"🔌 HTTP-пул {self.name}: до {self.limit} соединений "
+                        f"(на хост {self.limit_per_host or 'без ограничения'}), keep-alive {self.keepalive} с")
+        return self._session
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def queued_start(session, context, params):
+            context.queued_at = time.perf_counter()
+
+        async def queued_end(session, context, params):
+            elapsed = time.perf_counter() - context.queued_at
+            self.queued += 1
+            self._wait_times.append(elapsed)
+            HTTP_POOL_WAIT.labels(self.name).observe(elapsed)
+
+        async def create_start(session, context, params):
+            context.connect_at = time.perf_counter()
+
+        async def create_end(session, context, params):
+            elapsed = time.perf_counter() - context.connect_at
+            self.connects += 1
+            self._connect_times.append(elapsed)
+            HTTP_CONNECT_LATENCY.labels(self.name).observe(elapsed)
+            HTTP_CONNECTIONS.labels(self.name, "new").inc()
+
+        async def reuse(session, context, params):
+            self.reused += 1
+            HTTP_CONNECTIONS.labels(self.name, "reused").inc()
+
+        async def dns_hit(session, context, params):
+            self.dns_hits += 1
+
+        async def dns_miss(session, context, params):
+            self.dns_misses += 1
+
+        trace.on_connection_queued_start.append(queued_start)
+        trace.on_connection_queued_end.append(queued_end)
+        trace.on_connection_create_start.append(create_start)
+        trace.on_connection_create_end.append(create_end)
+        trace.on_connection_reuseconn.append(reuse)
+        trace.on_dns_cache_hit.append(dns_hit)
+        trace.on_dns_cache_miss.append(dns_miss)
+        return trace
+
+    # Занятые и свободные соединения по хостам. У TCPConnector нет публичного
+    # API для этого, поэтому читаются его внутренние структуры _acquired_per_host
+    # и _conns - они сверены с aiohttp 3.8-3.9 (requirements.txt: 3.9.3).
+    # Если после обновления aiohttp их не окажется, статистика покажет None
+    # вместо нулей, а в лог один раз попадет предупреждение
+    def _connections(self):
+        connector = self._session.connector if self._session is not None and not self._session.closed else None
+        if connector is None:
+            return {}
+        hosts = {}
+        try:
+            acquired, conns = connector._acquired_per_host, connector._conns
+        except AttributeError as e:
+            if not self._connections_warned:
+                self._connections_warned = True
+                logger.warning(f"⚠️ Нет данных о соединениях пула {self.name}, несовместимая версия aiohttp: {e}")
+            return None
+        for key, protocols in acquired.items():
+            hosts.setdefault(f"{key.host}:{key.port}", {'in_use': 0, 'idle': 0})['in_use'] = len(protocols)
+        for key, idle in conns.items():
+            hosts.setdefault(f"{key.host}:{key.port}", {'in_use': 0, 'idle': 0})['idle'] = len(idle)
+        return hosts
+
+    def stats(self) -> dict:
+        hosts = self._connections()
+        connect_times = list(self._connect_times)
+        wait_times = list(self._wait_times)
+        return {
+            'in_use': sum(host['in_use'] for host in hosts.values()) if hosts is not None else None,
+            'idle': sum(host['idle'] for host in hosts.values()) if hosts is not None else None,
+            'hosts': hosts,
+            'limit': self.limit,
+            'limit_per_host': self.limit_per_host,
+            'connects': self.connects,
+            'reused': self.reused,
+            'connect_ms_p50': round(_percentile(connect_times, 0.5) * 1000, 1),
+            'connect_ms_p99': round(_percentile(connect_times, 0.99) * 1000, 1),
+            'connect_ms_max': round(max(connect_times, default=0) * 1000, 1),
+            'queued': self.queued,
+            'queue_wait_ms_max': round(max(wait_times, default=0) * 1000, 1),
+            'dns_cache_hits': self.dns_hits,
+            'dns_cache_misses': self.dns_misses,
+        }
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info(f"🔌 HTTP-пул {self.name} закрыт: {self.connects} соединений, "
+                        f"{self.reused} повторных использований")
+
+
+# Сессия aiogram поверх общего пула
+class PooledAiohttpSession(AiohttpSession):
+    def __init__(self, pool: HttpPool, **kwargs):
+        super().__init__(**kwargs)
+        self.pool = pool
+
+    async def create_session(self) -> aiohttp.ClientSession:
+        return self.pool.session
+
+    async def make_request(self, bot, method, timeout=None):
+        # aiogram передает таймаут числом, и aiohttp сделал бы из него только
+        # общий таймаут, без ограничений на соединение и чтение
+        return await super().make_request(
+            bot, method, self.pool.timeout(total=self.timeout if timeout is None else timeout)
+        )
+
+    async def close(self):
+        await self.pool.close()
@@ -0,0 +1,153 @@
+import atexit
+import copy
+import itertools
+import json
+import logging
+import queue
+import time
+from datetime import datetime, timedelta, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Неблокирующее логирование: event loop только кладет запись в очередь,
+# форматирование и запись на диск выполняет поток QueueListener.
+
+DEFAULT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+# Ротация и по размеру, и по времени (when: H - каждый час, D/midnight - в полночь).
+# Архивы нумеруются как у RotatingFileHandler: bot.log.1 ... bot.log.N
+class SizeTimeRotatingFileHandler(RotatingFileHandler):
+    def __init__(self, filename: str, max_bytes: int = 0, when: str = None,
+                 backup_count: int = 5, encoding: str = 'utf-8'):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding, delay=True)
+        self.when = when.upper() if when else None
+        if self.when not in (None, 'H', 'D', 'MIDNIGHT'):
+            raise ValueError(f"Неизвестный интервал ротации логов: {when}")
+        self.rollover_at = self._next_rollover(time.time())
+
+    def _next_rollover(self, now: float) -> float:
+        if self.when is None:
+            return float('inf')
+        current = datetime.fromtimestamp(now)
+        if self.when == 'H':
+            boundary = current.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        else:
+            boundary = current.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        return boundary.timestamp()
+
+    def shouldRollover(self, record) -> bool:
+        if time.time() >= self.rollover_at:
+            return True
+        return bool(self.maxBytes) and super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = self._next_rollover(time.time())
+
+
+# Запись уходит в очередь уже подготовленной: сообщение подставлено, а
+# traceback отформатирован в exc_text. Стандартный prepare() дописывает
+# traceback в msg и очищает exc_text, и JsonFormatter в потоке
+# QueueListener не смог бы вывести его отдельным полем exc
+class ExcQueueHandler(QueueHandler):
+    _exc_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# Компактный JSON lines: одна запись - одна строка
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# Выборка шумных логгеров: из N записей ниже WARNING проходит одна.
+# Правило логгера действует и на его дочерние логгеры (aiogram -> aiogram.event).
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+        self._counters = {name: itertools.count() for name in rates}
+        self._resolved = {}
+
+    def _rule(self, name: str):
+        if name not in self._resolved:
+            rule = None
+            parts = name.split('.')
+            for i in range(len(parts), 0, -1):
+                prefix = '.'.join(parts[:i])
+                if prefix in self.rates:
+                    rule = prefix
+                    break
+            self._resolved[name] = rule
+        return self._resolved[name]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rule = self._rule(record.name)
+        if rule is None:
+            return True
+        every = self.rates[rule]
+        return every > 0 and next(self._counters[rule]) % every == 0
+
+
+# "aiogram.event=10,rates=5" -> {"aiogram.event": 10, "rates": 5}
+def parse_sampling(spec: str) -> dict:
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, every = item.partition('=')
+        rates[name.strip()] = int(every)
+    return rates
+
+
+def setup_logging(path: str = "bot.log", level: int = logging.INFO, fmt: str = "text",
+                  max_bytes: int = 10 * 1024 * 1024, when: str = None, backup_count: int = 5,
+                  sampling: dict = None) -> QueueListener:
+    formatter = JsonFormatter() if fmt == "json" else logging.Formatter(DEFAULT_FORMAT)
+
+    handlers = [logging.StreamHandler()]
+    if path:
+        handlers.append(SizeTimeRotatingFileHandler(path, max_bytes=max_bytes, when=when, backup_count=backup_count))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = ExcQueueHandler(log_queue)
+    if sampling:
+        queue_handler.addFilter(SamplingFilter(sampling))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_listener, listener)
+    return listener
+
+
+# Дописывает оставшиеся в очереди записи; повторный вызов безопасен
+def stop_listener(listener: QueueListener):
+    if listener._thread is not None:
+        listener.stop()
+
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "Задержка срабатывания таймера event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+LOOP_STALLS = Counter("event_loop_stalls_total", "Блокировки event loop дольше порога")
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# Сторож event loop.
+# Задача в loop раз в interval секунд засекает, насколько позже срока она
+# проснулась (лаг), и отмечает время последнего срабатывания. Отдельный поток
+# следит за этой отметкой: если loop не отвечает дольше threshold, поток
+# снимает стек потока loop (sys._current_frames) - это и есть блокирующий код.
+# Стеки группируются по месту в коде проекта; в stats() - перцентили лага и
+# места с наибольшим суммарным временем блокировки.
+class LoopWatchdog:
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25, window: int = 3000,
+                 max_offenders: int = 20, stack_limit: int = 12):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_offenders = max_offenders
+        self.stack_limit = stack_limit
+
+        self._lags = deque(maxlen=window)
+        self._offenders = {}
+        self._lock = threading.Lock()
+        self._beat = time.monotonic()
+        self._captured_beat = None
+        self._pending = None
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self.stalls = 0
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"🐶 Сторож event loop: проверка каждые {self.interval * 1000:.0f} мс, "
+                    f"порог блокировки {self.threshold * 1000:.0f} мс")
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join, 1)
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - started - self.interval, 0.0)
+            previous, self._beat = self._beat, time.monotonic()
+            self._lags.append(lag)
+            LOOP_LAG.observe(lag)
+
+            # Блокировку поймал поток-сторож: теперь известна ее полная длительность
+            pending, self._pending = self._pending, None
+            if pending is not None:
+                location, beat, stalled = pending
+                self._finish_stall(location, max(lag, stalled) if beat == previous else stalled)
+
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 4):
+            beat = self._beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.threshold or self._captured_beat == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            self._captured_beat = beat
+            stack = traceback.extract_stack(frame)[-self.stack_limit:]
+            del frame
+            self._pending = (self._record_stall(stack, stalled), beat, stalled)
+
+    # Место блокировки - самый глубокий кадр из кода проекта, а если его нет
+    # (блокирует библиотека сама по себе) - самый глубокий кадр вообще
+    @staticmethod
+    def _location(stack) -> str:
+        for entry in reversed(stack):
+            if (entry.filename.startswith(PROJECT_DIR) and entry.filename != os.path.abspath(__file__)
+                    and "site-packages" not in entry.filename):
+                break
+        else:
+            entry = stack[-1]
+        return f"{os.path.relpath(entry.filename, PROJECT_DIR)}:{entry.lineno} {entry.name}"
+
+    def _record_stall(self, stack, stalled: float) -> str:
+        location = self._location(stack)
+        with self._lock:
+            offender = self._offenders.get(location)
+            if offender is None:
+                if len(self._offenders) >= self.max_offenders:
+                    # Вытесняется место с наименьшим суммарным временем блокировки
+                    del self._offenders[min(self._offenders, key=lambda key: self._offenders[key]['total'])]
+                offender = self._offenders[location] = {'count': 0, 'total': 0.0, 'max': 0.0}
+            offender['count'] += 1
+            offender['last_seen'] = time.time()
+            offender['stack'] = [f"{entry.filename}:{entry.lineno} {entry.name}: {entry.line}" for entry in stack]
+        logger.warning(f"🐢 Event loop заблокирован уже {stalled * 1000:.0f} мс: {location}\n"
+                       + "".join(traceback.format_list(stack)))
+        return location
+
+    def _finish_stall(self, location: str, lag: float):
+        self.stalls += 1
+        LOOP_STALLS.inc()
+        with self._lock:
+            offender = self._offenders.get(location)
+            if offender is not None:
+                offender['total'] += lag
+                offender['max'] = max(offender['max'], lag)
+        logger.warning(f"🐢 Event loop был заблокирован {lag * 1000:.0f} мс: {location}")
+
+    def stats(self) -> dict:
+        lags = sorted(self._lags)
+        with self._lock:
+            offenders = sorted(self._offenders.items(), key=lambda item: item[1]['total'], reverse=True)
+            offenders = [{
+                'where': location,
+                'count': offender['count'],
+                'total_ms': round(offender['total'] * 1000, 1),
+                'max_ms': round(offender['max'] * 1000, 1),
+                'last_seen': offender['last_seen'],
+                'stack': offender['stack'],
+            } for location, offender in offenders]
+        return {
+            'lag_ms_p50': round(_percentile(lags, 0.5) * 1000, 2),
+            'lag_ms_p90': round(_percentile(lags, 0.9) * 1000, 2),
+            'lag_ms_p99': round(_percentile(lags, 0.99) * 1000, 2),
+            'lag_ms_max': round(max(lags, default=0) * 1000, 2),
+            'samples': len(lags),
+            'threshold_ms': self.threshold * 1000,
+            'stalls': self.stalls,
+            'offenders': offenders,
+        }
+
+
+# Отладочный режим asyncio: предупреждения о колбэках дольше
+# slow_callback_duration секунд, незавершенных корутинах и вызовах loop
+# из других потоков. Заметно замедляет работу, только для отладки
+def enable_loop_debug(slow_callback_duration: float = 0.1):
+    loop = asyncio.get_running_loop()
+    loop.set_debug(True)
+    loop.slow_callback_duration = slow_callback_duration
+    logger.warning(f"🐞 Отладочный режим asyncio: медленные колбэки дольше {slow_callback_duration * 1000:.0f} мс")
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import logging
+import os
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+logger = logging.getLogger(__name__)
+
+# Ошибки Telegram, означающие, что сам file_id непригоден (чужой бот, другой
+# сервер Bot API, устаревшая ссылка на файл). Прочие ошибки (разметка подписи,
+# клавиатура) к file_id отношения не имеют
+FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file identifier", "file reference",
+                  "file_id_invalid", "wrong padding")
+
+
+def is_file_id_error(error: TelegramBadRequest) -> bool:
+    text = error.message.lower()
+    return any(marker in text for marker in FILE_ID_ERRORS)
+
+
+# Кэш file_id медиафайлов.
+# Файл загружается в Telegram один раз, затем отправляется по file_id без
+# повторного скачивания с сайта. Кэш сохраняется в JSON и переживает перезапуск.
+# file_id действителен только для бота, который загрузил файл, и только на
+# том же сервере Bot API, поэтому ключи хранятся с префиксом scope.
+class MediaCache:
+    def __init__(self, path: str = "media_cache.json", scope: str = ""):
+        self.path = path
+        self.scope = scope
+        self._file_ids = {}
+        self._locks = {}
+
+        self.hits = 0
+        self.uploads = 0
+        self.invalidations = 0
+
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self._file_ids = json.load(f)
+            logger.info(f"Загружен кэш медиафайлов: {len(self._file_ids)} шт.")
+        except Exception as e:
+            logger.error(f"Ошибка чтения кэша медиафайлов {self.path}: {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._file_ids, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения кэша медиафайлов {self.path}: {e}")
+
+    def _key(self, key: str) -> str:
+        return f"{self.scope}:{key}" if self.scope else key
+
+    def get(self, key: str):
+        return self._file_ids.get(self._key(key))
+
+    def set(self, key: str, file_id: str):
+        if self._file_ids.get(self._key(key)) != file_id:
+            self._file_ids[self._key(key)] = file_id
+            self._save()
+
+    def invalidate(self, key: str):
+        if self._file_ids.pop(self._key(key), None) is not None:
+            self.invalidations += 1
+            self._save()
+
+    # Источник для первой загрузки: локальный файл, если он есть, иначе URL
+    @staticmethod
+    def _source(source: str):
+        if os.path.isfile(source):
+            return FSInputFile(source)
+        return source
+
+    async def answer_photo(self, message: Message, key: str, source: str, **kwargs) -> Message:
+        file_id = self.get(key)
+        if file_id is not None:
+            try:
+                self.hits += 1
+                return await message.answer_photo(photo=file_id, **kwargs)
+            except TelegramBadRequest as e:
+                if not is_file_id_error(e):
+                    raise
+                # file_id принадлежит другому боту или устарел - загружаем заново
+                logger.warning(f"file_id для {key} недействителен, повторная загрузка: {e}")
+                self.invalidate(key)
+
+        # Пока идет первая загрузка, остальные ждут ее file_id
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            file_id = self.get(key)
+            if file_id is not None:
+                self.hits += 1
+                return await message.answer_photo(photo=file_id, **kwargs)
+
+            self.uploads += 1
+            sent = await message.answer_photo(photo=self._source(source), **kwargs)
+            if sent.photo:
+                self.set(key, sent.photo[-1].file_id)
+                logger.info(f"Медиафайл {key} загружен в Telegram, file_id сохранен")
+            return sent
+
+    def stats(self) -> dict:
+        return {
+            'cached': len(self._file_ids),
+            'hits': self.hits,
+            'uploads': self.uploads,
+            'invalidations': self.invalidations,
+        }
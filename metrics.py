@@ -0,0 +1,226 @@
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+
+# Минимальные метрики в формате Prometheus без внешних зависимостей.
+# Все обновления идут из одного event loop, поэтому блокировки не нужны,
+# а на горячем пути только арифметика над уже созданными объектами.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        if not self.labelnames:
+            yield from self._child_samples((), self.labels())
+            return
+        for values, child in self._children.items():
+            yield from self._child_samples(values, child)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {value}" for name, labels, value in self._samples())
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _child_samples(self, values, child):
+        yield self.name, _format_labels(self.labelnames, values), child.value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function = None
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+    # Значение вычисляется только в момент чтения /metrics
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def _child_samples(self, values, child):
+        value = child.value if self._function is None else self._function()
+        yield self.name, _format_labels(self.labelnames, values), value
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _child_samples(self, values, child):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            yield (f"{self.name}_bucket",
+                   _format_labels(self.labelnames + ("le",), tuple(values) + (le,)), cumulative)
+        yield f"{self.name}_sum", _format_labels(self.labelnames, values), child.sum
+        yield f"{self.name}_count", _format_labels(self.labelnames, values), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+# ===== Метрики бота =====
+
+UPDATES = Counter("bot_updates_total", "Обработанные обновления Telegram")
+HANDLER_LATENCY = Histogram(
+    "bot_handler_duration_seconds", "Время обработки сообщения обработчиком", ["handler"]
+)
+BOT_API_LATENCY = Histogram(
+    "bot_api_request_duration_seconds", "Время запроса к Bot API", ["method"]
+)
+BOT_API_ERRORS = Counter("bot_api_errors_total", "Ошибки запросов к Bot API", ["method"])
+CALCULATIONS = Counter(
+    "bot_calculations_total", "Завершенные расчеты стоимости", ["engine_type", "importer_type"]
+)
+API_QUOTES = Counter("bot_api_quotes_total", "Расчеты через HTTP API", ["endpoint", "result"])
+FSM_ACTIVE_SESSIONS = Gauge("bot_fsm_active_sessions", "Незавершенные анкеты расчета")
+COLD_START = Gauge(
+    "bot_cold_start_seconds", "Время от запуска процесса до первого обработанного обновления"
+)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            UPDATES.inc()
+
+
+# Middleware обработчиков: подпись метрики - имя функции-обработчика.
+# Для кнопок меню это обработчик, выбранный TextRouter (text_route)
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            handler_object = data.get("text_route") or data.get("handler")
+            name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+            HANDLER_LATENCY.labels(name).observe(time.perf_counter() - started)
+
+
+# Middleware сессии бота: время и ошибки каждого вызова Bot API
+class BotApiMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            BOT_API_ERRORS.labels(name).inc()
+            raise
+        finally:
+            BOT_API_LATENCY.labels(name).observe(time.perf_counter() - started)
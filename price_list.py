@@ -0,0 +1,232 @@
+import codecs
+import csv
+import logging
+import os
+import re
+import time
+from datetime import date, datetime
+from itertools import chain, islice
+
+from tariffs import ENGINE_TYPE_CODES, calculate_batch
+
+logger = logging.getLogger(__name__)
+
+# Поля строки прайс-листа и варианты заголовков столбцов
+HEADER_ALIASES = {
+    'price': ('цена', 'цена cny', 'стоимость', 'стоимость cny', 'price', 'price_cny'),
+    'year_month': ('год.месяц', 'дата выпуска', 'год выпуска', 'выпуск', 'year_month', 'year'),
+    'engine_type': ('двигатель', 'тип двигателя', 'топливо', 'engine', 'engine_type'),
+    'engine_volume': ('объем', 'объём', 'объем двигателя', 'объём двигателя', 'volume', 'engine_volume',
+                      'engine_volume_cc'),
+    'power': ('мощность', 'мощность двигателя', 'power'),
+    'importer': ('импортер', 'импортёр', 'importer'),
+    'purpose': ('цель', 'цель ввоза', 'purpose'),
+}
+# Порядок столбцов в файле без заголовка
+POSITIONAL_FIELDS = ('price', 'year_month', 'engine_type', 'engine_volume', 'power', 'importer', 'purpose')
+DEFAULT_HEADER = ('Цена, CNY', 'Год.месяц', 'Двигатель', 'Объем', 'Мощность', 'Импортер', 'Цель')
+
+RESULT_COLUMNS = (
+    ('price_rub', 'Цена, руб.'),
+    ('duty', 'Пошлина, руб.'),
+    ('excise', 'Акциз, руб.'),
+    ('vat', 'НДС, руб.'),
+    ('recycling', 'Утильсбор, руб.'),
+    ('total', 'Итого, руб.'),
+)
+FORMATS = ('.csv', '.xlsx')
+
+
+def file_format(filename: str) -> str:
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Поддерживаются файлы {', '.join(FORMATS)}")
+    return extension
+
+
+def _encoding(path: str) -> str:
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    with open(path, 'rb') as f:
+        try:
+            decoder.decode(f.read(65536), final=False)
+            return 'utf-8-sig'
+        except UnicodeDecodeError:
+            return 'cp1251'
+
+
+def _csv_rows(path: str):
+    with open(path, newline='', encoding=_encoding(path)) as f:
+        try:
+            dialect = csv.Sniffer().sniff(f.read(8192), delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        f.seek(0)
+        yield from csv.reader(f, dialect)
+
+
+def _xlsx_rows(path: str):
+    try:
+        import openpyxl
+    except ImportError as e:
+        raise ValueError("Файлы XLSX не поддерживаются на сервере, отправьте CSV") from e
+    # read_only: строки читаются из архива по одной, лист целиком в память не загружается
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        workbook.close()
+
+
+def _header_key(value) -> str:
+    return re.split(r"[,(]", str(value or ""))[0].strip().lower()
+
+
+# Столбцы полей по строке заголовка; None - первая строка не похожа на заголовок
+def _columns(first_row: list):
+    aliases = {alias: field for field, names in HEADER_ALIASES.items() for alias in names}
+    columns = {}
+    for i, value in enumerate(first_row):
+        field = aliases.get(_header_key(value))
+        if field is not None and field not in columns:
+            columns[field] = i
+    if 'price' in columns and 'year_month' in columns:
+        return columns
+    return None
+
+
+# Значение ячейки как текст, который ввел бы пользователь в анкете.
+# Excel хранит 2021.10 как число 2021.1, а объем 2000 как 2000.0
+def cell_text(value, field: str) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (datetime, date)):
+        return f"{value.year}.{value.month:02d}"
+    if isinstance(value, float):
+        if field == 'year_month':
+            return f"{value:.2f}"
+        if value.is_integer() and (field != 'engine_volume' or value >= 100):
+            return str(int(value))
+    return str(value).strip()
+
+
+class _CsvWriter:
+    def __init__(self, path: str):
+        self._file = open(path, 'w', newline='', encoding='utf-8-sig')
+        self._writer = csv.writer(self._file, delimiter=';')
+
+    def append(self, row):
+        self._writer.writerow(row)
+
+    def close(self):
+        self._file.close()
+
+
+class _XlsxWriter:
+    def __init__(self, path: str):
+        import openpyxl
+        self.path = path
+        # write_only: строки сразу уходят во временный файл
+        self._workbook = openpyxl.Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet("Расчет")
+
+    def append(self, row):
+        self._sheet.append(row)
+
+    def close(self):
+        self._workbook.save(self.path)
+
+
+# Расчет прайс-листа: файл читается построчно, строки проверяются parse_row
+# (та же проверка, что и в анкете) и считаются пачками по chunk_size через
+# calculate_batch. В памяти одновременно только одна пачка строк.
+# В итоговый файл добавляются столбцы платежей и ошибка строки, ошибки
+# дополнительно собираются в отдельный CSV-отчет.
+# progress(обработано строк) вызывается не чаще раза в progress_interval секунд.
+def price_file(src_path: str, out_path: str, errors_path: str, parse_row, cny_rate: float, eur_rate: float,
+               chunk_size: int = 2000, max_rows: int = 50000, progress=None,
+               progress_interval: float = 1.0) -> dict:
+    extension = file_format(src_path)
+    rows = _xlsx_rows(src_path) if extension == '.xlsx' else _csv_rows(src_path)
+    started = time.perf_counter()
+
+    first_row = next(rows, None)
+    if first_row is None:
+        raise ValueError("Файл пустой")
+    columns = _columns(first_row)
+    if columns is None:
+        columns = {field: i for i, field in enumerate(POSITIONAL_FIELDS)}
+        header = list(DEFAULT_HEADER[:len(first_row)]) + [""] * (len(first_row) - len(DEFAULT_HEADER))
+        numbered = enumerate([first_row], start=1)
+        first_data_row = 1
+    else:
+        header = [str(value) if value is not None else "" for value in first_row]
+        numbered = iter(())
+        first_data_row = 2
+    numbered_rows = chain(numbered, enumerate(rows, start=first_data_row))
+
+    writer = _XlsxWriter(out_path) if extension == '.xlsx' else _CsvWriter(out_path)
+    errors = _CsvWriter(errors_path)
+    writer.append(header + [title for _, title in RESULT_COLUMNS] + ["Ошибка"])
+    errors.append(["Строка", "Ошибка"] + header)
+
+    total = priced = failed = 0
+    reported_at = time.monotonic()
+    try:
+        while True:
+            chunk = list(islice(numbered_rows, chunk_size))
+            if not chunk:
+                break
+
+            parsed = []
+            for row_no, cells in chunk:
+                cells = list(cells)
+                if all(value is None or str(value).strip() == "" for value in cells):
+                    continue
+                total += 1
+                if total > max_rows:
+                    raise ValueError(f"В файле больше {max_rows} строк")
+                fields = {field: cell_text(cells[i] if i < len(cells) else None, field)
+                          for field, i in columns.items()}
+                try:
+                    parsed.append((row_no, cells, parse_row(fields), None))
+                except ValueError as e:
+                    parsed.append((row_no, cells, None, str(e)))
+
+            valid = [entry[2] for entry in parsed if entry[2] is not None]
+            results = _price(valid, cny_rate, eur_rate) if valid else {}
+            index = 0
+            for row_no, cells, quote_input, error in parsed:
+                if quote_input is None:
+                    failed += 1
+                    writer.append(cells + [None] * len(RESULT_COLUMNS) + [error])
+                    errors.append([row_no, error] + cells)
+                    continue
+                writer.append(cells + [round(results[key][index], 2) for key, _ in RESULT_COLUMNS] + [None])
+                index += 1
+                priced += 1
+
+            if progress is not None and time.monotonic() - reported_at >= progress_interval:
+                progress(total)
+                reported_at = time.monotonic()
+    finally:
+        writer.close()
+        errors.close()
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"Прайс-лист: строк {total}, рассчитано {priced}, ошибок {failed}, {elapsed:.2f} с")
+    return {'rows': total, 'priced': priced, 'errors': failed, 'seconds': round(elapsed, 2)}
+
+
+def _price(entries: list, cny_rate: float, eur_rate: float) -> dict:
+    result = calculate_batch(
+        [data['price'] for data, _, _ in entries],
+        [data['age_months'] for data, _, _ in entries],
+        [data.get('engine_volume_cc', 0) for data, _, _ in entries],
+        [data['engine_power'] for data, _, _ in entries],
+        [ENGINE_TYPE_CODES[data['engine_type']] for data, _, _ in entries],
+        [is_individual for _, is_individual, _ in entries],
+        [is_personal_use for _, _, is_personal_use in entries],
+        cny_rate, eur_rate
+    )
+    return {key: result[key].tolist() for key, _ in RESULT_COLUMNS}
@@ -0,0 +1,83 @@
+import logging
+from collections import OrderedDict
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+QUOTE_CACHE_REQUESTS = Counter(
+    "bot_quote_cache_requests_total", "Обращения к кэшу расчетов", ["result"]
+)
+
+
+# Ключ расчета из нормализованных данных анкеты.
+# Для электромобиля объем не влияет на расчет, для юрлица - цель ввоза,
+# поэтому они обнуляются и одинаковые по сути расчеты попадают в одну запись.
+def quote_key(data: dict, is_individual: bool, is_personal_use: bool):
+    is_electric = data.get('engine_type') == "🔋 Электрический"
+    year, month = data['year_month']
+    return (
+        float(data['price']),
+        float(year),
+        float(month),
+        int(data['age_months']),
+        data.get('engine_type'),
+        0 if is_electric else int(data.get('engine_volume_cc', 0)),
+        float(data.get('engine_power', 0)),
+        bool(is_individual),
+        bool(is_personal_use) if is_individual else None
+    )
+
+
+# LRU-кэш готовых расчетов: разбивка платежей и текст сообщения.
+# Кэш относится к одному поколению (дата курсов ЦБ, версия тарифов, день
+# расчета) и очищается целиком, как только поколение меняется.
+class QuoteCache:
+    def __init__(self, maxsize: int = 2048):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._generation = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.resets = 0
+
+    def _check_generation(self, generation):
+        if generation != self._generation:
+            if self._cache:
+                self.resets += 1
+                logger.info(f"Кэш расчетов очищен: новые курсы или тарифы {generation}")
+            self._cache.clear()
+            self._generation = generation
+
+    def get(self, generation, key):
+        self._check_generation(generation)
+        value = self._cache.get(key)
+        if value is None:
+            self.misses += 1
+            QUOTE_CACHE_REQUESTS.labels("miss").inc()
+            return None
+        self._cache.move_to_end(key)
+        self.hits += 1
+        QUOTE_CACHE_REQUESTS.labels("hit").inc()
+        return value
+
+    def put(self, generation, key, value):
+        self._check_generation(generation)
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'resets': self.resets,
+        }
@@ -0,0 +1,110 @@
+import logging
+import sqlite3
+import struct
+import time
+
+from tariffs import ENGINE_TYPE_CODES
+
+logger = logging.getLogger(__name__)
+
+ENGINE_TYPE_NAMES = {code: name for name, code in ENGINE_TYPE_CODES.items()}
+
+# Запись расчета - только исходные данные анкеты и итог на момент расчета,
+# 47 байт: время, цена CNY, год, месяц, тип двигателя, объем, мощность,
+# флаги импортера, курс CNY и итог в рублях
+RECORD = struct.Struct("<ddHBBHdBdd")
+FLAG_INDIVIDUAL = 1
+FLAG_PERSONAL_USE = 2
+
+
+def pack_quote(data: dict, is_individual: bool, is_personal_use: bool, total: float, cny_rate: float,
+               created_at: float = None) -> bytes:
+    year, month = data['year_month']
+    # Объем хранится в двух байтах: больше 65535 см³ запись не вместит
+    volume_cc = int(data.get('engine_volume_cc', 0))
+    if not 0 <= volume_cc <= 0xFFFF:
+        raise ValueError(f"Объем двигателя {volume_cc} см³ не помещается в запись истории")
+    flags = (FLAG_INDIVIDUAL if is_individual else 0) | (FLAG_PERSONAL_USE if is_personal_use else 0)
+    return RECORD.pack(
+        created_at if created_at is not None else time.time(),
+        float(data['price']),
+        int(year),
+        int(month),
+        ENGINE_TYPE_CODES[data['engine_type']],
+        volume_cc,
+        float(data.get('engine_power', 0)),
+        flags,
+        cny_rate,
+        total
+    )
+
+
+def unpack_quote(record: bytes) -> dict:
+    created_at, price, year, month, engine, volume, power, flags, cny_rate, total = RECORD.unpack(record)
+    return {
+        'created_at': created_at,
+        'data': {
+            'price': price,
+            'year_month': (year, month),
+            'engine_type': ENGINE_TYPE_NAMES[engine],
+            'engine_volume_cc': volume,
+            'engine_power': power,
+        },
+        'is_individual': bool(flags & FLAG_INDIVIDUAL),
+        'is_personal_use': bool(flags & FLAG_PERSONAL_USE),
+        'cny_rate': cny_rate,
+        'total': total,
+    }
+
+
+# История расчетов пользователей: записи только добавляются, у каждого
+# пользователя хранятся последние limit расчетов, более старые удаляются
+# при добавлении новых
+class QuoteHistory:
+    def __init__(self, path: str = "users.sqlite3", limit: int = 20):
+        self.path = path
+        self.limit = limit
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS quote_history ("
+            " id INTEGER PRIMARY KEY,"
+            " chat_id INTEGER NOT NULL,"
+            " record BLOB NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS quote_history_chat ON quote_history (chat_id, id)")
+        self.appended = 0
+
+    def append(self, chat_id: int, data: dict, is_individual: bool, is_personal_use: bool,
+               total: float, cny_rate: float):
+        self._db.execute(
+            "INSERT INTO quote_history (chat_id, record) VALUES (?, ?)",
+            (chat_id, pack_quote(data, is_individual, is_personal_use, total, cny_rate))
+        )
+        self._db.execute(
+            "DELETE FROM quote_history WHERE chat_id = ? AND id <= ("
+            " SELECT id FROM quote_history WHERE chat_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            (chat_id, chat_id, self.limit)
+        )
+        self.appended += 1
+
+    # Расчеты пользователя от старых к новым
+    def entries(self, chat_id: int) -> list:
+        rows = self._db.execute(
+            "SELECT record FROM quote_history WHERE chat_id = ? ORDER BY id", (chat_id,)
+        ).fetchall()
+        return [unpack_quote(row[0]) for row in rows]
+
+    def clear(self, chat_id: int) -> int:
+        return self._db.execute("DELETE FROM quote_history WHERE chat_id = ?", (chat_id,)).rowcount
+
+    def stats(self) -> dict:
+        return {
+            'records': self._db.execute("SELECT COUNT(*) FROM quote_history").fetchone()[0],
+            'appended': self.appended,
+            'limit': self.limit,
+        }
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,162 @@
+import argparse
+import asyncio
+import logging
+import sqlite3
+from datetime import date, datetime, timedelta
+from xml.etree import ElementTree as ET
+
+import aiohttp
+
+from http_pool import HttpPool
+from rates import HEADERS
+
+logger = logging.getLogger(__name__)
+
+CBR_DYNAMIC_URL = 'https://www.cbr.ru/scripts/XML_dynamic.asp'
+# Коды валют ЦБ РФ для XML_dynamic.asp
+CBR_CURRENCY_CODES = {'USD': 'R01235', 'EUR': 'R01239', 'CNY': 'R01375'}
+CURRENCIES = tuple(CBR_CURRENCY_CODES)
+
+
+# "18.10.2024" (формат ЦБ) -> date
+def parse_cbr_date(value: str) -> date:
+    return datetime.strptime(value, "%d.%m.%Y").date()
+
+
+# Ответ XML_dynamic.asp: {дата: курс за 1 единицу валюты}
+def parse_cbr_dynamic(content: bytes) -> dict:
+    root = ET.fromstring(content)
+    rates = {}
+    for record in root.findall('Record'):
+        nominal = int(record.find('Nominal').text)
+        value = float(record.find('Value').text.replace(',', '.'))
+        rates[parse_cbr_date(record.get('Date'))] = value / nominal
+    return rates
+
+
+# Архив официальных курсов ЦБ РФ по датам.
+# Дата - первичный ключ таблицы без rowid, поэтому поиск курса на любую дату -
+# один проход по B-дереву. На выходные и праздники действует курс последней
+# предыдущей даты установления, как у самого ЦБ.
+class RateArchive:
+    def __init__(self, path: str = "rates.sqlite3"):
+        self.path = path
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rates ("
+            " date TEXT PRIMARY KEY,"
+            " usd REAL NOT NULL,"
+            " eur REAL NOT NULL,"
+            " cny REAL NOT NULL) WITHOUT ROWID"
+        )
+
+    def store(self, day: date, rates: dict):
+        self.store_many([(day, rates)])
+
+    def store_many(self, rows):
+        self._db.executemany(
+            "INSERT INTO rates (date, usd, eur, cny) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(date) DO UPDATE SET usd = excluded.usd, eur = excluded.eur, cny = excluded.cny",
+            [(day.isoformat(), rates['USD'], rates['EUR'], rates['CNY']) for day, rates in rows]
+        )
+
+    @staticmethod
+    def _result(row):
+        if row is None:
+            return None
+        return date.fromisoformat(row[0]), {'USD': row[1], 'EUR': row[2], 'CNY': row[3]}
+
+    # Курс, действовавший на дату: последняя запись не позже day
+    def rates_on(self, day: date):
+        return self._result(self._db.execute(
+            "SELECT date, usd, eur, cny FROM rates WHERE date <= ? ORDER BY date DESC LIMIT 1",
+            (day.isoformat(),)
+        ).fetchone())
+
+    def latest(self):
+        return self._result(self._db.execute(
+            "SELECT date, usd, eur, cny FROM rates ORDER BY date DESC LIMIT 1"
+        ).fetchone())
+
+    def count(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM rates").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+# Загрузка архива за период: по одному запросу XML_dynamic.asp на валюту,
+# длинные периоды разбиваются на части по chunk_days
+async def backfill(archive: RateArchive, start: date, end: date, url: str = CBR_DYNAMIC_URL,
+                   chunk_days: int = 366, session: aiohttp.ClientSession = None) -> int:
+    pool = None
+    if session is None:
+        pool = HttpPool("cbr", limit_per_host=4, headers=HEADERS, total_timeout=60)
+        session = pool.session
+
+    stored = 0
+    try:
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(end, chunk_start + timedelta(days=chunk_days - 1))
+            by_currency = {}
+            for currency, code in CBR_CURRENCY_CODES.items():
+                params = {
+                    'date_req1': chunk_start.strftime("%d/%m/%Y"),
+                    'date_req2': chunk_end.strftime("%d/%m/%Y"),
+                    'VAL_NM_RQ': code
+                }
+                async with session.get(url, params=params) as response:
+                    response.raise_for_status()
+                    by_currency[currency] = parse_cbr_dynamic(await response.read())
+
+            # Сохраняются только даты, на которые есть курсы всех трех валют
+            days = set.intersection(*(set(rates) for rates in by_currency.values()))
+            rows = [(day, {currency: by_currency[currency][day] for currency in CURRENCIES})
+                    for day in sorted(days)]
+            archive.store_many(rows)
+            stored += len(rows)
+            logger.info(f"Архив курсов: {chunk_start} - {chunk_end}, сохранено дат: {len(rows)}")
+            chunk_start = chunk_end + timedelta(days=1)
+    finally:
+        if pool is not None:
+            await pool.close()
+    return stored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Архив курсов ЦБ РФ")
+    parser.add_argument("--db", default="rates.sqlite3")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backfill_parser = commands.add_parser("backfill", help="загрузить курсы за период")
+    backfill_parser.add_argument("start", type=date.fromisoformat, help="ГГГГ-ММ-ДД")
+    backfill_parser.add_argument("end", type=date.fromisoformat, nargs="?", default=date.today())
+    backfill_parser.add_argument("--url", default=CBR_DYNAMIC_URL)
+
+    show_parser = commands.add_parser("show", help="курс на дату")
+    show_parser.add_argument("day", type=date.fromisoformat, nargs="?", default=date.today())
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    archive = RateArchive(args.db)
+    try:
+        if args.command == "backfill":
+            stored = asyncio.run(backfill(archive, args.start, args.end, url=args.url))
+            print(f"Сохранено дат: {stored}, всего в архиве: {archive.count()}")
+        else:
+            found = archive.rates_on(args.day)
+            if found is None:
+                print(f"Нет курсов на {args.day}")
+            else:
+                rate_date, rates = found
+                print(f"Курсы ЦБ на {args.day} (установлены {rate_date}): "
+                      f"USD={rates['USD']:.4f}, EUR={rates['EUR']:.4f}, CNY={rates['CNY']:.4f}")
+    finally:
+        archive.close()
+
+
+if __name__ == "__main__":
+    main()
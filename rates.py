@@ -0,0 +1,340 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+from datetime import datetime, time as dt_time, timedelta, timezone
+from xml.etree import ElementTree as ET
+
+import aiohttp
+
+from metrics import Counter, Histogram
+from sqlite_thread import SQLiteThread
+
+logger = logging.getLogger(__name__)
+
+CBR_DAILY_URL = 'https://www.cbr.ru/scripts/XML_daily.asp'
+TRACKED_CURRENCIES = ('USD', 'EUR', 'CNY')
+DEFAULT_RATES = {'USD': 80.0, 'EUR': 90.0, 'CNY': 11.0}
+# ЦБ РФ устанавливает курсы по московскому времени
+MOSCOW_TZ = timezone(timedelta(hours=3))
+
+CBR_FETCH_LATENCY = Histogram("cbr_fetch_duration_seconds", "Время запроса курсов к ЦБ РФ")
+CBR_FETCH_FAILURES = Counter("cbr_fetch_failures_total", "Неудачные запросы курсов к ЦБ РФ")
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'
+}
+
+
+# Разбор ответа XML_daily.asp: дата публикации ЦБ и курсы за 1 единицу валюты.
+# Без какой-либо из валют ответ не принимается (ValueError): подставленные
+# значения по умолчанию попали бы в кэш и архив как настоящие курсы
+def parse_cbr_daily(content: bytes):
+    root = ET.fromstring(content)
+    rate_date = root.get('Date')
+    rates = {}
+
+    for valute in root.findall('Valute'):
+        char_code = valute.find('CharCode').text
+        if char_code in TRACKED_CURRENCIES:
+            nominal = int(valute.find('Nominal').text)
+            value = float(valute.find('Value').text.replace(',', '.'))
+            rates[char_code] = value / nominal
+
+    missing = [currency for currency in TRACKED_CURRENCIES if currency not in rates]
+    if missing:
+        raise ValueError(f"В ответе ЦБ нет курсов {', '.join(missing)}")
+
+    return rate_date, rates
+
+
+# Асинхронный клиент курсов ЦБ РФ.
+# Кэш хранится по дате публикации ЦБ, одновременные запросы ждут один общий
+# запрос к cbr.ru (single-flight), а при медленном ответе ЦБ отдаются
+# устаревшие курсы, пока обновление продолжается в фоне (stale-while-revalidate).
+# С архивом (RateArchive) полученные курсы сохраняются по датам, а если ЦБ
+# недоступен, используются последние известные курсы вместо DEFAULT_RATES.
+# Запросы к архиву после запуска выполняются в потоке SQLiteThread (db).
+class CbrRatesClient:
+    def __init__(self, url: str = CBR_DAILY_URL, ttl: float = 3600,
+                 stale_timeout: float = 1.0, request_timeout: float = 15,
+                 error_backoff: float = 30, max_dates: int = 7, archive=None, http_pool=None,
+                 db: SQLiteThread = None):
+        self.url = url
+        self.db = db if db is not None else SQLiteThread("rates-archive")
+        # Общий пул соединений (HttpPool); без него клиент открывает свою сессию
+        self.http_pool = http_pool
+        if http_pool is not None:
+            self._timeout = http_pool.timeout(total=request_timeout)
+        else:
+            self._timeout = aiohttp.ClientTimeout(total=request_timeout)
+        self.archive = archive
+        self.ttl = ttl
+        self.stale_timeout = stale_timeout
+        self.request_timeout = request_timeout
+        self.error_backoff = error_backoff
+        self.max_dates = max_dates
+
+        self._session = None
+        self._cache = OrderedDict()
+        self._current_date = None
+        self._fetched_at = 0.0
+        self._retry_at = 0.0
+        self._inflight = None
+        # Курсы обновляет RatePrefetcher: запросы пользователей не ждут сеть
+        self.background = False
+        self.snapshot_at = None
+        self.last_error = None
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale_served = 0
+        self.upstream_requests = 0
+        self.upstream_errors = 0
+        self.fallbacks = 0
+
+        self._load_archive()
+
+    # После перезапуска сразу есть последние известные курсы; они считаются
+    # устаревшими и обновляются при первом обращении
+    def _load_archive(self):
+        if self.archive is None:
+            return
+        try:
+            latest = self.archive.latest()
+        except Exception:
+            logger.exception("Ошибка чтения архива курсов")
+            return
+        if latest is not None:
+            rate_date, rates = latest
+            self._cache[rate_date.strftime("%d.%m.%Y")] = rates
+            self._current_date = rate_date.strftime("%d.%m.%Y")
+            self._fetched_at = float('-inf')
+            logger.info(f"Из архива загружены курсы на {self._current_date}")
+
+    async def _fallback(self) -> dict:
+        self.fallbacks += 1
+        if self.archive is not None:
+            try:
+                latest = await self.db.run(self.archive.latest)
+                if latest is not None:
+                    logger.warning(f"Используются последние известные курсы на {latest[0]}")
+                    return dict(latest[1])
+            except Exception:
+                logger.exception("Ошибка чтения архива курсов")
+        logger.warning("Используются курсы по умолчанию")
+        return dict(DEFAULT_RATES)
+
+    @property
+    def rate_date(self):
+        return self._current_date
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.http_pool is not None:
+            return self.http_pool.session
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(headers=HEADERS, timeout=self._timeout)
+        return self._session
+
+    async def close(self):
+        if self._inflight is not None and not self._inflight.done():
+            self._inflight.cancel()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def _cached(self):
+        if self._current_date is None:
+            return None
+        return dict(self._cache[self._current_date])
+
+    # Возраст курсов в памяти, с (None - курсы еще не получены от ЦБ)
+    def snapshot_age(self):
+        if self.snapshot_at is None:
+            return None
+        return time.time() - self.snapshot_at
+
+    async def get_rates(self) -> dict:
+        if self.background and self._current_date is not None:
+            self.hits += 1
+            return self._cached()
+
+        now = time.monotonic()
+        if self._current_date is not None and (now - self._fetched_at < self.ttl or now < self._retry_at):
+            self.hits += 1
+            return self._cached()
+
+        self.misses += 1
+        if self._current_date is None and now < self._retry_at:
+            return await self._fallback()
+
+        task = self._refresh()
+        if self._current_date is None:
+            return dict(await asyncio.shield(task))
+
+        try:
+            return dict(await asyncio.wait_for(asyncio.shield(task), self.stale_timeout))
+        except asyncio.TimeoutError:
+            self.stale_served += 1
+            logger.warning("ЦБ РФ отвечает медленно, используются курсы из кэша")
+            return self._cached()
+
+    def _refresh(self) -> asyncio.Task:
+        if self._inflight is not None and not self._inflight.done():
+            self.coalesced += 1
+            return self._inflight
+        self._inflight = asyncio.ensure_future(self._fetch())
+        return self._inflight
+
+    # Принудительное обновление курсов; True, если ЦБ ответил
+    async def refresh(self) -> bool:
+        await asyncio.shield(self._refresh())
+        return self.last_error is None
+
+    async def _fetch(self) -> dict:
+        self.upstream_requests += 1
+        started = time.perf_counter()
+        try:
+            logger.info("Запрос курсов валют к ЦБ РФ")
+            params = {'date_req': datetime.now(MOSCOW_TZ).strftime("%d/%m/%Y")}
+            async with self._get_session().get(self.url, params=params, timeout=self._timeout) as response:
+                response.raise_for_status()
+                content = await response.read()
+
+            rate_date, rates = parse_cbr_daily(content)
+            self._store(rate_date, rates)
+            await self._archive_rates(rate_date, rates)
+            logger.info(f"Получены курсы на {rate_date}: USD={rates['USD']}, EUR={rates['EUR']}, CNY={rates['CNY']}")
+            return rates
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.upstream_errors += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            CBR_FETCH_FAILURES.inc()
+            self._retry_at = time.monotonic() + self.error_backoff
+            logger.exception("Ошибка получения курсов")
+            return self._cached() or await self._fallback()
+        finally:
+            CBR_FETCH_LATENCY.observe(time.perf_counter() - started)
+
+    # Новые курсы подменяют снимок без промежуточных await: обработчики видят
+    # либо старые курсы целиком, либо новые
+    def _store(self, rate_date, rates):
+        self._cache[rate_date] = rates
+        self._cache.move_to_end(rate_date)
+        while len(self._cache) > self.max_dates:
+            self._cache.popitem(last=False)
+        self._current_date = rate_date
+        self._fetched_at = time.monotonic()
+        self._retry_at = 0.0
+        self.snapshot_at = time.time()
+        self.last_error = None
+
+    async def _archive_rates(self, rate_date, rates):
+        if self.archive is None or not rate_date:
+            return
+        try:
+            await self.db.run(self.archive.store, datetime.strptime(rate_date, "%d.%m.%Y").date(), rates)
+        except Exception:
+            logger.exception("Ошибка записи курсов в архив")
+
+    def stats(self) -> dict:
+        return {
+            'rate_date': self._current_date,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'stale_served': self.stale_served,
+            'upstream_requests': self.upstream_requests,
+            'upstream_errors': self.upstream_errors,
+            'fallbacks': self.fallbacks,
+        }
+
+
+# "00:01,12:00" -> (time(0, 1), time(12, 0))
+def parse_times(value: str):
+    return tuple(dt_time.fromisoformat(part.strip()) for part in value.split(",") if part.strip())
+
+
+# Фоновое обновление курсов по расписанию ЦБ РФ.
+# Курсы на следующий день ЦБ публикует после 15:30 МСК, а действовать они
+# начинают с 00:00 МСК, поэтому основной запрос идет сразу после полуночи
+# по Москве, а между запусками по расписанию курсы перепроверяются раз в interval.
+# Неудачный запрос повторяется с экспоненциальной задержкой со случайным
+# разбросом, чтобы несколько копий бота не опрашивали cbr.ru синхронно.
+class RatePrefetcher:
+    def __init__(self, client: CbrRatesClient, times=(dt_time(0, 1),), interval: float = 3600,
+                 jitter: float = 30, backoff: float = 5, max_backoff: float = 600, on_refresh=None):
+        self.client = client
+        # Корутина, которая получает курсы после каждого успешного обновления
+        self.on_refresh = on_refresh
+        self.times = tuple(times)
+        self.interval = interval
+        self.jitter = jitter
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.failures = 0
+        self.last_success_at = None
+        self.last_attempt_at = None
+        self.next_fetch_at = None
+
+    # Ближайший запуск: следующее время по расписанию или now + interval
+    def next_run(self, now: datetime) -> datetime:
+        candidates = [now + timedelta(seconds=self.interval)]
+        for at in self.times:
+            scheduled = now.replace(hour=at.hour, minute=at.minute, second=at.second, microsecond=0)
+            if scheduled <= now:
+                scheduled += timedelta(days=1)
+            candidates.append(scheduled)
+        return min(candidates)
+
+    def retry_delay(self) -> float:
+        delay = min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    async def run(self):
+        self.client.background = True
+        logger.info(f"Фоновое обновление курсов: в {', '.join(at.strftime('%H:%M') for at in self.times)} МСК "
+                    f"и каждые {self.interval:.0f} с")
+        try:
+            while True:
+                self.last_attempt_at = time.time()
+                if await self.client.refresh():
+                    self.failures = 0
+                    self.last_success_at = time.time()
+                    if self.on_refresh is not None:
+                        try:
+                            await self.on_refresh(await self.client.get_rates())
+                        except Exception:
+                            logger.exception("Ошибка обработчика обновления курсов")
+                    now = datetime.now(MOSCOW_TZ)
+                    delay = (self.next_run(now) - now).total_seconds() + random.uniform(0, self.jitter)
+                else:
+                    self.failures += 1
+                    delay = self.retry_delay()
+                    logger.warning(f"Курсы ЦБ не обновлены (попытка {self.failures}), повтор через {delay:.0f} с")
+                self.next_fetch_at = time.time() + delay
+                await asyncio.sleep(delay)
+        finally:
+            self.client.background = False
+
+    def stats(self) -> dict:
+        age = self.client.snapshot_age()
+        return {
+            'rate_date': self.client.rate_date,
+            'snapshot_age_seconds': round(age, 1) if age is not None else None,
+            'last_success': _isoformat(self.last_success_at),
+            'last_attempt': _isoformat(self.last_attempt_at),
+            'last_error': self.client.last_error,
+            'consecutive_failures': self.failures,
+            'next_fetch': _isoformat(self.next_fetch_at),
+        }
+
+
+def _isoformat(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, MOSCOW_TZ).isoformat(timespec='seconds')
@@ -0,0 +1,188 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: ответы пользователям идут раньше рассылок
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BROADCAST = 1
+LANE_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BROADCAST: "broadcast"}
+
+send_priority: ContextVar[int] = ContextVar("send_priority", default=PRIORITY_INTERACTIVE)
+
+# Методы, на которые действуют лимиты Telegram на отправку сообщений
+SEND_METHODS = frozenset({
+    "SendMessage", "SendPhoto", "SendDocument", "SendMediaGroup", "SendAnimation",
+    "SendVideo", "SendAudio", "SendVoice", "SendSticker", "SendLocation", "SendContact",
+    "CopyMessage", "ForwardMessage", "EditMessageText", "EditMessageCaption",
+    "EditMessageReplyMarkup", "EditMessageMedia",
+})
+
+SEND_QUEUE_DEPTH = Gauge("bot_send_queue_depth", "Сообщения в очереди на отправку", ["lane"])
+SEND_QUEUE_WAIT = Histogram(
+    "bot_send_queue_wait_seconds", "Ожидание сообщения в очереди на отправку", ["lane"]
+)
+SEND_RETRY_AFTER = Counter("bot_send_retry_after_total", "Ответы 429 Too Many Requests от Bot API")
+
+
+# Все, что отправляется внутри блока, идет в указанной полосе
+@contextmanager
+def priority(lane: int):
+    token = send_priority.set(lane)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+# Общий лимит: token bucket. Telegram считает сообщения в окне 1 с, поэтому
+# по умолчанию запас в один токен - отправки равномерно разнесены по времени
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+# Планировщик исходящих сообщений.
+# Сначала сообщение ждет свой слот в чате (лимит на чат с небольшим запасом
+# на серию из нескольких сообщений), затем общий слот бота. Общие слоты
+# раздаются по приоритету полосы, внутри полосы - в порядке очереди.
+class SendScheduler:
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: int = 3,
+                 max_retries: int = 3, global_burst: float = 1):
+        self.chat_interval = 1 / chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+
+        self._global = TokenBucket(global_rate, global_burst)
+        # Теоретическое время следующей отправки по каждому чату (GCRA)
+        self._chat_tat = {}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._releaser = None
+
+        self.sent = 0
+        self.retries = 0
+        self.dropped = 0
+
+    # Когда можно отправить в чат; слот резервируется сразу, поэтому
+    # сообщения одного чата выходят в том порядке, в котором пришли
+    def _reserve_chat(self, chat_id, now: float) -> float:
+        if chat_id is None:
+            return 0.0
+        tat = max(self._chat_tat.get(chat_id, now), now)
+        allowed_at = tat - (self.chat_burst - 1) * self.chat_interval
+        self._chat_tat[chat_id] = tat + self.chat_interval
+        if len(self._chat_tat) > 10000:
+            self._prune(now)
+        return max(0.0, allowed_at - now)
+
+    def _prune(self, now: float):
+        self._chat_tat = {chat: tat for chat, tat in self._chat_tat.items() if tat > now}
+
+    # Telegram попросил подождать: чат не получает слотов до истечения retry_after
+    def block_chat(self, chat_id, retry_after: float):
+        now = time.monotonic()
+        if chat_id is not None:
+            self._chat_tat[chat_id] = max(
+                self._chat_tat.get(chat_id, now),
+                now + retry_after + (self.chat_burst - 1) * self.chat_interval
+            )
+
+    async def acquire(self, chat_id, lane: int):
+        gauge = SEND_QUEUE_DEPTH.labels(LANE_NAMES.get(lane, str(lane)))
+        started = time.monotonic()
+        gauge.inc()
+        try:
+            delay = self._reserve_chat(chat_id, started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if not self._waiters and self._global.delay() == 0:
+                self._global.take()
+            else:
+                future = asyncio.get_running_loop().create_future()
+                heapq.heappush(self._waiters, (lane, next(self._seq), future))
+                if self._releaser is None or self._releaser.done():
+                    self._releaser = asyncio.ensure_future(self._release())
+                await future
+        finally:
+            gauge.dec()
+            SEND_QUEUE_WAIT.labels(LANE_NAMES.get(lane, str(lane))).observe(time.monotonic() - started)
+
+    async def _release(self):
+        while self._waiters:
+            delay = self._global.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._global.take()
+                future.set_result(None)
+
+    def stats(self) -> dict:
+        depth = {}
+        for lane, name in LANE_NAMES.items():
+            depth[name] = SEND_QUEUE_DEPTH.labels(name).value
+        return {
+            'queued': depth,
+            'sent': self.sent,
+            'retries': self.retries,
+            'dropped': self.dropped,
+            'tracked_chats': len(self._chat_tat),
+        }
+
+
+# Middleware сессии бота: отправка сообщений идет через планировщик,
+# 429 с retry_after повторяется автоматически
+class SendSchedulerMiddleware(BaseRequestMiddleware):
+    def __init__(self, scheduler: SendScheduler):
+        self.scheduler = scheduler
+
+    async def __call__(self, make_request, bot, method):
+        if type(method).__name__ not in SEND_METHODS:
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        lane = send_priority.get()
+        attempt = 0
+        while True:
+            await self.scheduler.acquire(chat_id, lane)
+            try:
+                response = await make_request(bot, method)
+                self.scheduler.sent += 1
+                return response
+            except TelegramRetryAfter as e:
+                SEND_RETRY_AFTER.inc()
+                self.scheduler.block_chat(chat_id, e.retry_after)
+                if attempt >= self.scheduler.max_retries:
+                    self.scheduler.dropped += 1
+                    raise
+                attempt += 1
+                self.scheduler.retries += 1
+                logger.warning(f"Лимит Telegram для чата {chat_id}, повтор через {e.retry_after} с")
@@ -0,0 +1,39 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Выполнение запросов SQLite вне event loop.
+# Запрос к базе может ждать диск или блокировку другого процесса (busy timeout
+# до 5 с), и все это время loop не обрабатывал бы обновления. Запросы уходят
+# в один отдельный поток: к одному файлу SQLite они и так выполняются по
+# очереди, а соединение sqlite3 не используется из нескольких потоков сразу.
+class SQLiteThread:
+    def __init__(self, name: str = "sqlite"):
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.calls = 0
+        self.slowest = 0.0
+
+    async def run(self, func, *args, **kwargs):
+        self.calls += 1
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(self._timed, func, *args, **kwargs)
+        )
+
+    def _timed(self, func, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.slowest = max(self.slowest, time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        return {
+            'calls': self.calls,
+            'slowest_ms': round(self.slowest * 1000, 1),
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,221 @@
+import contextvars
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import TelegramObject
+
+from sqlite_thread import SQLiteThread
+
+logger = logging.getLogger(__name__)
+
+_UNSET = object()
+_pending_writes = contextvars.ContextVar("pending_fsm_writes", default=None)
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    if state is None:
+        return None
+    return getattr(state, "state", state)
+
+
+def _key_str(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.destiny}"
+
+
+# Хранилище FSM в SQLite (WAL): переживает перезапуск, и один файл могут
+# использовать несколько процессов на одной машине. Брошенные анкеты
+# истекают через ttl секунд после последней записи. Запросы выполняются
+# в отдельном потоке (SQLiteThread), event loop их не ждет.
+class SQLiteStorage(BaseStorage):
+    def __init__(self, path: str = "fsm.sqlite3", ttl: float = 86400, purge_every: int = 1000):
+        self.path = path
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._writes = 0
+        self.db = SQLiteThread("fsm-sqlite")
+
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            " key TEXT PRIMARY KEY,"
+            " state TEXT,"
+            " data TEXT NOT NULL DEFAULT '{}',"
+            " expires_at REAL NOT NULL)"
+        )
+        self.purge_expired()
+
+    def _row(self, key: StorageKey):
+        return self._db.execute(
+            "SELECT state, data FROM fsm WHERE key = ? AND expires_at > ?",
+            (_key_str(key), time.time())
+        ).fetchone()
+
+    async def get_state(self, bot: Bot, key: StorageKey) -> Optional[str]:
+        row = await self.db.run(self._row, key)
+        return row[0] if row else None
+
+    async def get_data(self, bot: Bot, key: StorageKey) -> Dict[str, Any]:
+        row = await self.db.run(self._row, key)
+        return json.loads(row[1]) if row else {}
+
+    async def set_state(self, bot: Bot, key: StorageKey, state: StateType = None) -> None:
+        await self.write(key, state=_state_name(state))
+
+    async def set_data(self, bot: Bot, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self.write(key, data=data)
+
+    # Запись состояния и/или данных одним запросом
+    async def write(self, key: StorageKey, state=_UNSET, data=_UNSET):
+        await self.db.run(self._write, key, state, data)
+
+    def _write(self, key: StorageKey, state, data):
+        expires_at = time.time() + self.ttl
+        key_str = _key_str(key)
+        if state is not _UNSET and data is not _UNSET:
+            if state is None and not data:
+                self._db.execute("DELETE FROM fsm WHERE key = ?", (key_str,))
+            else:
+                self._db.execute(
+                    "INSERT INTO fsm (key, state, data, expires_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, "
+                    "data = excluded.data, expires_at = excluded.expires_at",
+                    (key_str, state, json.dumps(data, ensure_ascii=False), expires_at)
+                )
+        elif state is not _UNSET:
+            self._db.execute(
+                "INSERT INTO fsm (key, state, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at",
+                (key_str, state, expires_at)
+            )
+        elif data is not _UNSET:
+            self._db.execute(
+                "INSERT INTO fsm (key, data, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+                (key_str, json.dumps(data, ensure_ascii=False), expires_at)
+            )
+
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            self.purge_expired()
+
+    def purge_expired(self) -> int:
+        deleted = self._db.execute("DELETE FROM fsm WHERE expires_at <= ?", (time.time(),)).rowcount
+        if deleted:
+            logger.info(f"FSM: удалено {deleted} просроченных анкет")
+        return deleted
+
+    async def active_sessions(self) -> int:
+        return await self.db.run(self._active_sessions)
+
+    def _active_sessions(self) -> int:
+        return self._db.execute(
+            "SELECT COUNT(*) FROM fsm WHERE state IS NOT NULL AND expires_at > ?", (time.time(),)
+        ).fetchone()[0]
+
+    async def close(self) -> None:
+        await self.db.run(self._db.close)
+        self.db.close()
+
+
+# Обертка, откладывающая записи в хранилище до конца обработки обновления.
+# Обработчик анкеты делает update_data + set_state, а в хранилище уходит
+# одна запись на ключ. Вне StorageBatchMiddleware пишет сразу.
+class BufferedStorage(BaseStorage):
+    def __init__(self, backend: BaseStorage):
+        self.backend = backend
+        self.flushes = 0
+
+    def _pending(self, key: StorageKey):
+        pending = _pending_writes.get()
+        if pending is None:
+            return None
+        return pending.setdefault(key, [_UNSET, _UNSET])
+
+    async def get_state(self, bot: Bot, key: StorageKey) -> Optional[str]:
+        pending = _pending_writes.get()
+        if pending is not None and key in pending and pending[key][0] is not _UNSET:
+            return pending[key][0]
+        return await self.backend.get_state(bot=bot, key=key)
+
+    async def get_data(self, bot: Bot, key: StorageKey) -> Dict[str, Any]:
+        pending = _pending_writes.get()
+        if pending is not None and key in pending and pending[key][1] is not _UNSET:
+            return pending[key][1].copy()
+        return await self.backend.get_data(bot=bot, key=key)
+
+    async def set_state(self, bot: Bot, key: StorageKey, state: StateType = None) -> None:
+        entry = self._pending(key)
+        if entry is None:
+            await self.backend.set_state(bot=bot, key=key, state=state)
+        else:
+            entry[0] = _state_name(state)
+
+    async def set_data(self, bot: Bot, key: StorageKey, data: Dict[str, Any]) -> None:
+        entry = self._pending(key)
+        if entry is None:
+            await self.backend.set_data(bot=bot, key=key, data=data)
+        else:
+            entry[1] = data.copy()
+
+    async def flush(self, bot: Bot, pending: dict) -> None:
+        for key, (state, data) in pending.items():
+            if isinstance(self.backend, SQLiteStorage):
+                await self.backend.write(key, state=state, data=data)
+            else:
+                if state is not _UNSET:
+                    await self.backend.set_state(bot=bot, key=key, state=state)
+                if data is not _UNSET:
+                    await self.backend.set_data(bot=bot, key=key, data=data)
+        self.flushes += 1
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+
+class StorageBatchMiddleware(BaseMiddleware):
+    def __init__(self, storage: BufferedStorage):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        pending = {}
+        token = _pending_writes.set(pending)
+        try:
+            return await handler(event, data)
+        finally:
+            _pending_writes.reset(token)
+            if pending:
+                await self.storage.flush(data["bot"], pending)
+
+
+# Выбор хранилища по URL: memory, sqlite:///path/to/fsm.sqlite3, redis://host:6379/0
+def create_storage(url: str, ttl: float = 86400) -> BaseStorage:
+    if not url or url == "memory":
+        return MemoryStorage()
+
+    if url.startswith("sqlite://"):
+        path = url[len("sqlite://"):]
+        if path.startswith("/"):
+            path = path[1:]
+        return BufferedStorage(SQLiteStorage(path or "fsm.sqlite3", ttl=ttl))
+
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError as e:
+            raise RuntimeError("Для FSM_STORAGE=redis:// установите пакет redis") from e
+        return BufferedStorage(RedisStorage.from_url(url, state_ttl=int(ttl), data_ttl=int(ttl)))
+
+    raise ValueError(f"Неизвестное хранилище FSM: {url}")
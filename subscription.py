@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.dispatcher.flags import get_flag
+from aiogram.enums import ChatMemberStatus
+from aiogram.types import CallbackQuery, InlineQuery, Message, TelegramObject
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBED_STATUSES = (
+    ChatMemberStatus.MEMBER,
+    ChatMemberStatus.ADMINISTRATOR,
+    ChatMemberStatus.CREATOR
+)
+
+
+# Проверка подписки с кэшем.
+# Числовой id канала запрашивается один раз при старте, статус пользователя
+# хранится в ограниченном LRU-кэше: подписчики - positive_ttl секунд,
+# неподписанные - negative_ttl секунд (чтобы после подписки долго не ждать).
+class SubscriptionResolver:
+    def __init__(self, bot: Bot, channel, positive_ttl: float = 600,
+                 negative_ttl: float = 30, maxsize: int = 10000):
+        self.bot = bot
+        self.channel = channel
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+
+        self._chat_id = None
+        self._cache = OrderedDict()
+        self._pending = {}
+
+        self.checks = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.api_calls = 0
+        self.api_errors = 0
+        self.invalidations = 0
+
+    @property
+    def chat_id(self):
+        return self._chat_id
+
+    async def resolve_channel(self) -> int:
+        self.api_calls += 1
+        chat = await self.bot.get_chat(chat_id=self.channel)
+        self._chat_id = chat.id
+        logger.info(f"Канал {self.channel} имеет id {chat.id}")
+        return chat.id
+
+    async def is_subscribed(self, user_id: int) -> bool:
+        self.checks += 1
+        now = time.monotonic()
+
+        entry = self._cache.get(user_id)
+        if entry is not None:
+            subscribed, expires_at = entry
+            if expires_at > now:
+                self.hits += 1
+                self._cache.move_to_end(user_id)
+                return subscribed
+            del self._cache[user_id]
+
+        self.misses += 1
+        # Одновременные проверки одного пользователя ждут один запрос к API
+        pending = self._pending.get(user_id)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        pending = asyncio.ensure_future(self._check(user_id))
+        self._pending[user_id] = pending
+        pending.add_done_callback(lambda _: self._pending.pop(user_id, None))
+        return await asyncio.shield(pending)
+
+    async def _check(self, user_id: int) -> bool:
+        try:
+            if self._chat_id is None:
+                await self.resolve_channel()
+
+            self.api_calls += 1
+            member = await self.bot.get_chat_member(
+                chat_id=self._chat_id,
+                user_id=user_id
+            )
+        except Exception as e:
+            self.api_errors += 1
+            logger.error(f"Ошибка проверки подписки: {e}", exc_info=True)
+            return False
+
+        subscribed = member.status in SUBSCRIBED_STATUSES
+        ttl = self.positive_ttl if subscribed else self.negative_ttl
+        self._store(user_id, subscribed, time.monotonic() + ttl)
+        return subscribed
+
+    def _store(self, user_id: int, subscribed: bool, expires_at: float):
+        self._cache[user_id] = (subscribed, expires_at)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        if self._cache.pop(user_id, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        # Без кэша каждая проверка стоила два вызова: getChat и getChatMember
+        return {
+            'checks': self.checks,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'cached_users': len(self._cache),
+            'api_calls': self.api_calls,
+            'api_errors': self.api_errors,
+            'api_calls_saved': max(self.checks * 2 - self.api_calls, 0),
+            'invalidations': self.invalidations,
+        }
+
+
+# Единая проверка подписки для всех обработчиков.
+# Регистрируется как middleware обработчиков (а не outer), потому что флаги
+# обработчика известны только после прохождения фильтров. Обработчик с флагом
+# skip_subscription пропускается без проверки: так отмечены шаги анкеты, в
+# которые попадают только через проверенный вход.
+# Inline-запросу неподписанного пользователя отвечает пустой список с кнопкой
+# перехода в бота (inline_prompt, не длиннее 64 символов).
+class SubscriptionMiddleware(BaseMiddleware):
+    def __init__(self, resolver: SubscriptionResolver, prompt: str,
+                 reply_markup_factory: Callable[[], Any],
+                 inline_prompt: str = "📢 Подпишитесь на канал, чтобы пользоваться ботом"):
+        self.resolver = resolver
+        self.prompt = prompt
+        self.inline_prompt = inline_prompt
+        self.reply_markup_factory = reply_markup_factory
+        self.skipped = 0
+        self.rejected = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or get_flag(data, "skip_subscription"):
+            self.skipped += 1
+            return await handler(event, data)
+
+        if await self.resolver.is_subscribed(user.id):
+            return await handler(event, data)
+
+        self.rejected += 1
+        try:
+            if isinstance(event, CallbackQuery):
+                await event.answer(self.prompt, show_alert=True)
+            elif isinstance(event, Message):
+                await event.answer(self.prompt, reply_markup=self.reply_markup_factory())
+            elif isinstance(event, InlineQuery):
+                await event.answer(
+                    [], cache_time=int(self.resolver.negative_ttl), is_personal=True,
+                    switch_pm_text=self.inline_prompt[:64], switch_pm_parameter="subscribe"
+                )
+        except Exception as e:
+            logger.error(f"Ошибка отправки запроса подписки: {e}", exc_info=True)
+        return None
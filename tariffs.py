@@ -0,0 +1,334 @@
+import json
+import logging
+import os
+import time
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Константы компании (не зависят от версии тарифов)
+DELIVERY_COST = 220000
+CUSTOMS_CLEARANCE = 80000
+KW_TO_HP = 1.35962
+
+# Типы двигателей (коды для пакетного расчета)
+ENGINE_PETROL = 0
+ENGINE_DIESEL = 1
+ENGINE_ELECTRIC = 2
+
+ENGINE_TYPE_CODES = {
+    "🛢️ Бензиновый": ENGINE_PETROL,
+    "⛽ Дизельный": ENGINE_DIESEL,
+    "🔋 Электрический": ENGINE_ELECTRIC
+}
+
+# Ставки пошлин, утильсбора и акциза лежат в файле с версиями тарифов.
+# Новую версию с датой вступления в силу можно добавить заранее: бот
+# перечитает файл и сам переключится на нее в нужный день.
+TARIFF_RULES_PATH = os.getenv(
+    "TARIFF_RULES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "tariff_rules.json")
+)
+TARIFF_RELOAD_INTERVAL = 60
+
+
+def _brackets(name: str, upper: list, values: list):
+    if len(values) != len(upper) + 1:
+        raise ValueError(f"{name}: значений должно быть на одно больше, чем границ")
+    if any(a >= b for a, b in zip(upper, upper[1:])):
+        raise ValueError(f"{name}: границы должны возрастать")
+    return list(upper), list(values)
+
+
+# Одна версия тарифов, скомпилированная в отсортированные массивы границ.
+# Значение для x берется из values[bisect_left(upper, x)], что равносильно
+# цепочке "if x <= upper[0] ... elif x <= upper[1] ... else".
+class TariffTable:
+    def __init__(self, rules: dict):
+        self.version = rules['version']
+        self.effective_from = date.fromisoformat(rules['effective_from'])
+        self.vat_rate = rules['vat_rate']
+        self.legal_duty_rate = rules['legal_duty_rate']
+        self.electric_duty_rate = rules['electric_duty_rate']
+        self.excise_rate_per_hp = rules['excise_rate_per_hp']
+
+        duty_new = rules['duty_new']
+        self.duty_new_price_upper, self.duty_new_percent = _brackets(
+            'duty_new.percent', duty_new['price_eur_upper'], duty_new['percent'])
+        _, self.duty_new_min_eur_per_cc = _brackets(
+            'duty_new.min_eur_per_cc', duty_new['price_eur_upper'], duty_new['min_eur_per_cc'])
+
+        self.duty_3_5_volume_upper, self.duty_3_5_eur_per_cc = _brackets(
+            'duty_3_5', rules['duty_3_5']['volume_upper'], rules['duty_3_5']['eur_per_cc'])
+        self.duty_over_5_volume_upper, self.duty_over_5_eur_per_cc = _brackets(
+            'duty_over_5', rules['duty_over_5']['volume_upper'], rules['duty_over_5']['eur_per_cc'])
+
+        recycling = rules['recycling']
+        self.recycling_individual_new = recycling['individual_new']
+        self.recycling_individual_old = recycling['individual_old']
+        self.recycling_individual_max_volume = recycling['individual_max_volume']
+        self.recycling_base_legal = recycling['base_legal']
+        self.recycling_volume_upper, self.recycling_coef_new = _brackets(
+            'recycling.coef_new', recycling['volume_upper'], recycling['coef_new'])
+        _, self.recycling_coef_old = _brackets(
+            'recycling.coef_old', recycling['volume_upper'], recycling['coef_old'])
+        self.recycling_electric_individual_new = recycling['electric_individual_new']
+        self.recycling_electric_individual_old = recycling['electric_individual_old']
+        self.recycling_electric_legal_new = recycling['electric_legal_new']
+        self.recycling_electric_legal_old = recycling['electric_legal_old']
+
+        self.excise_electric_upper, self.excise_electric_rates = _brackets(
+            'excise_electric', rules['excise_electric']['power_hp_upper'], rules['excise_electric']['rates'])
+
+    def __repr__(self):
+        return f"<TariffTable {self.version} c {self.effective_from}>"
+
+
+# Все версии тарифов, упорядоченные по дате вступления в силу
+class TariffBook:
+    def __init__(self, tables: list):
+        if not tables:
+            raise ValueError("Нет ни одной версии тарифов")
+        self.tables = sorted(tables, key=lambda t: t.effective_from)
+        self._dates = [t.effective_from for t in self.tables]
+        self._by_version = {t.version: t for t in self.tables}
+
+    @property
+    def versions(self) -> list:
+        return [t.version for t in self.tables]
+
+    def for_date(self, day: date) -> TariffTable:
+        i = bisect_right(self._dates, day) - 1
+        if i < 0:
+            raise ValueError(f"Нет тарифов, действующих на {day}")
+        return self.tables[i]
+
+    def get(self, version: str) -> TariffTable:
+        try:
+            return self._by_version[version]
+        except KeyError:
+            raise ValueError(f"Неизвестная версия тарифов: {version}") from None
+
+
+def load_tariff_book(path: str = TARIFF_RULES_PATH) -> TariffBook:
+    with open(path, encoding='utf-8') as f:
+        rules = json.load(f)
+    return TariffBook([TariffTable(version) for version in rules['versions']])
+
+
+_book = None
+_book_mtime = None
+_book_checked_at = 0.0
+
+
+# Текущий набор версий; файл перечитывается, если изменился на диске
+def tariff_book() -> TariffBook:
+    global _book, _book_mtime, _book_checked_at
+    now = time.monotonic()
+    if _book is not None and now - _book_checked_at < TARIFF_RELOAD_INTERVAL:
+        return _book
+    _book_checked_at = now
+
+    try:
+        mtime = os.stat(TARIFF_RULES_PATH).st_mtime
+        if _book is None or mtime != _book_mtime:
+            _book = load_tariff_book(TARIFF_RULES_PATH)
+            _book_mtime = mtime
+            logger.info(f"Загружены тарифы: {', '.join(_book.versions)}")
+    except Exception:
+        if _book is None:
+            raise
+        logger.exception("Ошибка перезагрузки тарифов, используются прежние")
+    return _book
+
+
+def current_tariff(day: date = None) -> TariffTable:
+    return tariff_book().for_date(day or date.today())
+
+
+# Расчет пошлины
+def calculate_duty(price_rub: float, age_months: int, engine_volume_cc: int,
+                   is_individual: bool, eur_rate: float, is_electric: bool,
+                   is_personal_use: bool, tariff: TariffTable = None) -> float:
+    tariff = tariff or current_tariff()
+
+    if is_electric:
+        return price_rub * tariff.electric_duty_rate
+
+    if not is_individual or not is_personal_use:
+        return price_rub * tariff.legal_duty_rate
+
+    if age_months <= 36:
+        price_eur = price_rub / eur_rate
+        i = bisect_left(tariff.duty_new_price_upper, price_eur)
+        duty_by_percent = price_rub * tariff.duty_new_percent[i]
+        duty_by_volume = tariff.duty_new_min_eur_per_cc[i] * eur_rate * engine_volume_cc
+        return max(duty_by_percent, duty_by_volume)
+
+    elif age_months <= 60:
+        eur_per_cc = tariff.duty_3_5_eur_per_cc[bisect_left(tariff.duty_3_5_volume_upper, engine_volume_cc)]
+        return eur_per_cc * engine_volume_cc * eur_rate
+
+    else:
+        eur_per_cc = tariff.duty_over_5_eur_per_cc[bisect_left(tariff.duty_over_5_volume_upper, engine_volume_cc)]
+        return eur_per_cc * engine_volume_cc * eur_rate
+
+# Расчет утильсбора
+def calculate_recycling(age_months: int, engine_volume_cc: int, is_individual: bool,
+                        is_personal_use: bool, is_electric: bool, tariff: TariffTable = None) -> float:
+    tariff = tariff or current_tariff()
+    is_new = age_months <= 36
+
+    if is_electric:
+        if is_individual and is_personal_use:
+            return tariff.recycling_electric_individual_new if is_new else tariff.recycling_electric_individual_old
+        else:
+            return tariff.recycling_electric_legal_new if is_new else tariff.recycling_electric_legal_old
+
+    if is_individual and is_personal_use and engine_volume_cc <= tariff.recycling_individual_max_volume:
+        return tariff.recycling_individual_new if is_new else tariff.recycling_individual_old
+
+    i = bisect_left(tariff.recycling_volume_upper, engine_volume_cc)
+    coefficient = tariff.recycling_coef_new[i] if is_new else tariff.recycling_coef_old[i]
+    return tariff.recycling_base_legal * coefficient
+
+def calculate_excise(engine_power_hp: int, tariff: TariffTable = None) -> float:
+    tariff = tariff or current_tariff()
+    return engine_power_hp * tariff.excise_rate_per_hp
+
+def electric_excise_rate(power_hp: float, tariff: TariffTable = None) -> int:
+    tariff = tariff or current_tariff()
+    if power_hp <= 0:
+        return 0
+    return tariff.excise_electric_rates[bisect_left(tariff.excise_electric_upper, power_hp)]
+
+def calculate_excise_electric(power_hp: float, tariff: TariffTable = None) -> float:
+    if power_hp <= 0:
+        return 0
+    return power_hp * electric_excise_rate(power_hp, tariff)
+
+# Полный расчет одного авто: то же, что показывает бот в результате.
+# tariff позволяет посчитать по любой версии тарифов (по умолчанию - текущая).
+def calculate_quote(price_cny: float, age_months: int, engine_volume_cc: int, power: float,
+                    is_electric: bool, is_individual: bool, is_personal_use: bool,
+                    cny_rate: float, eur_rate: float, tariff: TariffTable = None) -> dict:
+    tariff = tariff or current_tariff()
+    price_rub = price_cny * cny_rate
+    if is_electric:
+        engine_volume_cc = 0
+        engine_power_hp = power * KW_TO_HP
+        excise_rate = electric_excise_rate(engine_power_hp, tariff)
+        excise = engine_power_hp * excise_rate if engine_power_hp > 0 else 0
+    else:
+        engine_power_hp = power
+        excise = calculate_excise(engine_power_hp, tariff) if not is_individual else 0
+        excise_rate = tariff.excise_rate_per_hp
+
+    duty = calculate_duty(price_rub, age_months, engine_volume_cc,
+                          is_individual, eur_rate, is_electric, is_personal_use, tariff)
+
+    recycling = calculate_recycling(age_months, engine_volume_cc,
+                                    is_individual, is_personal_use, is_electric, tariff)
+
+    vat_base = price_rub + duty + excise
+    vat = vat_base * tariff.vat_rate if (is_electric or not is_individual) else 0
+
+    total = price_rub + duty + recycling + vat + excise + DELIVERY_COST + CUSTOMS_CLEARANCE
+
+    return {
+        'price_rub': price_rub,
+        'engine_volume_cc': engine_volume_cc,
+        'engine_power_hp': engine_power_hp,
+        'excise_rate': excise_rate,
+        'duty': duty,
+        'excise': excise,
+        'vat': vat,
+        'recycling': recycling,
+        'total': total,
+        'tariff_version': tariff.version
+    }
+
+# ===== ПАКЕТНЫЙ РАСЧЕТ (NumPy) =====
+# Те же формулы и те же таблицы тарифов, что и в скалярных функциях выше,
+# но сразу для массивов. Порядок операций сохранен, поэтому результаты
+# совпадают до бита.
+
+def calculate_batch(price_cny, age_months, engine_volume_cc, power, engine_type,
+                    is_individual, is_personal_use, cny_rate: float, eur_rate: float,
+                    tariff: TariffTable = None) -> dict:
+    tariff = tariff or current_tariff()
+    f64 = lambda values: np.asarray(values, dtype=np.float64)
+
+    price_cny = np.asarray(price_cny, dtype=np.float64)
+    age_months = np.asarray(age_months, dtype=np.int64)
+    power = np.asarray(power, dtype=np.float64)
+    is_electric = np.asarray(engine_type) == ENGINE_ELECTRIC
+    is_individual = np.asarray(is_individual, dtype=bool)
+    is_personal_use = np.asarray(is_personal_use, dtype=bool)
+    volume = np.where(is_electric, 0, np.asarray(engine_volume_cc, dtype=np.float64))
+
+    price_rub = price_cny * cny_rate
+    is_new = age_months <= 36
+    is_private = is_individual & is_personal_use
+
+    # Пошлина
+    price_eur = price_rub / eur_rate
+    idx = np.searchsorted(f64(tariff.duty_new_price_upper), price_eur, side='left')
+    duty_new = np.maximum(price_rub * f64(tariff.duty_new_percent)[idx],
+                          f64(tariff.duty_new_min_eur_per_cc)[idx] * eur_rate * volume)
+    idx = np.searchsorted(f64(tariff.duty_3_5_volume_upper), volume, side='left')
+    duty_3_5 = f64(tariff.duty_3_5_eur_per_cc)[idx] * volume * eur_rate
+    idx = np.searchsorted(f64(tariff.duty_over_5_volume_upper), volume, side='left')
+    duty_old = f64(tariff.duty_over_5_eur_per_cc)[idx] * volume * eur_rate
+    duty_private = np.where(is_new, duty_new, np.where(age_months <= 60, duty_3_5, duty_old))
+    duty = np.where(
+        is_electric,
+        price_rub * tariff.electric_duty_rate,
+        np.where(is_private, duty_private, price_rub * tariff.legal_duty_rate)
+    )
+
+    # Утильсбор
+    idx = np.searchsorted(f64(tariff.recycling_volume_upper), volume, side='left')
+    coefficient = np.where(is_new, f64(tariff.recycling_coef_new)[idx], f64(tariff.recycling_coef_old)[idx])
+    recycling_ice = np.where(
+        is_private & (volume <= tariff.recycling_individual_max_volume),
+        np.where(is_new, float(tariff.recycling_individual_new), float(tariff.recycling_individual_old)),
+        tariff.recycling_base_legal * coefficient
+    )
+    recycling_electric = np.where(
+        is_private,
+        np.where(is_new, float(tariff.recycling_electric_individual_new), float(tariff.recycling_electric_individual_old)),
+        np.where(is_new, float(tariff.recycling_electric_legal_new), float(tariff.recycling_electric_legal_old))
+    )
+    recycling = np.where(is_electric, recycling_electric, recycling_ice)
+
+    # Акциз
+    engine_power_hp = np.where(is_electric, power * KW_TO_HP, power)
+    idx = np.searchsorted(f64(tariff.excise_electric_upper), engine_power_hp, side='left')
+    excise_rate = np.where(is_electric,
+                           np.where(engine_power_hp > 0, f64(tariff.excise_electric_rates)[idx], 0.0),
+                           float(tariff.excise_rate_per_hp))
+    excise = np.where(
+        is_electric,
+        np.where(engine_power_hp > 0, engine_power_hp * excise_rate, 0.0),
+        np.where(is_individual, 0.0, engine_power_hp * tariff.excise_rate_per_hp)
+    )
+
+    # НДС и итог
+    vat_base = price_rub + duty + excise
+    vat = np.where(is_electric | ~is_individual, vat_base * tariff.vat_rate, 0.0)
+    total = price_rub + duty + recycling + vat + excise + DELIVERY_COST + CUSTOMS_CLEARANCE
+
+    return {
+        'price_rub': price_rub,
+        'engine_power_hp': engine_power_hp,
+        'excise_rate': excise_rate,
+        'duty': duty,
+        'excise': excise,
+        'vat': vat,
+        'recycling': recycling,
+        'total': total
+    }
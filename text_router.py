@@ -0,0 +1,81 @@
+import logging
+
+from aiogram.dispatcher.event.handler import CallableMixin
+from aiogram.filters import Filter
+from aiogram.types import KeyboardButton, Message, ReplyKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+
+# Reply-клавиатура и индекс ее кнопок из одного описания: ряды пар
+# (текст кнопки, значение). Обработчики узнают значение нажатой кнопки по
+# индексу, поэтому тексты кнопок не повторяются в проверках и не расходятся
+# с клавиатурой. Разметка собирается один раз.
+class Keyboard:
+    def __init__(self, rows, **markup):
+        self.rows = tuple(tuple(row) for row in rows)
+        self.index = {text: value for row in self.rows for text, value in row}
+        self.markup = ReplyKeyboardMarkup(
+            keyboard=[[KeyboardButton(text=text) for text, _ in row] for row in self.rows],
+            **markup
+        )
+
+    def __call__(self) -> ReplyKeyboardMarkup:
+        return self.markup
+
+    # Значение кнопки с таким текстом; default - текст не с этой клавиатуры
+    def value(self, text: str, default=None):
+        return self.index.get(text, default)
+
+
+# Маршрутизация кнопок меню одним поиском в словаре вместо цепочки фильтров
+# m.text == "...". Тексты берутся из клавиатур (include), обработчики
+# привязываются к значениям кнопок декоратором action. В aiogram router
+# регистрируется фильтром единственного обработчика dispatch. Фильтр
+# асинхронный: синхронные фильтры aiogram выполняет в пуле потоков.
+# Во время анкеты (есть состояние FSM) срабатывают только действия с
+# any_state=True, остальные тексты достаются обработчикам шагов анкеты.
+class TextRouter(Filter):
+    def __init__(self):
+        self._texts = {}
+        self._actions = {}
+        self.routed = 0
+        self.passed = 0
+
+    def include(self, keyboard: Keyboard):
+        for text, action in keyboard.index.items():
+            if action is not None:
+                self._texts[text] = action
+
+    def action(self, name: str, any_state: bool = False):
+        def decorator(callback):
+            self._actions[name] = (CallableMixin(callback), any_state)
+            return callback
+        return decorator
+
+    # Каждой кнопке меню должен соответствовать обработчик
+    def validate(self):
+        missing = sorted({action for action in self._texts.values() if action not in self._actions})
+        if missing:
+            raise ValueError(f"Нет обработчиков для кнопок меню: {', '.join(map(str, missing))}")
+        logger.info(f"Маршрутизатор меню: {len(self._texts)} кнопок, {len(self._actions)} действий")
+
+    # Фильтр aiogram: выбранный обработчик передается в dispatch как text_route
+    async def __call__(self, message: Message, raw_state=None):
+        route = self._actions.get(self._texts.get(message.text))
+        if route is None or (raw_state is not None and not route[1]):
+            self.passed += 1
+            return False
+        self.routed += 1
+        return {'text_route': route[0]}
+
+    @staticmethod
+    async def dispatch(message: Message, text_route: CallableMixin, **data):
+        return await text_route.call(message, **data)
+
+    def stats(self) -> dict:
+        return {
+            'buttons': len(self._texts),
+            'routed': self.routed,
+            'passed': self.passed,
+        }
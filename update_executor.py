@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+UPDATE_QUEUE_WAIT = Histogram(
+    "bot_update_queue_wait_seconds", "Ожидание обновления в очереди чата до начала обработки"
+)
+UPDATES_QUEUED = Gauge("bot_updates_queued", "Обновления в очередях чатов")
+UPDATES_RUNNING = Gauge("bot_updates_running", "Обновления в обработке")
+UPDATES_SHED = Counter("bot_updates_shed_total", "Обновления, отклоненные из-за перегрузки", ["reason"])
+
+
+class _ChatQueue:
+    __slots__ = ("lock", "size")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.size = 0
+
+
+# Исполнитель обновлений: обновления одного чата обрабатываются строго по очереди,
+# разные чаты - параллельно, но не больше concurrency одновременно.
+# Очереди ограничены: при переполнении очереди чата или общей очереди
+# обновление отбрасывается, а пользователь получает короткий ответ "бот занят".
+# Должен стоять до FSM middleware, чтобы состояние анкеты читалось уже в очереди.
+class UpdateExecutor(BaseMiddleware):
+    def __init__(self, concurrency: int = 64, max_chat_queue: int = 5, max_queued: int = 1000,
+                 busy_text: str = "⏳ Бот сейчас перегружен, попробуйте через несколько секунд.",
+                 busy_interval: float = 10):
+        self.concurrency = concurrency
+        self.max_chat_queue = max_chat_queue
+        self.max_queued = max_queued
+        self.busy_text = busy_text
+        self.busy_interval = busy_interval
+
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._chats = {}
+        self._busy_sent_at = {}
+        self._tasks = set()
+
+        self.queued = 0
+        self.running = 0
+        self.processed = 0
+        self.shed = 0
+
+    @staticmethod
+    def _chat_key(data: Dict[str, Any]):
+        chat = data.get("event_chat")
+        if chat is not None:
+            return chat.id
+        user = data.get("event_from_user")
+        return user.id if user is not None else None
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        key = self._chat_key(data)
+        if key is None:
+            async with self._semaphore:
+                return await handler(event, data)
+        queue = self._chats.get(key)
+
+        if self.queued >= self.max_queued:
+            return self._shed(event, data, "global")
+        if queue is not None and queue.size >= self.max_chat_queue:
+            return self._shed(event, data, "chat")
+
+        if queue is None:
+            queue = self._chats[key] = _ChatQueue()
+        queue.size += 1
+        self.queued += 1
+        UPDATES_QUEUED.inc()
+        started = time.perf_counter()
+        waiting = True
+        try:
+            async with queue.lock:
+                async with self._semaphore:
+                    waiting = False
+                    self.queued -= 1
+                    UPDATES_QUEUED.dec()
+                    UPDATE_QUEUE_WAIT.observe(time.perf_counter() - started)
+
+                    self.running += 1
+                    UPDATES_RUNNING.inc()
+                    try:
+                        return await handler(event, data)
+                    finally:
+                        self.running -= 1
+                        self.processed += 1
+                        UPDATES_RUNNING.dec()
+        finally:
+            if waiting:
+                self.queued -= 1
+                UPDATES_QUEUED.dec()
+            queue.size -= 1
+            if queue.size == 0 and self._chats.get(key) is queue:
+                del self._chats[key]
+
+    def _shed(self, event: TelegramObject, data: Dict[str, Any], reason: str):
+        self.shed += 1
+        UPDATES_SHED.labels(reason).inc()
+        if isinstance(event, Update):
+            task = asyncio.create_task(self._reply_busy(event, data))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return None
+
+    # Ответ "бот занят" - не чаще раза в busy_interval секунд на чат
+    async def _reply_busy(self, update: Update, data: Dict[str, Any]):
+        key = self._chat_key(data)
+        now = time.monotonic()
+        if now - self._busy_sent_at.get(key, float("-inf")) < self.busy_interval:
+            return
+        self._busy_sent_at[key] = now
+        if len(self._busy_sent_at) > 10000:
+            self._busy_sent_at = {
+                chat: sent_at for chat, sent_at in self._busy_sent_at.items()
+                if now - sent_at < self.busy_interval
+            }
+
+        bot = data["bot"]
+        try:
+            if update.message is not None:
+                await bot.send_message(update.message.chat.id, self.busy_text)
+            elif update.callback_query is not None:
+                await bot.answer_callback_query(update.callback_query.id, self.busy_text)
+        except Exception as e:
+            logger.warning(f"Не удалось отправить ответ о перегрузке: {e}")
+
+    def stats(self) -> dict:
+        return {
+            'concurrency': self.concurrency,
+            'queued': self.queued,
+            'running': self.running,
+            'chats': len(self._chats),
+            'processed': self.processed,
+            'shed': self.shed,
+        }
@@ -0,0 +1,105 @@
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# Аудитории рассылок: все пользователи или подписавшиеся на изменение курса
+AUDIENCES = ("all", "rate_alerts")
+
+
+# Реестр пользователей для рассылок.
+# Одна строка на личный чат (chat_id - ключ таблицы, он же rowid), поэтому
+# выборка получателей по возрастанию chat_id идет прямо по B-дереву и легко
+# продолжается с любого места. Заблокировавшие бота помечаются и не получают
+# рассылок, пока снова не нажмут /start.
+class UserRegistry:
+    def __init__(self, path: str = "users.sqlite3"):
+        self.path = path
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            " chat_id INTEGER PRIMARY KEY,"
+            " user_id INTEGER NOT NULL,"
+            " first_seen REAL NOT NULL,"
+            " last_seen REAL NOT NULL,"
+            " blocked_at REAL,"
+            " rate_alerts INTEGER NOT NULL DEFAULT 0)"
+        )
+        # Подписчики на курс - малая часть пользователей, частичный индекс
+        # позволяет не просматривать всю таблицу
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS users_rate_alerts ON users (chat_id) "
+            "WHERE rate_alerts = 1 AND blocked_at IS NULL"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    # Пользователь нажал /start: добавляется или снова становится активным
+    def touch(self, chat_id: int, user_id: int):
+        now = time.time()
+        self._db.execute(
+            "INSERT INTO users (chat_id, user_id, first_seen, last_seen) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET user_id = excluded.user_id, "
+            "last_seen = excluded.last_seen, blocked_at = NULL",
+            (chat_id, user_id, now, now)
+        )
+
+    def set_rate_alerts(self, chat_id: int, enabled: bool) -> bool:
+        return self._db.execute(
+            "UPDATE users SET rate_alerts = ? WHERE chat_id = ?", (int(enabled), chat_id)
+        ).rowcount > 0
+
+    def rate_alerts_enabled(self, chat_id: int) -> bool:
+        row = self._db.execute("SELECT rate_alerts FROM users WHERE chat_id = ?", (chat_id,)).fetchone()
+        return bool(row and row[0])
+
+    def mark_blocked(self, chat_ids):
+        now = time.time()
+        self._db.executemany(
+            "UPDATE users SET blocked_at = ? WHERE chat_id = ?", [(now, chat_id) for chat_id in chat_ids]
+        )
+
+    @staticmethod
+    def _audience_filter(audience: str) -> str:
+        if audience == "all":
+            return "blocked_at IS NULL"
+        if audience == "rate_alerts":
+            return "rate_alerts = 1 AND blocked_at IS NULL"
+        raise ValueError(f"Неизвестная аудитория рассылки: {audience}")
+
+    # Следующая страница получателей после chat_id after
+    def recipients(self, audience: str, after: int = None, limit: int = 500) -> list:
+        rows = self._db.execute(
+            f"SELECT chat_id FROM users WHERE {self._audience_filter(audience)} AND chat_id > ? "
+            f"ORDER BY chat_id LIMIT ?",
+            (after if after is not None else -(1 << 63), limit)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self, audience: str = "all") -> int:
+        return self._db.execute(
+            f"SELECT COUNT(*) FROM users WHERE {self._audience_filter(audience)}"
+        ).fetchone()[0]
+
+    def get_meta(self, key: str):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        self._db.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+
+    def stats(self) -> dict:
+        total, blocked, rate_alerts = self._db.execute(
+            "SELECT COUNT(*), COUNT(blocked_at), "
+            "COALESCE(SUM(rate_alerts = 1 AND blocked_at IS NULL), 0) FROM users"
+        ).fetchone()
+        return {'users': total, 'blocked': blocked, 'rate_alerts': rate_alerts}
+
+    def close(self):
+        self._db.close()